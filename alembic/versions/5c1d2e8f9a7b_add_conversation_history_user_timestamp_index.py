@@ -0,0 +1,41 @@
+"""add conversation history user/timestamp index
+
+Revision ID: 5c1d2e8f9a7b
+Revises: ea83e5156362
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c1d2e8f9a7b'
+down_revision: Union[str, Sequence[str], None] = 'ea83e5156362'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Build the index without locking writes on large Postgres tables
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_conversation_history_user_id_timestamp',
+            'conversation_history',
+            ['user_id', sa.text('timestamp DESC')],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_conversation_history_user_id_timestamp',
+            table_name='conversation_history',
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,29 @@
+"""add conversation history token count
+
+Revision ID: 8e4a6b2c0d13
+Revises: 5c1d2e8f9a7b
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e4a6b2c0d13'
+down_revision: Union[str, Sequence[str], None] = '5c1d2e8f9a7b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing rows stay NULL; their token counts are estimated when loaded
+    op.add_column('conversation_history', sa.Column('token_count', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('conversation_history', 'token_count')
@@ -0,0 +1,118 @@
+"""partition conversation history by month
+
+Optional: only runs on Postgres with HISTORY_PARTITIONING=true, otherwise it
+is recorded without changing anything. The retention job then creates future
+partitions and drops months older than HISTORY_MAX_AGE_DAYS as a whole.
+
+Revision ID: f4b9e2a7c3d1
+Revises: d3a8c5f1b962
+Create Date: 2026-10-18 15:10:00.000000
+
+"""
+import os
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4b9e2a7c3d1'
+down_revision: Union[str, Sequence[str], None] = 'd3a8c5f1b962'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = 'id, user_id, timestamp, role, content, bot_name, attachments, token_count'
+
+COLUMN_DEFINITIONS = """
+    id INTEGER NOT NULL DEFAULT nextval('conversation_history_id_seq'),
+    user_id BIGINT NOT NULL,
+    timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    role VARCHAR(50) NOT NULL,
+    content TEXT NOT NULL,
+    bot_name VARCHAR(255) NOT NULL,
+    attachments JSON,
+    token_count INTEGER
+"""
+
+
+def enabled() -> bool:
+    return (
+        op.get_context().dialect.name == 'postgresql'
+        and os.getenv('HISTORY_PARTITIONING', 'false').lower() == 'true'
+    )
+
+
+def set_aside(suffix: str) -> None:
+    """Rename the current table and the names that would clash with its replacement."""
+    op.execute(f'ALTER TABLE conversation_history RENAME TO conversation_history_{suffix}')
+    op.execute(
+        f'ALTER TABLE conversation_history_{suffix} '
+        f'RENAME CONSTRAINT conversation_history_pkey TO conversation_history_{suffix}_pkey'
+    )
+    op.execute(
+        'ALTER INDEX ix_conversation_history_user_id_timestamp '
+        f'RENAME TO ix_conversation_history_{suffix}_user_id_timestamp'
+    )
+
+
+def replace(suffix: str) -> None:
+    """Move the rows and the id sequence over from the set-aside table, then drop it."""
+    op.execute('ALTER SEQUENCE conversation_history_id_seq OWNED BY conversation_history.id')
+    op.execute(
+        f'INSERT INTO conversation_history ({COLUMNS}) '
+        f'SELECT {COLUMNS} FROM conversation_history_{suffix}'
+    )
+    op.execute(f'DROP TABLE conversation_history_{suffix}')
+    op.execute(
+        'CREATE INDEX ix_conversation_history_user_id_timestamp '
+        'ON conversation_history (user_id, timestamp DESC)'
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not enabled():
+        return
+
+    set_aside('unpartitioned')
+    # The partition key has to be part of the primary key
+    op.execute(
+        f'CREATE TABLE conversation_history ({COLUMN_DEFINITIONS}, PRIMARY KEY (id, timestamp)) '
+        'PARTITION BY RANGE (timestamp)'
+    )
+    # One partition per month from the oldest message to two months ahead
+    op.execute("""
+    DO $$
+    DECLARE
+        month date;
+    BEGIN
+        FOR month IN SELECT generate_series(
+            date_trunc('month', coalesce(
+                (SELECT min(timestamp) FROM conversation_history_unpartitioned), now()
+            )),
+            date_trunc('month', now()) + interval '2 months',
+            interval '1 month'
+        )::date
+        LOOP
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF conversation_history FOR VALUES FROM (%L) TO (%L)',
+                'conversation_history_p' || to_char(month, 'YYYYMM'),
+                month,
+                (month + interval '1 month')::date
+            );
+        END LOOP;
+    END $$
+    """)
+    # Catches rows outside the monthly partitions if the retention job falls behind
+    op.execute('CREATE TABLE conversation_history_default PARTITION OF conversation_history DEFAULT')
+    replace('unpartitioned')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not enabled():
+        return
+
+    set_aside('partitioned')
+    op.execute(f'CREATE TABLE conversation_history ({COLUMN_DEFINITIONS}, PRIMARY KEY (id))')
+    replace('partitioned')
@@ -0,0 +1,134 @@
+"""
+Shared fakes for the benchmark scripts.
+
+Benchmarks run fully offline: Poe is replaced by a local token stream and
+Telegram objects by light stand-ins that only record what was sent. The
+database is whatever BENCHMARK_DATABASE_URL points at, defaulting to
+in-memory SQLite. DATABASE_URL is ignored on purpose: several benchmarks
+drop all tables, which must never happen to the bot's own database.
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+from typing import Any
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if os.environ.get("BENCHMARK_DATABASE_URL", "") == os.environ.get("DATABASE_URL"):
+    sys.exit("BENCHMARK_DATABASE_URL must not be the bot's DATABASE_URL: use a scratch database")
+os.environ["DATABASE_URL"] = os.environ.get(
+    "BENCHMARK_DATABASE_URL", "sqlite+aiosqlite:///:memory:"
+)
+os.environ.setdefault("POE_API_KEY", "benchmark")
+os.environ.setdefault("TELEGRAM_TOKEN", "benchmark")
+# Measure throughput, not the rate limits
+os.environ.setdefault("USER_RATE_PER_MINUTE", "0")
+os.environ.setdefault("BOT_RATE_PER_MINUTE", "0")
+
+import fastapi_poe as fp  # noqa: E402
+
+
+def install_fake_poe(
+    tokens: int = 50, token_delay: float = 0.01, token_text: str = "word "
+) -> None:
+    """Replace `fp.stream_request` with a local stream of fixed-size tokens."""
+
+    async def fake_stream_request(*_args: Any, **_kwargs: Any):
+        for _ in range(tokens):
+            await asyncio.sleep(token_delay)
+            yield fp.PartialResponse(text=token_text)
+
+    fp.stream_request = fake_stream_request  # type: ignore
+
+
+class FakeMessage:
+    """Minimal stand-in for `telegram.Message` that records replies."""
+
+    _next_id = 0
+
+    def __init__(self, chat_id: int, text: str):
+        FakeMessage._next_id += 1
+        self.message_id = FakeMessage._next_id
+        self.chat_id = chat_id
+        self.text = text
+        self.caption = None
+        self.photo: list = []
+        self.document = None
+        self.media_group_id = None
+        self.replies: list[str] = []
+
+    async def reply_text(self, text: str, **_kwargs: Any) -> "FakeMessage":
+        self.replies.append(text)
+        return FakeMessage(self.chat_id, text)
+
+    async def edit_text(self, text: str, **_kwargs: Any) -> "FakeMessage":
+        self.text = text
+        return self
+
+    async def reply_document(self, document: Any, **kwargs: Any) -> "FakeMessage":
+        self.replies.append(kwargs.get("caption") or "")
+        reply = FakeMessage(self.chat_id, "")
+        reply.document = document
+        return reply
+
+
+class FakeBot:
+    """Minimal stand-in for `telegram.Bot`."""
+
+    async def send_chat_action(self, **_kwargs: Any) -> bool:
+        return True
+
+    async def edit_message_text(self, text: str, **_kwargs: Any) -> bool:
+        return True
+
+
+def make_update(user_id: int, text: str) -> tuple[Any, Any]:
+    """Build an (update, context) pair for a plain text message."""
+    message = FakeMessage(chat_id=user_id, text=text)
+    user = SimpleNamespace(id=user_id, username=f"user{user_id}")
+    update = SimpleNamespace(
+        update_id=message.message_id,
+        effective_user=user,
+        message=message,
+        effective_message=message,
+        effective_chat=SimpleNamespace(id=user_id),
+    )
+    context = SimpleNamespace(bot=FakeBot(), user_data={}, args=[])
+    return update, context
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile of `samples`."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: list[float], elapsed: float) -> dict[str, float]:
+    """Summarize latencies in milliseconds alongside overall throughput."""
+    return {
+        "requests": len(latencies),
+        "throughput_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def print_summary(title: str, summary: dict[str, float]) -> None:
+    print(f"\n{title}")
+    for key, value in summary.items():
+        print(f"  {key:>18}: {value:,.2f}")
+
+
+async def timed(coro: Any) -> float:
+    """Await `coro` and return how long it took in seconds."""
+    start = time.perf_counter()
+    await coro
+    return time.perf_counter() - start
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark delivering complete (non-streamed) responses of growing size.
+
+Compares the old policy, one message per chunk with a fixed 0.5 s pause in
+between, against `deliver_response`, which sends short answers as messages
+back to back and long ones as a preview plus a Markdown file. Each Bot API
+call is given a simulated round trip of --latency milliseconds.
+
+    poetry run python benchmarks/delivery.py --latency 80
+"""
+
+import asyncio
+import time
+from argparse import ArgumentParser
+from typing import Any
+
+import common
+
+from poe_tg.delivery import deliver_response
+from poe_tg.formatting import render_chunks, reply_formatted
+
+PARAGRAPH = "The quick brown fox jumps over the **lazy** dog. " * 8
+
+
+class SlowMessage(common.FakeMessage):
+    """FakeMessage whose replies take a fixed round trip."""
+
+    latency = 0.0
+
+    async def reply_text(self, text: str, **kwargs: Any) -> common.FakeMessage:
+        await asyncio.sleep(self.latency)
+        return await super().reply_text(text, **kwargs)
+
+    async def reply_document(self, document: Any, **kwargs: Any) -> common.FakeMessage:
+        await asyncio.sleep(self.latency)
+        # Read it like the upload would
+        document.input_file_content
+        return await super().reply_document(document, **kwargs)
+
+
+async def deliver_with_fixed_pause(message: common.FakeMessage, text: str) -> None:
+    chunks = render_chunks(text)
+    for chunk in chunks:
+        await reply_formatted(message, chunk)
+        if len(chunks) > 1:
+            await asyncio.sleep(0.5)
+
+
+async def measure(deliver: Any, text: str) -> tuple[float, int]:
+    message = SlowMessage(chat_id=1, text="")
+    start = time.perf_counter()
+    await deliver(message, text)
+    return time.perf_counter() - start, len(message.replies)
+
+
+async def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=80, help="Bot API round trip (ms)")
+    parser.add_argument("--sizes", default="2000,8000,16000,40000")
+    args = parser.parse_args()
+    SlowMessage.latency = args.latency / 1000
+
+    print(f"{'chars':>8} {'policy':>12} {'messages':>9} {'seconds':>8}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        text = "\n\n".join([PARAGRAPH] * (size // len(PARAGRAPH) + 1))[:size]
+        for name, deliver in (
+            ("fixed pause", deliver_with_fixed_pause),
+            ("delivery", deliver_response),
+        ):
+            elapsed, messages = await measure(deliver, text)
+            print(f"{size:>8} {name:>12} {messages:>9} {elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
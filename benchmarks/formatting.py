@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark the Markdown to Telegram HTML rendering that runs on every response.
+
+Renders synthetic model outputs of growing size, including adversarial ones
+(thousands of unmatched "*", "[" and "`" on one line), to show the time grows
+linearly. Also checks that every rendered chunk has properly nested tags,
+stays within Telegram's entity limit and shows no more text than the limit.
+
+    poetry run python benchmarks/formatting.py --size 100000
+"""
+
+import random
+import time
+from argparse import ArgumentParser
+from html.parser import HTMLParser
+
+import common  # noqa: F401
+
+from poe_tg import config
+from poe_tg.formatting import count_entities, markdown_to_html, render_chunks
+
+WORDS = "the **quick** brown `fox` jumps _over_ a [lazy](https://example.com) dog".split()
+
+
+class TagChecker(HTMLParser):
+    """Verify tags nest properly and collect the text Telegram would show."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack: list[str] = []
+        self.text: list[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        assert self.stack and self.stack.pop() == tag, f"misnested </{tag}>"
+
+    def handle_data(self, data):
+        self.text.append(data)
+
+
+def model_output(rng: random.Random, size: int) -> str:
+    parts: list[str] = []
+    length = 0
+    while length < size:
+        kind = rng.random()
+        if kind < 0.1:
+            body = "\n".join(
+                "    " + " ".join(rng.choices(WORDS, k=8)) for _ in range(rng.randint(2, 30))
+            )
+            part = f"```python\n{body}\n```"
+        elif kind < 0.15:
+            part = "| a | b |\n|---|---|\n" + "\n".join(
+                f"| {i} | {rng.choice(WORDS)} |" for i in range(rng.randint(1, 10))
+            )
+        elif kind < 0.3:
+            part = "\n".join(f"- {' '.join(rng.choices(WORDS, k=6))}" for _ in range(5))
+        else:
+            part = " ".join(rng.choices(WORDS, k=rng.randint(5, 200)))
+        parts.append(part)
+        length += len(part) + 2
+    return "\n\n".join(parts)
+
+
+def adversarial(size: int) -> dict[str, str]:
+    return {
+        "unmatched *": "*a " * (size // 3),
+        "unmatched [": "[a " * (size // 3),
+        "unmatched `": "`a " * (size // 3),
+        "nested": "**_~~" * (size // 5),
+    }
+
+
+def time_render(text: str, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        markdown_to_html(text)
+    return (time.perf_counter() - start) / repeat
+
+
+def check(text: str) -> None:
+    for chunk in render_chunks(text):
+        if chunk.html is None:
+            continue
+        checker = TagChecker()
+        checker.feed(chunk.html)
+        checker.close()
+        assert not checker.stack, f"unclosed {checker.stack}"
+        assert count_entities(chunk.html) <= config.TELEGRAM_MAX_ENTITIES
+        assert len("".join(checker.text)) <= config.TELEGRAM_MESSAGE_LIMIT
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--checks", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for size in (args.size // 10, args.size, args.size * 10):
+        texts = {"model output": model_output(rng, size), **adversarial(size)}
+        for name, text in texts.items():
+            elapsed = time_render(text, args.repeat)
+            print(
+                f"{name:>13}: {len(text):>9,} characters in {elapsed * 1000:8.2f} ms "
+                f"({len(text) / elapsed / 1e6:.1f} M chars/s)"
+            )
+
+    for _ in range(args.checks):
+        check(model_output(rng, rng.randint(100, 50_000)))
+    for text in adversarial(20_000).values():
+        check(text)
+    print(f"{args.checks} random outputs rendered to valid chunks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Measure `handle_message` latency with many chats talking at once.
+
+Each simulated chat sends its messages one after another while all chats run
+concurrently, the way the bot sees traffic in production. A heartbeat task
+measures event loop lag: with a blocking data layer it grows with every query,
+with the async layer it stays near zero.
+
+    poetry run python benchmarks/handler_latency.py --chats 200 --messages 5
+"""
+
+import asyncio
+import time
+from argparse import ArgumentParser
+
+from common import install_fake_poe, make_update, print_summary, summarize, timed
+
+from poe_tg.db.database import close_db, init_db
+from poe_tg.telegram_handler import handle_message
+
+
+async def heartbeat(lags: list[float], interval: float = 0.01) -> None:
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def chat(user_id: int, messages: int, latencies: list[float]) -> None:
+    for i in range(messages):
+        update, context = make_update(user_id, f"message {i} from {user_id}")
+        latencies.append(await timed(handle_message(update, context)))
+
+
+async def run(chats: int, messages: int) -> None:
+    await init_db()
+    latencies: list[float] = []
+    lags: list[float] = []
+    monitor = asyncio.create_task(heartbeat(lags))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(chat(1000 + i, messages, latencies) for i in range(chats)))
+    elapsed = time.perf_counter() - start
+
+    monitor.cancel()
+    await close_db()
+
+    print_summary(f"handle_message latency ({chats} chats)", summarize(latencies, elapsed))
+    print_summary("event loop lag", summarize(lags, elapsed))
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    args = parser.parse_args()
+
+    install_fake_poe(tokens=args.tokens, token_delay=args.token_delay)
+    asyncio.run(run(args.chats, args.messages))
+
+
+if __name__ == "__main__":
+    main()
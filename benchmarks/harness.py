@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test of the handlers registered by `setup_handlers`.
+
+A real `Application` processes synthetic `Update`s arriving at a target rate,
+the way webhook updates go through the update processor. Nothing leaves the
+process: Poe is a local token stream (--tokens, --token-delay, --token-text)
+and the Bot API is answered by a stub request class with a fixed round trip
+(--api-latency). The database is a fresh temporary SQLite file unless
+BENCHMARK_DATABASE_URL is set.
+
+Reports throughput, end-to-end latency percentiles (from an update's
+scheduled arrival until its handler returns), SQL statements per message,
+Bot API calls per message and memory growth measured with tracemalloc. The
+results are saved as JSON, together with the commit they were measured on,
+and --compare prints the change against an earlier run.
+
+    poetry run python benchmarks/harness.py --rate 50 --duration 20
+    poetry run python benchmarks/harness.py --compare benchmarks/results/abc1234.json
+"""
+
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from collections import Counter
+from datetime import datetime
+from typing import Any, Optional
+
+DATABASE_FILE = os.path.join(tempfile.gettempdir(), "poe_tg_harness.db")
+if "BENCHMARK_DATABASE_URL" not in os.environ:
+    if os.path.exists(DATABASE_FILE):
+        os.remove(DATABASE_FILE)
+    # In-memory SQLite cannot run concurrent transactions on its single connection
+    os.environ["BENCHMARK_DATABASE_URL"] = f"sqlite+aiosqlite:///{DATABASE_FILE}"
+
+from common import install_fake_poe, summarize  # noqa: E402
+
+from sqlalchemy import event  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import Application, ApplicationBuilder  # noqa: E402
+from telegram.request import BaseRequest, RequestData  # noqa: E402
+
+from poe_tg import config  # noqa: E402
+from poe_tg.db.database import close_db, engine, history_writer, init_db  # noqa: E402
+from poe_tg.telegram_handler import setup_handlers  # noqa: E402
+from poe_tg.update_processor import ChatOrderedUpdateProcessor  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Harness", "username": "harness_bot"}
+
+
+class StubBotAPI(BaseRequest):
+    """Answers Bot API calls locally after a fixed delay, counting them by method."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self.next_message_id = 1_000_000
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        *_args: Any,
+        **_kwargs: Any,
+    ) -> tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        parameters = request_data.parameters if request_data else {}
+        return 200, json.dumps({"ok": True, "result": self.result(endpoint, parameters)}).encode()
+
+    def result(self, endpoint: str, parameters: dict[str, Any]) -> Any:
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint in ("sendMessage", "editMessageText", "sendDocument"):
+            if endpoint != "editMessageText":
+                self.next_message_id += 1
+            message = {
+                "message_id": parameters.get("message_id", self.next_message_id),
+                "date": int(time.time()),
+                "chat": {"id": parameters.get("chat_id", 0), "type": "private"},
+                "from": BOT_USER,
+            }
+            if endpoint == "sendDocument":
+                message["document"] = {"file_id": "document", "file_unique_id": "document"}
+                message["caption"] = parameters.get("caption", "")
+            else:
+                message["text"] = parameters.get("text", "")
+            return message
+        return True
+
+
+def make_update(update_id: int, chat_id: int, text: str, bot: Any) -> Update:
+    user = {"id": chat_id, "is_bot": False, "first_name": "User", "username": f"user{chat_id}"}
+    data = {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": user,
+            "text": text,
+        },
+    }
+    return Update.de_json(data, bot)
+
+
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.count += 1
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def drive(application: Application, updates: list[Update], rate: float) -> list[float]:
+    """Feed updates at `rate` per second and return each one's end-to-end latency."""
+    latencies: list[float] = []
+    processor = application.update_processor
+
+    async def handle(update: Update, arrival: float) -> None:
+        await processor.process_update(update, application.process_update(update))
+        latencies.append(time.perf_counter() - arrival)
+
+    tasks = []
+    start = time.perf_counter()
+    for i, update in enumerate(updates):
+        arrival = start + i / rate
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(handle(update, arrival)))
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+async def run(args: Any) -> dict[str, Any]:
+    api = StubBotAPI(args.api_latency / 1000)
+    application = (
+        ApplicationBuilder()
+        .token("123456:harness")
+        .request(api)
+        .get_updates_request(StubBotAPI())
+        .updater(None)
+        .concurrent_updates(ChatOrderedUpdateProcessor())
+        .build()
+    )
+    setup_handlers(application)
+
+    await init_db()
+    if config.HISTORY_WRITE_BEHIND:
+        await history_writer.start()
+
+    statements = 0
+
+    def on_execute(*_args: Any) -> None:
+        nonlocal statements
+        statements += 1
+
+    event.listen(engine.sync_engine, "before_cursor_execute", on_execute)
+    errors = ErrorCounter()
+    config.logger.addHandler(errors)
+
+    total = int(args.rate * args.duration)
+    updates = [
+        make_update(i + 1, 1000 + i % args.chats, f"message {i}", application.bot)
+        for i in range(total)
+    ]
+
+    async with application:
+        # Warm up: every chat's first message creates its preference row
+        warmup = [
+            make_update(total + i + 1, 1000 + i, "hello", application.bot)
+            for i in range(args.chats)
+        ]
+        await drive(application, warmup, args.rate)
+        await history_writer.flush()
+
+        if args.tracemalloc:
+            tracemalloc.start()
+            memory_before = tracemalloc.get_traced_memory()[0]
+        statements = 0
+        api.calls.clear()
+        errors.count = 0
+
+        start = time.perf_counter()
+        latencies = await drive(application, updates, args.rate)
+        await history_writer.flush()
+        elapsed = time.perf_counter() - start
+
+        memory: dict[str, float] = {}
+        if args.tracemalloc:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            memory = {
+                "memory_growth_mb": (current - memory_before) / 2**20,
+                "memory_peak_mb": (peak - memory_before) / 2**20,
+            }
+
+    event.remove(engine.sync_engine, "before_cursor_execute", on_execute)
+    config.logger.removeHandler(errors)
+    await history_writer.stop()
+    await close_db()
+
+    summary = summarize(latencies, elapsed)
+    return {
+        "commit": git_commit(),
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "database": engine.dialect.name,
+        "parameters": {
+            key: value for key, value in vars(args).items() if key not in ("output", "compare")
+        },
+        "results": {
+            "messages": len(latencies),
+            "messages_per_s": summary["throughput_per_s"],
+            "p50_ms": summary["p50_ms"],
+            "p95_ms": summary["p95_ms"],
+            "p99_ms": summary["p99_ms"],
+            "db_statements_per_message": statements / len(latencies),
+            "api_calls_per_message": sum(api.calls.values()) / len(latencies),
+            "errors": errors.count,
+            **memory,
+        },
+        "api_calls": dict(api.calls),
+    }
+
+
+def print_results(report: dict[str, Any], baseline: Optional[dict[str, Any]]) -> None:
+    print(f"\nCommit {report['commit']}, {report['database']}")
+    for key, value in report["results"].items():
+        line = f"  {key:>26}: {value:12,.2f}"
+        if baseline and key in baseline["results"]:
+            before = baseline["results"][key]
+            change = f"{(value - before) / before * 100:+.1f}%" if before else "n/a"
+            line += f"   (was {before:,.2f} at {baseline['commit']}, {change})"
+        print(line)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--rate", type=float, default=50, help="Messages per second")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of traffic")
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Seconds per token")
+    parser.add_argument("--token-text", default="word ")
+    parser.add_argument("--api-latency", type=float, default=20, help="Bot API round trip (ms)")
+    parser.add_argument(
+        "--no-tracemalloc",
+        dest="tracemalloc",
+        action="store_false",
+        help="Skip memory tracking, which slows Python down noticeably",
+    )
+    parser.add_argument("--output", help="JSON file to write (default: results/<commit>.json)")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    install_fake_poe(tokens=args.tokens, token_delay=args.token_delay, token_text=args.token_text)
+    report = asyncio.run(run(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_results(report, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"\nSaved to {output}")
+
+
+if __name__ == "__main__":
+    main()
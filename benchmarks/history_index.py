@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Measure the conversation history hot query with and without the
+(user_id, timestamp DESC) index.
+
+Seeds USERS x MESSAGES rows, then times `get_conversation_history` (which
+bypasses the in-process cache) for random users, first without the index and
+then with it. Point BENCHMARK_DATABASE_URL at a scratch Postgres database
+for numbers that match production; the tables are dropped at the end.
+
+    poetry run python benchmarks/history_index.py --users 1000 --messages 200
+"""
+
+import asyncio
+import random
+import time
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+
+from common import print_summary, summarize, timed
+
+from sqlalchemy import insert
+
+from poe_tg.db import database
+from poe_tg.db.models import Base, ConversationHistory
+
+INDEX = next(
+    index
+    for index in ConversationHistory.__table__.indexes
+    if index.name == "ix_conversation_history_user_id_timestamp"
+)
+
+
+async def seed(users: int, messages: int, batch: int = 5000) -> None:
+    start = datetime.now() - timedelta(days=30)
+    rows = (
+        {
+            "user_id": user_id,
+            "timestamp": start + timedelta(seconds=i * users + user_id),
+            "role": "user" if i % 2 == 0 else "bot",
+            "content": f"message {i} of user {user_id}",
+            "bot_name": "GPT-4o",
+            "attachments": [],
+        }
+        # Interleave users so their rows are spread over the whole table
+        for i in range(messages)
+        for user_id in range(users)
+    )
+    pending = []
+    async with database.engine.begin() as conn:
+        for row in rows:
+            pending.append(row)
+            if len(pending) == batch:
+                await conn.execute(insert(ConversationHistory), pending)
+                pending = []
+        if pending:
+            await conn.execute(insert(ConversationHistory), pending)
+
+
+async def measure(users: int, queries: int) -> list[float]:
+    return [
+        await timed(database.get_conversation_history(random.randrange(users)))
+        for _ in range(queries)
+    ]
+
+
+async def run(users: int, messages: int, queries: int) -> None:
+    async with database.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(INDEX.drop)
+
+    print(f"Seeding {users * messages:,} rows...")
+    await seed(users, messages)
+
+    start = time.perf_counter()
+    without_index = await measure(users, queries)
+    print_summary("Without index", summarize(without_index, time.perf_counter() - start))
+
+    async with database.engine.begin() as conn:
+        await conn.run_sync(INDEX.create)
+
+    start = time.perf_counter()
+    with_index = await measure(users, queries)
+    print_summary("With index", summarize(with_index, time.perf_counter() - start))
+
+    async with database.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await database.engine.dispose()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.users, args.messages, args.queries))
+
+
+if __name__ == "__main__":
+    main()
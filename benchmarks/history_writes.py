@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Count database commits for saving conversation history, with and without the
+write-behind history writer.
+
+Every chat runs MESSAGES exchanges through `get_poe_response` against the
+fake Poe backend, all chats at once. The report shows how many commits and
+INSERT statements were needed and checks that every exchange was stored.
+
+    poetry run python benchmarks/history_writes.py --chats 200 --messages 5
+"""
+
+import asyncio
+import time
+from argparse import ArgumentParser
+
+from common import install_fake_poe, make_update, print_summary, summarize, timed
+
+from sqlalchemy import event, func, select
+
+from poe_tg.db import database
+from poe_tg.db.models import Base, ConversationHistory
+from poe_tg.poe_client import get_poe_response
+
+
+async def run(chats: int, messages: int, write_behind: bool) -> None:
+    async with database.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    database.history_cache.clear()
+
+    counts = {"commits": 0, "inserts": 0}
+
+    def on_commit(*_args):
+        counts["commits"] += 1
+
+    def on_execute(_conn, _cursor, statement, *_args):
+        if statement.startswith("INSERT INTO conversation_history"):
+            counts["inserts"] += 1
+
+    event.listen(database.engine.sync_engine, "commit", on_commit)
+    event.listen(database.engine.sync_engine, "before_cursor_execute", on_execute)
+    if write_behind:
+        await database.history_writer.start()
+
+    async def chat(user_id: int) -> list[float]:
+        latencies = []
+        for i in range(messages):
+            update, context = make_update(user_id, f"message {i}")
+            latencies.append(await timed(get_poe_response(update, context)))
+        return latencies
+
+    # Create the preferences up front so only history writes are counted
+    for user_id in range(chats):
+        await database.get_user_preference(user_id)
+    counts.update(commits=0, inserts=0)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(chat(user_id) for user_id in range(chats)))
+    await database.history_writer.stop()
+    elapsed = time.perf_counter() - start
+
+    event.remove(database.engine.sync_engine, "commit", on_commit)
+    event.remove(database.engine.sync_engine, "before_cursor_execute", on_execute)
+
+    async with database.session_scope() as db:
+        stored = await db.scalar(select(func.count()).select_from(ConversationHistory))
+
+    summary = summarize([latency for result in results for latency in result], elapsed)
+    summary.update(counts)
+    summary["rows_stored"] = stored or 0
+    summary["rows_expected"] = chats * messages * 2
+    print_summary(f"Write-behind {'on' if write_behind else 'off'}, {chats} chats", summary)
+
+
+async def main_async(chats: int, messages: int) -> None:
+    await run(chats, messages, write_behind=False)
+    await run(chats, messages, write_behind=True)
+    await database.engine.dispose()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    args = parser.parse_args()
+
+    install_fake_poe(args.tokens, args.token_delay)
+    asyncio.run(main_async(args.chats, args.messages))
+
+
+if __name__ == "__main__":
+    main()
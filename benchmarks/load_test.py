@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Load test for the update processor with a fake Poe backend.
+
+Updates from many chats arrive interleaved, the way python-telegram-bot hands
+them over: every update is scheduled as its own task in arrival order. Each
+handler holds a Poe slot for a random, fake response time and records when it
+finished. The report covers throughput and how many updates finished before an
+earlier update of the same chat (ordering violations).
+
+    poetry run python benchmarks/load_test.py --chats 100 --messages 10
+    poetry run python benchmarks/load_test.py --processor simple  # no ordering
+"""
+
+import asyncio
+import random
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+
+from common import print_summary, summarize
+
+from telegram import Chat, Message, Update
+from telegram.ext import BaseUpdateProcessor, SimpleUpdateProcessor
+
+from poe_tg import poe_client
+from poe_tg.update_processor import ChatOrderedUpdateProcessor
+
+
+def make_updates(chats: int, messages: int) -> list[Update]:
+    updates = []
+    update_id = 0
+    for i in range(messages):
+        for chat_id in range(chats):
+            update_id += 1
+            chat = Chat(id=chat_id, type=Chat.PRIVATE)
+            message = Message(
+                message_id=i, date=datetime.now(), chat=chat, text=f"{chat_id}:{i}"
+            )
+            updates.append(Update(update_id=update_id, message=message))
+    return updates
+
+
+async def fake_poe_call(chat_id: int, min_latency: float, max_latency: float) -> None:
+    async with poe_client.poe_scheduler.slot(chat_id):
+        await asyncio.sleep(random.uniform(min_latency, max_latency))
+
+
+async def run(
+    processor: BaseUpdateProcessor,
+    chats: int,
+    messages: int,
+    min_latency: float,
+    max_latency: float,
+) -> None:
+    finished: dict[int, list[int]] = {}
+    latencies: list[float] = []
+
+    async def handle(update: Update, received: float) -> None:
+        assert update.message
+        await fake_poe_call(update.message.chat.id, min_latency, max_latency)
+        finished.setdefault(update.message.chat.id, []).append(update.message.message_id)
+        latencies.append(time.perf_counter() - received)
+
+    updates = make_updates(chats, messages)
+    start = time.perf_counter()
+    async with processor:
+        tasks = [
+            asyncio.create_task(
+                processor.process_update(update, handle(update, time.perf_counter()))
+            )
+            for update in updates
+        ]
+        await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    violations = sum(
+        1
+        for order in finished.values()
+        for earlier, later in zip(order, order[1:])
+        if later < earlier
+    )
+    summary = summarize(latencies, elapsed)
+    summary["ordering_violations"] = violations
+    print_summary(f"{type(processor).__name__}, {chats} chats", summary)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=10)
+    parser.add_argument("--min-latency", type=float, default=0.05)
+    parser.add_argument("--max-latency", type=float, default=0.5)
+    parser.add_argument(
+        "--processor",
+        choices=["chat-ordered", "sequential", "simple"],
+        default="chat-ordered",
+    )
+    args = parser.parse_args()
+
+    processors = {
+        "chat-ordered": lambda: ChatOrderedUpdateProcessor(),
+        "sequential": lambda: SimpleUpdateProcessor(1),
+        "simple": lambda: SimpleUpdateProcessor(256),
+    }
+    asyncio.run(
+        run(
+            processors[args.processor](),
+            args.chats,
+            args.messages,
+            args.min_latency,
+            args.max_latency,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
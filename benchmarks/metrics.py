@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Measure the cost of the metrics instrumentation and show what it records.
+
+Runs the same `handle_message` load with metrics off and on and compares
+throughput, then prints the per-stage latencies from /metrics and scrapes
+the standalone exporter once over HTTP.
+
+    poetry run python benchmarks/metrics.py --chats 100 --messages 5
+"""
+
+import asyncio
+import re
+import time
+import urllib.request
+from argparse import ArgumentParser
+
+from common import install_fake_poe, make_update, print_summary, summarize, timed
+
+from poe_tg import config, metrics
+from poe_tg.db.database import close_db, init_db
+from poe_tg.telegram_handler import handle_message
+
+SUM = re.compile(r'poe_tg_stage_seconds_(sum|count)\{stage="(\w+)"\} (\S+)')
+
+
+async def chat(user_id: int, messages: int, latencies: list[float]) -> None:
+    for i in range(messages):
+        update, context = make_update(user_id, f"message {i} from {user_id}")
+        latencies.append(await timed(handle_message(update, context)))
+
+
+async def load(chats: int, messages: int, first_user: int) -> dict[str, float]:
+    latencies: list[float] = []
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(chat(first_user + i, messages, latencies) for i in range(chats))
+    )
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def stage_means(text: str) -> dict[str, float]:
+    totals: dict[str, dict[str, float]] = {}
+    for kind, stage, value in SUM.findall(text):
+        totals.setdefault(stage, {})[kind] = float(value)
+    return {
+        f"{stage}_ms": values["sum"] / values["count"] * 1000
+        for stage, values in totals.items()
+        if values.get("count")
+    }
+
+
+def observe_cost(samples: int = 200_000) -> float:
+    """Microseconds per `timed` block around nothing."""
+    start = time.perf_counter()
+    for _ in range(samples):
+        with metrics.timed("benchmark"):
+            pass
+    return (time.perf_counter() - start) / samples * 1e6
+
+
+async def run(chats: int, messages: int, port: int) -> None:
+    await init_db()
+    # Create the users one at a time (in-memory SQLite cannot run their first
+    # transactions concurrently) so both runs see the same state
+    for user_id in range(1000, 1000 + chats):
+        update, context = make_update(user_id, "hello")
+        await handle_message(update, context)
+
+    config.METRICS_ENABLED = False
+    print_summary("metrics off", await load(chats, messages, 1000))
+    config.METRICS_ENABLED = True
+    print_summary("metrics on", await load(chats, messages, 1000))
+
+    print_summary("mean time per stage", stage_means(metrics.registry.render()))
+    print(f"\ntimed() overhead: {observe_cost():.2f} µs per block")
+
+    metrics.exporter.port = port
+    await metrics.exporter.start()
+    assert metrics.exporter.server is not None
+    url = f"http://127.0.0.1:{metrics.exporter.server.server_address[1]}/metrics"
+    body = await asyncio.to_thread(lambda: urllib.request.urlopen(url).read())
+    await metrics.exporter.stop()
+    print(f"Scraped {len(body.splitlines())} lines from the exporter")
+
+    await close_db()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-delay", type=float, default=0.002)
+    parser.add_argument("--port", type=int, default=19100, help="Exporter port")
+    args = parser.parse_args()
+
+    install_fake_poe(tokens=args.tokens, token_delay=args.token_delay)
+    asyncio.run(run(args.chats, args.messages, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark connection reuse for Poe requests.
+
+Sends the same Poe requests through fastapi_poe to a local stub server, once
+the way fastapi_poe does by default (a new client per request) and once
+through the shared `poe_http` client. The stub delays the first request on
+every new connection by --handshake milliseconds, standing in for the TCP
+and TLS setup to api.poe.com, and counts the connections it accepts.
+
+    poetry run python benchmarks/poe_connections.py --requests 200 --concurrency 20
+"""
+
+import asyncio
+import time
+from argparse import ArgumentParser
+from typing import Optional
+
+from common import print_summary, summarize
+
+import fastapi_poe as fp
+import httpx
+
+from poe_tg.http_client import poe_http
+
+EVENTS = (
+    'event: text\ndata: {"text": "Hello"}\n\n'
+    'event: text\ndata: {"text": " world"}\n\n'
+    "event: done\ndata: {}\n\n"
+).encode()
+
+
+class StubPoe:
+    """Answers every POST with a short event stream over keep-alive HTTP/1.1."""
+
+    def __init__(self, handshake: float):
+        self.handshake = handshake
+        self.connections = 0
+        self.requests = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        first = True
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    name, _, value = line.partition(b":")
+                    if name.strip().lower() == b"content-length":
+                        length = int(value)
+                await reader.readexactly(length)
+                if first:
+                    await asyncio.sleep(self.handshake)
+                    first = False
+                self.requests += 1
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                    + f"Content-Length: {len(EVENTS)}\r\n\r\n".encode()
+                    + EVENTS
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def ask(base_url: str, session: Optional[httpx.AsyncClient]) -> float:
+    start = time.perf_counter()
+    async for _ in fp.get_bot_response(
+        messages=[fp.ProtocolMessage(role="user", content="hi")],
+        bot_name="Stub",
+        api_key="benchmark",
+        base_url=base_url,
+        session=session,
+    ):
+        pass
+    return time.perf_counter() - start
+
+
+async def run(
+    stub: StubPoe, base_url: str, requests: int, concurrency: int, shared: bool
+) -> dict[str, float]:
+    stub.connections = stub.requests = 0
+    if shared:
+        await poe_http.start()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> float:
+        async with semaphore:
+            return await ask(base_url, poe_http.client)
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    await poe_http.stop()
+    return {**summarize(list(latencies), elapsed), "connections": stub.connections}
+
+
+async def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument(
+        "--handshake", type=float, default=50, help="Connection setup delay (ms)"
+    )
+    args = parser.parse_args()
+
+    stub = StubPoe(args.handshake / 1000)
+    server = await asyncio.start_server(stub.handle, "127.0.0.1", 0)
+    base_url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/bot/"
+
+    async with server:
+        for label, shared in (("client per request", False), ("shared client", True)):
+            result = await run(stub, base_url, args.requests, args.concurrency, shared)
+            print_summary(label, result)
+        server.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Exercise `stream_bot_response` against a scripted Poe backend.
+
+Each scenario makes the fake `fp.stream_request` fail, hang or answer per
+bot and shows what the user gets, which bot answered, how long it took and
+the `poe_tg_poe_*` and circuit breaker metrics it left behind. Timeouts and
+backoff are shortened so the whole run takes a few seconds.
+
+    poetry run python benchmarks/poe_resilience.py
+"""
+
+import asyncio
+import os
+import time
+from typing import Any
+
+os.environ.setdefault("POE_CONNECT_TIMEOUT", "0.3")
+os.environ.setdefault("POE_IDLE_TIMEOUT", "0.3")
+os.environ.setdefault("POE_RETRY_BASE_DELAY_MS", "20")
+os.environ.setdefault("POE_RETRY_MAX_DELAY_MS", "100")
+os.environ.setdefault("POE_TOTAL_TIMEOUT", "1.5")
+os.environ.setdefault("POE_BREAKER_FAILURES", "3")
+os.environ.setdefault("POE_BREAKER_RESET", "1")
+
+import common  # noqa: E402,F401
+
+import fastapi_poe as fp  # noqa: E402
+import httpx  # noqa: E402
+
+from poe_tg import config, metrics  # noqa: E402
+from poe_tg.circuit_breaker import poe_breakers  # noqa: E402
+from poe_tg.poe_client import stream_bot_response  # noqa: E402
+
+PRIMARY = config.DEFAULT_BOT
+FALLBACK = config.AVAILABLE_BOTS[PRIMARY]["fallback"]
+
+# Per bot: a list of behaviours used by successive requests, the last one repeating
+behaviour: dict[str, list[str]] = {}
+calls: dict[str, int] = {}
+
+
+async def scripted_stream_request(*_args: Any, bot_name: str, **_kwargs: Any):
+    calls[bot_name] = calls.get(bot_name, 0) + 1
+    script = behaviour.get(bot_name, ["ok"])
+    action = script.pop(0) if len(script) > 1 else script[0]
+    if action == "disconnect":
+        raise httpx.ConnectError("connection refused")
+    if action == "error":
+        raise fp.BotError('{"text": "internal error", "allow_retry": true}')
+    if action in ("unavailable", "unauthorized"):
+        # How fastapi_poe reports an HTTP error status
+        status = 503 if action == "unavailable" else 401
+        request = httpx.Request("POST", f"https://api.poe.com/bot/{bot_name}")
+        response = httpx.Response(status, request=request)
+        cause = httpx.HTTPStatusError(str(status), request=request, response=response)
+        raise fp.BotError(f"Error communicating with bot {bot_name}") from cause
+    if action == "invalid":
+        raise fp.BotErrorNoRetry('{"text": "bad request", "allow_retry": false}')
+    if action == "hang":
+        await asyncio.sleep(3600)
+    for word in ("Hello ", "from ", bot_name):
+        await asyncio.sleep(0.01)
+        yield fp.PartialResponse(text=word)
+        if action == "stall":
+            await asyncio.sleep(3600)
+
+
+fp.stream_request = scripted_stream_request  # type: ignore
+
+
+async def ask() -> tuple[str, str, float]:
+    messages = [fp.ProtocolMessage(role="user", content="hi")]
+    parts, answered_by = [], "-"
+    start = time.perf_counter()
+    try:
+        async for answered_by, text in stream_bot_response(messages, PRIMARY, 0.7):
+            parts.append(text)
+    except Exception as e:
+        parts.append(f"[{type(e).__name__}: {e}]")
+    return answered_by, "".join(parts), time.perf_counter() - start
+
+
+async def scenario(title: str, script: dict[str, list[str]], requests: int = 1) -> None:
+    behaviour.clear()
+    behaviour.update({bot: list(actions) for bot, actions in script.items()})
+    calls.clear()
+    print(f"\n{title}")
+    for _ in range(requests):
+        answered_by, text, elapsed = await ask()
+        print(f"  {elapsed * 1000:7.0f} ms  {answered_by:<18} {text}")
+    print(f"  Poe calls: {calls}")
+
+
+async def main() -> None:
+    await scenario("Healthy bot", {})
+    await scenario("Two transient errors, then success", {PRIMARY: ["disconnect", "error", "ok"]})
+    await scenario("No first token in time, then success", {PRIMARY: ["hang", "ok"]})
+    await scenario("Stalls after the first token (no retry)", {PRIMARY: ["stall", "ok"]})
+    await scenario("Poe unavailable (503), then success", {PRIMARY: ["unavailable", "ok"]})
+    await scenario("Request rejected by the bot (no retry)", {PRIMARY: ["invalid", "ok"]})
+    await scenario("Request rejected by Poe (401, no retry)", {PRIMARY: ["unauthorized", "ok"]})
+    await scenario(
+        f"{PRIMARY} down: falls back to {FALLBACK}, then its breaker opens",
+        {PRIMARY: ["error"]},
+        requests=3,
+    )
+    print(f"  Breaker states: {poe_breakers.states()}")
+
+    print(f"\nAfter {config.POE_BREAKER_RESET:.0f} s the trial request closes the breaker again")
+    await asyncio.sleep(config.POE_BREAKER_RESET)
+    await scenario("Recovered", {PRIMARY: ["ok"]})
+    print(f"  Breaker states: {poe_breakers.states()}")
+
+    await scenario(
+        f"Every bot hangs: gives up after {config.POE_TOTAL_TIMEOUT:g} s",
+        {PRIMARY: ["hang"], FALLBACK: ["hang"]},
+    )
+
+    print("\nMetrics:")
+    for line in metrics.registry.render().splitlines():
+        if line.startswith(("poe_tg_poe_", "poe_tg_circuit")):
+            print(f"  {line}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Concurrency check for preference writes: fire many simultaneous /start and
+/set_temperature commands (plus first messages reading the preference) for
+the same user and verify that none of them fails and that exactly one row is
+left, holding the settings of the last write.
+
+Without BENCHMARK_DATABASE_URL a temporary SQLite file is used: in-memory
+SQLite shares one connection between all sessions, which cannot run
+concurrent transactions. SQLite still serializes writers, so point
+BENCHMARK_DATABASE_URL at a scratch Postgres database to exercise real
+concurrency; the tables are dropped at the end.
+
+    poetry run python benchmarks/preference_upserts.py --calls 200
+"""
+
+import asyncio
+import os
+import random
+import tempfile
+import time
+from argparse import ArgumentParser
+
+os.environ.setdefault(
+    "BENCHMARK_DATABASE_URL",
+    f"sqlite+aiosqlite:///{os.path.join(tempfile.gettempdir(), 'preference_upserts.db')}",
+)
+
+from common import make_update  # noqa: E402
+
+from sqlalchemy import func, select  # noqa: E402
+
+from poe_tg.db import database  # noqa: E402
+from poe_tg.db.models import Base, UserPreference  # noqa: E402
+from poe_tg.telegram_handler import set_temperature, start  # noqa: E402
+
+USER_ID = 42
+
+
+async def call(kind: str, temperature: float) -> None:
+    update, context = make_update(USER_ID, f"/{kind}")
+    if kind == "start":
+        await start(update, context)
+    elif kind == "set_temperature":
+        context.args = [str(temperature)]
+        await set_temperature(update, context)
+    else:
+        database.preference_cache.invalidate(USER_ID)
+        await database.get_user_preference(USER_ID)
+
+
+async def run(calls: int) -> None:
+    async with database.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+    kinds = [random.choice(["start", "set_temperature", "get"]) for _ in range(calls)]
+    start_time = time.perf_counter()
+    results = await asyncio.gather(
+        *(call(kind, round(i / calls, 3)) for i, kind in enumerate(kinds)),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - start_time
+
+    errors = [result for result in results if isinstance(result, BaseException)]
+    async with database.session_scope() as db:
+        rows = await db.scalar(
+            select(func.count())
+            .select_from(UserPreference)
+            .where(UserPreference.user_id == USER_ID)
+        )
+        stored = await db.get(UserPreference, USER_ID)
+
+    cached = database.preference_cache.get(USER_ID)
+    print(f"\n{calls} concurrent calls in {elapsed * 1000:.0f} ms")
+    print(f"  {'errors':>18}: {len(errors)}")
+    for error in errors[:5]:
+        print(f"  {'':>18}  {type(error).__name__}: {error}")
+    print(f"  {'rows':>18}: {rows}")
+    print(f"  {'stored temperature':>18}: {stored.temperature if stored else None}")
+    print(f"  {'cached temperature':>18}: {cached.temperature if cached else None}")
+
+    async with database.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await database.engine.dispose()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.calls))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Count the database work behind one answered message.
+
+Runs MESSAGES exchanges per user through `get_poe_response` with the fake Poe
+backend and counts SQL statements, transactions and connection checkouts per
+message. "cold" clears the in-process caches before every message (a restart,
+or a user coming back after the cache TTL); "warm" keeps them. History is
+written directly, not through the write-behind buffer, so writes are counted
+per message too.
+
+    poetry run python benchmarks/queries_per_message.py --users 50 --messages 4
+"""
+
+import asyncio
+from argparse import ArgumentParser
+
+from common import install_fake_poe, make_update
+
+from sqlalchemy import event
+
+from poe_tg.db import database
+from poe_tg.db.models import Base
+from poe_tg.poe_client import get_poe_response
+
+
+def clear_caches() -> None:
+    database.preference_cache.clear()
+    database.summary_cache.clear()
+    database.history_cache.clear()
+
+
+async def run(users: int, messages: int, cold: bool) -> None:
+    async with database.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    clear_caches()
+
+    counts = {"statements": 0, "commits": 0}
+
+    def on_execute(*_args):
+        counts["statements"] += 1
+
+    def on_commit(*_args):
+        counts["commits"] += 1
+
+    event.listen(database.engine.sync_engine, "before_cursor_execute", on_execute)
+    event.listen(database.engine.sync_engine, "commit", on_commit)
+    checkouts = database.pool_stats.checkouts
+
+    for i in range(messages):
+        for user_id in range(users):
+            if cold:
+                clear_caches()
+            update, context = make_update(user_id, f"message {i}")
+            await get_poe_response(update, context)
+
+    event.remove(database.engine.sync_engine, "before_cursor_execute", on_execute)
+    event.remove(database.engine.sync_engine, "commit", on_commit)
+
+    total = users * messages
+    print(f"\n{'Cold' if cold else 'Warm'} caches, {total} messages")
+    print(f"  {'statements':>18}: {counts['statements'] / total:.2f} per message")
+    print(f"  {'commits':>18}: {counts['commits'] / total:.2f} per message")
+    print(
+        f"  {'checkouts':>18}: {(database.pool_stats.checkouts - checkouts) / total:.2f} per message"
+    )
+
+
+async def main_async(users: int, messages: int) -> None:
+    await run(users, messages, cold=True)
+    await run(users, messages, cold=False)
+    await database.engine.dispose()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=4)
+    args = parser.parse_args()
+
+    install_fake_poe(tokens=5, token_delay=0)
+    asyncio.run(main_async(args.users, args.messages))
+
+
+if __name__ == "__main__":
+    main()
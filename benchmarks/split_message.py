@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for `split_message`.
+
+Times splitting large synthetic model outputs (prose, lists and fenced code).
+The properties of the split are checked by tests/test_utils.py.
+
+    poetry run python benchmarks/split_message.py --size 100000
+"""
+
+import random
+import time
+from argparse import ArgumentParser
+
+import common  # noqa: F401
+
+from poe_tg.utils import FENCE, split_message
+
+WORDS = "the quick brown fox jumps over a lazy dog while models stream tokens".split()
+
+
+def random_text(rng: random.Random, size: int) -> str:
+    parts: list[str] = []
+    length = 0
+    while length < size:
+        kind = rng.random()
+        if kind < 0.15:
+            language = rng.choice(["", "python", "js"])
+            lines = [
+                " " * rng.choice([0, 4, 8]) + " ".join(rng.choices(WORDS, k=rng.randint(1, 12)))
+                for _ in range(rng.randint(1, 120))
+            ]
+            part = f"\n{FENCE}{language}\n" + "\n".join(lines) + f"\n{FENCE}\n"
+        elif kind < 0.2:
+            # A single very long word
+            part = "x" * rng.randint(1, 6000)
+        else:
+            part = " ".join(rng.choices(WORDS, k=rng.randint(1, 400)))
+        parts.append(part)
+        parts.append(rng.choice(["\n\n", "\n", " ", "\n\n\n"]))
+        length += len(part) + 2
+    return "".join(parts)
+
+
+def benchmark(size: int, repeat: int) -> None:
+    rng = random.Random(0)
+    texts = {
+        "mixed": random_text(rng, size),
+        # One long paragraph without sentence breaks
+        "one line": " ".join(rng.choices(WORDS, k=size // 5)),
+    }
+    for shape, text in texts.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            chunks = split_message(text)
+        elapsed = (time.perf_counter() - start) / repeat
+        print(
+            f"{shape:>8}: {len(text):>9,} characters -> {len(chunks):>3} chunks "
+            f"in {elapsed * 1000:.2f} ms"
+        )
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    for size in (args.size // 10, args.size, args.size * 10):
+        benchmark(size, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
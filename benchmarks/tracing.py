@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Measure the cost of per-update tracing and show a slow-update span tree.
+
+Feeds messages through `ChatOrderedUpdateProcessor` with tracing off and on
+and compares throughput, then handles one more message with the slow
+threshold at zero so its span tree is logged.
+
+    poetry run python benchmarks/tracing.py --chats 100 --messages 5
+"""
+
+import asyncio
+import json
+import logging
+import time
+from argparse import ArgumentParser
+
+from common import install_fake_poe, make_update, print_summary, summarize, timed
+
+from poe_tg import config
+from poe_tg.db.database import close_db, init_db
+from poe_tg.telegram_handler import handle_message
+from poe_tg.update_processor import ChatOrderedUpdateProcessor
+
+
+class Capture(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records: list[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(record.getMessage())
+
+
+async def load(processor: ChatOrderedUpdateProcessor, chats: int, messages: int):
+    latencies: list[float] = []
+
+    async def chat(user_id: int) -> None:
+        for i in range(messages):
+            update, context = make_update(user_id, f"message {i} from {user_id}")
+            latencies.append(
+                await timed(processor.process_update(update, handle_message(update, context)))
+            )
+
+    start = time.perf_counter()
+    await asyncio.gather(*(chat(1000 + i) for i in range(chats)))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def print_tree(node: dict, depth: int = 0) -> None:
+    print(f"{'  ' * depth}{node['name']:<40} {node['duration_ms']:>9.2f} ms")
+    for child in node["children"]:
+        print_tree(child, depth + 1)
+
+
+async def run(chats: int, messages: int) -> None:
+    await init_db()
+    processor = ChatOrderedUpdateProcessor()
+    # Create the users one at a time: in-memory SQLite cannot run their
+    # first transactions concurrently
+    for user_id in range(1000, 1000 + chats):
+        update, context = make_update(user_id, "hello")
+        await handle_message(update, context)
+
+    config.TRACING_ENABLED = False
+    print_summary("tracing off", await load(processor, chats, messages))
+    config.TRACING_ENABLED = True
+    print_summary("tracing on", await load(processor, chats, messages))
+
+    capture = Capture()
+    config.logger.addHandler(capture)
+    config.TRACE_SLOW_THRESHOLD = 0
+    update, context = make_update(1000, "one more message")
+    await processor.process_update(update, handle_message(update, context))
+    config.logger.removeHandler(capture)
+
+    slow = [json.loads(r)["slow_trace"] for r in capture.records if r.startswith('{"slow_trace"')]
+    print(f"\nSlow-update log ({len(slow)} trace):")
+    print_tree(slow[0])
+
+    await close_db()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-delay", type=float, default=0.002)
+    args = parser.parse_args()
+
+    install_fake_poe(tokens=args.tokens, token_delay=args.token_delay)
+    asyncio.run(run(args.chats, args.messages))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,21 +5,73 @@ from telegram import Update
 from telegram.ext import Application, ApplicationBuilder
 from argparse import ArgumentParser
 
-from poe_tg import config
+from poe_tg import config, metrics
 from poe_tg.telegram_handler import setup_handlers
-from poe_tg.db.database import init_db
-
-
-polling_app = ApplicationBuilder().token(config.TELEGRAM_TOKEN).build()
+from poe_tg.db.database import init_db, close_db, history_writer
+from poe_tg.http_client import poe_http
+from poe_tg.retention import retention
+from poe_tg.summarizer import summarizer
+from poe_tg.tracing import TracedRequest
+from poe_tg.update_processor import ChatOrderedUpdateProcessor
+from poe_tg.webhook_queue import WebhookUpdateQueue
+
+
+async def on_startup(application: Application) -> None:
+    """Allocate shared resources before the bot starts handling updates."""
+    await init_db()
+    await poe_http.start()
+    if config.HISTORY_WRITE_BEHIND:
+        await history_writer.start()
+    await summarizer.start()
+    await retention.start()
+    if application.updater is not None:
+        # Polling mode has no FastAPI app to serve /metrics
+        await metrics.exporter.start()
+
+
+async def on_shutdown(_: Application) -> None:
+    """Release shared resources after the bot has stopped."""
+    await metrics.exporter.stop()
+    await retention.stop()
+    await summarizer.stop()
+    # Write the buffered history before the engine goes away
+    await history_writer.stop()
+    await poe_http.stop()
+    await close_db()
+
+
+polling_app = (
+    ApplicationBuilder()
+    .token(config.TELEGRAM_TOKEN)
+    # Same pool size PTB uses by default, with every Bot API call traced
+    .request(TracedRequest(connection_pool_size=256))
+    .concurrent_updates(ChatOrderedUpdateProcessor())
+    .post_init(on_startup)
+    .post_shutdown(on_shutdown)
+    .build()
+)
 setup_handlers(polling_app)
-
-webhook_app = Application.builder().token(config.TELEGRAM_TOKEN).updater(None).build()
+metrics.register_stats(
+    "polling_updates", polling_app.update_processor.stats  # type: ignore
+)
+
+webhook_app = (
+    Application.builder()
+    .token(config.TELEGRAM_TOKEN)
+    .updater(None)
+    .request(TracedRequest(connection_pool_size=256))
+    .concurrent_updates(ChatOrderedUpdateProcessor())
+    .build()
+)
 setup_handlers(webhook_app)
+webhook_queue = WebhookUpdateQueue(webhook_app)
+metrics.register_stats(
+    "webhook_updates", webhook_app.update_processor.stats  # type: ignore
+)
+metrics.register_stats("webhook_queue", webhook_queue.stats)
 
 
 def run_polling():
-    init_db()
-
     if not config.TELEGRAM_TOKEN:
         config.logger.error(
             "No Telegram token provided. Set the TELEGRAM_TOKEN in environment variables."
@@ -32,7 +84,7 @@ def run_polling():
 @asynccontextmanager
 async def lifespan(_: FastAPI):
     """Sets the webhook for the Telegram Bot and manages its lifecycle (start/stop)."""
-    init_db()
+    await on_startup(webhook_app)
 
     if not config.WEBHOOK_URL:
         config.logger.error(
@@ -43,15 +95,22 @@ async def lifespan(_: FastAPI):
         config.logger.error(
             "No Telegram token provided. Set the TELEGRAM_TOKEN in environment variables."
         )
+        await on_shutdown(webhook_app)
         return
 
-    await webhook_app.bot.set_webhook(url=config.WEBHOOK_URL + "/webhook")
+    await webhook_app.bot.set_webhook(
+        url=config.WEBHOOK_URL + "/webhook", secret_token=config.WEBHOOK_SECRET or None
+    )
 
     async with webhook_app:
         await webhook_app.start()
+        await webhook_queue.start()
         yield
+        await webhook_queue.stop()
         await webhook_app.stop()
 
+    await on_shutdown(webhook_app)
+
 
 app = FastAPI(lifespan=lifespan)
 
@@ -59,12 +118,41 @@ app = FastAPI(lifespan=lifespan)
 @app.post("/webhook")
 async def process_update(request: Request):
     """Handles incoming Telegram updates and processes them with the bot."""
-    message = await request.json()
-    update = Update.de_json(data=message, bot=webhook_app.bot)
-    await webhook_app.process_update(update)
+    if (
+        config.WEBHOOK_SECRET
+        and request.headers.get("X-Telegram-Bot-Api-Secret-Token")
+        != config.WEBHOOK_SECRET
+    ):
+        return Response(status_code=HTTPStatus.FORBIDDEN)
+
+    try:
+        message = await request.json()
+        update = Update.de_json(data=message, bot=webhook_app.bot)
+    except Exception as e:
+        config.logger.warning(f"Invalid webhook payload: {e}")
+        return Response(status_code=HTTPStatus.BAD_REQUEST)
+
+    if config.WEBHOOK_ASYNC_ACK:
+        # Acknowledge right away; a 503 makes Telegram redeliver the update later
+        if not webhook_queue.submit(update):
+            return Response(status_code=HTTPStatus.SERVICE_UNAVAILABLE)
+        return Response(status_code=HTTPStatus.OK)
+
+    # Go through the update processor so per-chat ordering also applies to webhooks
+    await webhook_app.update_processor.process_update(
+        update, webhook_app.process_update(update)
+    )
     return Response(status_code=HTTPStatus.OK)
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics of the bot."""
+    if not config.METRICS_ENABLED:
+        return Response(status_code=HTTPStatus.NOT_FOUND)
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
 def main():
     parser = ArgumentParser(
         description="Run the Telegram bot in polling or webhook mode"
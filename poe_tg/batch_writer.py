@@ -0,0 +1,159 @@
+import asyncio
+from typing import Awaitable, Callable, Generic, Optional, TypeVar
+
+from poe_tg import config
+
+T = TypeVar("T")
+
+
+class BatchWriter(Generic[T]):
+    """Write-behind buffer that hands rows to `write` in batches.
+
+    `add` only buffers its rows, which always end up in the same batch; a
+    background task writes the buffer once it holds `batch_size` rows or
+    `interval` seconds after the first buffered row, whichever comes first.
+    `flush` writes everything buffered so far and waits for writes already
+    in progress, so a caller that flushes before reading sees its own rows.
+    Until `start` is called (and after `stop`) rows are written straight away.
+
+    A failed write keeps its rows buffered for the next attempt; beyond
+    `max_pending` rows the oldest are dropped.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[list[T]], Awaitable[None]],
+        batch_size: int,
+        interval: float,
+        max_pending: int,
+        name: str = "batch-writer",
+    ):
+        self.write = write
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.name = name
+        # Rows added together stay together
+        self.pending: list[list[T]] = []
+        self.pending_rows = 0
+        self.lock = asyncio.Lock()
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.rows = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None
+
+    async def add(self, *rows: T) -> None:
+        """Buffer rows, or write them at once when the writer is not running."""
+        if not self.running:
+            async with self.lock:
+                await self._write(list(rows))
+            return
+
+        self.pending.append(list(rows))
+        self.pending_rows += len(rows)
+        if self.wakeup and (
+            len(self.pending) == 1 or self.pending_rows >= self.batch_size
+        ):
+            self.wakeup.set()
+
+    async def flush(self) -> bool:
+        """Write all buffered rows, waiting for writes already in progress.
+
+        Returns False if a write failed and rows are still buffered.
+        """
+        async with self.lock:
+            while self.pending:
+                groups = self._take_batch()
+                batch = [row for group in groups for row in group]
+                try:
+                    await self._write(batch)
+                except asyncio.CancelledError:
+                    self._requeue(groups)
+                    raise
+                except Exception as e:
+                    self.failures += 1
+                    config.logger.error(f"Error writing {len(batch)} rows ({self.name}): {e}")
+                    self._requeue(groups)
+                    return False
+        return True
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._run(), name=self.name)
+
+    async def stop(self) -> None:
+        """Stop the background task and write whatever is still buffered."""
+        task, self.task = self.task, None
+        if task is not None:
+            # Hold the lock so the task is not cancelled in the middle of a write
+            async with self.lock:
+                task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+        if self.pending:
+            config.logger.error(f"{self.pending_rows} rows were not written ({self.name})")
+        config.logger.info(f"{self.name}: {self.stats()}")
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "pending": self.pending_rows,
+            "rows": self.rows,
+            "batches": self.batches,
+            "rows_per_batch": self.rows / self.batches if self.batches else 0.0,
+            "failures": self.failures,
+            "dropped": self.dropped,
+        }
+
+    async def _write(self, batch: list[T]) -> None:
+        await self.write(batch)
+        self.rows += len(batch)
+        self.batches += 1
+
+    def _take_batch(self) -> list[list[T]]:
+        """Remove whole groups from the buffer until they add up to a batch."""
+        count = rows = 0
+        while count < len(self.pending) and rows < self.batch_size:
+            rows += len(self.pending[count])
+            count += 1
+        groups = self.pending[:count]
+        del self.pending[:count]
+        self.pending_rows -= rows
+        return groups
+
+    def _requeue(self, groups: list[list[T]]) -> None:
+        self.pending[:0] = groups
+        self.pending_rows += sum(len(group) for group in groups)
+        dropped = 0
+        while self.pending_rows > self.max_pending and len(self.pending) > 1:
+            group = self.pending.pop(0)
+            self.pending_rows -= len(group)
+            dropped += len(group)
+        if dropped:
+            self.dropped += dropped
+            config.logger.error(f"Dropped {dropped} unwritten rows ({self.name})")
+
+    async def _run(self) -> None:
+        assert self.wakeup is not None
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            if self.pending_rows < self.batch_size:
+                # Give other chats a moment to add their rows to the same batch
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+            if not await self.flush():
+                # Back off before retrying a failed write
+                await asyncio.sleep(self.interval)
+            if self.pending:
+                self.wakeup.set()
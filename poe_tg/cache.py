@@ -0,0 +1,198 @@
+import itertools
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Generic, Hashable, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """Bounded least-recently-used cache whose entries expire after a TTL."""
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        # Version of the recently changed keys; forgotten keys share the floor
+        self._versions: OrderedDict[K, int] = OrderedDict()
+        self._version_floor = 0
+        self._counter = itertools.count(1)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: K) -> Optional[V]:
+        """Return the cached value, or None if it is missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= self.clock():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def version(self, key: K) -> int:
+        """Return a token that changes whenever the key is set or invalidated."""
+        return self._versions.get(key, self._version_floor)
+
+    def set(self, key: K, value: V, if_version: Optional[int] = None) -> bool:
+        """Store a value, evicting the least recently used entry when full.
+
+        With `if_version`, the value is only stored if the key has not changed
+        since `version` returned that token, so a value loaded before a newer
+        one was stored cannot replace it. Returns whether the value was stored.
+        """
+        if if_version is not None and self.version(key) != if_version:
+            return False
+        self._changed(key)
+        if self.maxsize <= 0:
+            return False
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return True
+
+    def invalidate(self, key: K) -> None:
+        """Drop a single entry."""
+        self._entries.pop(key, None)
+        self._changed(key)
+
+    def clear(self) -> None:
+        """Drop all entries."""
+        self._entries.clear()
+        self._versions.clear()
+        self._version_floor = next(self._counter)
+
+    def _changed(self, key: K) -> None:
+        self._versions[key] = next(self._counter)
+        self._versions.move_to_end(key)
+        # Tokens of forgotten keys stop matching once the floor passes them
+        while len(self._versions) > max(self.maxsize, 1):
+            _, version = self._versions.popitem(last=False)
+            self._version_floor = max(self._version_floor, version)
+
+    def stats(self) -> dict[str, float]:
+        """Return hit/miss/eviction counters."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class ConversationCache(Generic[K, V]):
+    """Per-key ring buffers with LRU eviction across keys under a global weight cap.
+
+    Each key keeps at most `maxlen` of its most recent values. When the total
+    weight of all buffered values exceeds `max_weight`, whole buffers of the
+    least recently used keys are dropped.
+    """
+
+    def __init__(self, maxlen: int, max_weight: int, weigher: Callable[[V], int]):
+        self.maxlen = maxlen
+        self.max_weight = max_weight
+        self.weigher = weigher
+        self._buffers: OrderedDict[K, deque[V]] = OrderedDict()
+        self._weights: dict[K, int] = {}
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._buffers)
+
+    def get(self, key: K) -> Optional[list[V]]:
+        """Return the buffered values oldest first, or None if the key is not loaded."""
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            self.misses += 1
+            return None
+        self._buffers.move_to_end(key)
+        self.hits += 1
+        return list(buffer)
+
+    def load(self, key: K, values: list[V]) -> None:
+        """Replace the buffer for a key with freshly loaded values."""
+        self.drop(key)
+        self._buffers[key] = deque(maxlen=self.maxlen)
+        self._weights[key] = 0
+        for value in values:
+            self._push(key, value)
+        self._evict()
+
+    def append(self, key: K, value: V) -> None:
+        """Append a value to a loaded buffer; unloaded keys load lazily later."""
+        if key not in self._buffers:
+            return
+        self._buffers.move_to_end(key)
+        self._push(key, value)
+        self._evict()
+
+    def drop(self, key: K) -> None:
+        """Forget a key's buffer."""
+        if self._buffers.pop(key, None) is not None:
+            self.weight -= self._weights.pop(key)
+
+    def clear(self) -> None:
+        """Forget all buffers."""
+        self._buffers.clear()
+        self._weights.clear()
+        self.weight = 0
+
+    def stats(self) -> dict[str, float]:
+        """Return hit rate, size and eviction counters."""
+        lookups = self.hits + self.misses
+        return {
+            "keys": len(self._buffers),
+            "weight": self.weight,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _push(self, key: K, value: V) -> None:
+        buffer = self._buffers[key]
+        if self.maxlen <= 0:
+            return
+        if len(buffer) == self.maxlen:
+            self._adjust(key, -self.weigher(buffer[0]))
+        buffer.append(value)
+        self._adjust(key, self.weigher(value))
+
+    def _adjust(self, key: K, delta: int) -> None:
+        self._weights[key] += delta
+        self.weight += delta
+
+    def _evict(self) -> None:
+        # Never evict the most recently used key, even if it alone is too heavy
+        while self.weight > self.max_weight and len(self._buffers) > 1:
+            key = next(iter(self._buffers))
+            self.drop(key)
+            self.evictions += 1
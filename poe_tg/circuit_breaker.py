@@ -0,0 +1,156 @@
+import asyncio
+import random
+import time
+from typing import Callable, Hashable
+
+import fastapi_poe as fp
+import httpx
+
+from poe_tg import config, metrics
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+# Numeric state for metrics
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a bot whose circuit breaker is open."""
+
+
+class PoeTimeoutError(Exception):
+    """A Poe bot did not start or continue its answer in time."""
+
+
+class CircuitBreaker:
+    """Stop calling a failing bot for a while instead of making every user wait on it.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    rejects calls for `reset_timeout` seconds. Then it lets a single trial call
+    through (half-open): success closes it again, failure reopens it. A trial
+    that never reports back is replaced by another after `reset_timeout`.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        reset_timeout: float,
+        name: str = "",
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_started_at = 0.0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now."""
+        if self.state == CLOSED:
+            return True
+        now = self.clock()
+        if self.state == OPEN and now - self.opened_at < self.reset_timeout:
+            self.rejected += 1
+            return False
+        if self.state == HALF_OPEN and now - self.trial_started_at < self.reset_timeout:
+            self.rejected += 1
+            return False
+        self.state = HALF_OPEN
+        self.trial_started_at = now
+        return True
+
+    def retry_after(self) -> float:
+        """Seconds until the next trial call."""
+        since = self.opened_at if self.state == OPEN else self.trial_started_at
+        return max(0.0, self.reset_timeout - (self.clock() - since))
+
+    def record_success(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                config.logger.warning(
+                    f"Circuit breaker for {self.name} opened after {self.failures} failures"
+                )
+            self.state = OPEN
+            self.opened_at = self.clock()
+
+
+class CircuitBreakers:
+    """One circuit breaker per key (Poe bot name), created on first use."""
+
+    def __init__(
+        self,
+        failure_threshold: int = config.POE_BREAKER_FAILURES,
+        reset_timeout: float = config.POE_BREAKER_RESET,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: dict[Hashable, CircuitBreaker] = {}
+
+    def get(self, key: Hashable) -> CircuitBreaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout, str(key))
+            self._breakers[key] = breaker
+        return breaker
+
+    def states(self) -> dict[tuple[str, ...], float]:
+        """Breaker state per key: 0 closed, 1 half-open, 2 open."""
+        return {(str(key),): STATE_VALUES[b.state] for key, b in self._breakers.items()}
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed Poe call may be repeated: timeouts, network and server errors.
+
+    fastapi_poe raises every failure as a `BotError`, wrapping errors other
+    than the bot's own error events, so the wrapped error decides. Client
+    errors (4xx other than 429) are not retried.
+    """
+    if isinstance(error, fp.BotErrorNoRetry):
+        return False
+    if isinstance(error, fp.BotError) and error.__cause__ is not None:
+        error = error.__cause__
+    if isinstance(error, (PoeTimeoutError, asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    # Anything else wrapped, e.g. a response that is not an event stream, would fail again
+    return isinstance(error, fp.BotError)
+
+
+def is_refusal(error: BaseException) -> bool:
+    """Whether Poe or the bot answered by refusing the request.
+
+    That is a 4xx status other than 429, or an error event that forbids
+    retrying: the bot is up, it just will not take this request.
+    """
+    if isinstance(error, fp.BotErrorNoRetry):
+        return True
+    cause = error.__cause__ if isinstance(error, fp.BotError) else None
+    if isinstance(cause, httpx.HTTPStatusError):
+        status = cause.response.status_code
+        return 400 <= status < 500 and status != 429
+    return False
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Seconds to wait before retry `attempt` (1-based), with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+poe_breakers = CircuitBreakers()
+metrics.registry.register(
+    metrics.Gauge(
+        "poe_tg_circuit_breaker_state",
+        "Poe circuit breaker state per bot: 0 closed, 1 half-open, 2 open",
+        ("bot",),
+        poe_breakers.states,
+    )
+)
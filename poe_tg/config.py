@@ -13,7 +13,17 @@ load_dotenv()
 
 # Bot configuration
 DEFAULT_BOT = "Claude-3.7-Sonnet"
-AVAILABLE_BOTS = ["Claude-3.7-Sonnet", "GPT-4o", "GPT-4.1", "Claude-3.5-Sonnet"]
+# Bots offered by /select_bot. `context_tokens` is the (estimated) token budget
+# for conversation history sent along with each message; `fallback` answers
+# instead when the bot fails before its first token.
+AVAILABLE_BOTS: dict[str, dict] = {
+    "Claude-3.7-Sonnet": {"context_tokens": 16000, "fallback": "GPT-4o"},
+    "GPT-4o": {"context_tokens": 8000},
+    "GPT-4.1": {"context_tokens": 16000, "fallback": "GPT-4o"},
+    "Claude-3.5-Sonnet": {"context_tokens": 8000, "fallback": "Claude-3.7-Sonnet"},
+}
+# History budget for custom bots that are not listed above
+DEFAULT_CONTEXT_TOKENS = int(os.getenv("DEFAULT_CONTEXT_TOKENS", "4000"))
 
 # API keys - try .env first, then fall back to environment variables
 POE_API_KEY = str(os.getenv("POE_API_KEY"))
@@ -21,12 +31,159 @@ TELEGRAM_TOKEN = str(os.getenv("TELEGRAM_TOKEN"))
 
 # Telegram message character limit
 TELEGRAM_MESSAGE_LIMIT = 4096
+# Telegram ignores formatting beyond this many entities in one message
+TELEGRAM_MAX_ENTITIES = 100
+# Render the model's Markdown as Telegram HTML (falls back to plain text if Telegram rejects it)
+FORMAT_RESPONSES = os.getenv("FORMAT_RESPONSES", "true").lower() == "true"
+# Responses longer than this many characters or messages are sent as a Markdown file
+# with a short preview instead (0 disables)
+DOCUMENT_THRESHOLD_CHARS = int(os.getenv("DOCUMENT_THRESHOLD_CHARS", "12000"))
+DOCUMENT_THRESHOLD_MESSAGES = int(os.getenv("DOCUMENT_THRESHOLD_MESSAGES", "3"))
+# Length of the preview shown as the file's caption (Telegram allows up to 1024)
+DOCUMENT_PREVIEW_CHARS = int(os.getenv("DOCUMENT_PREVIEW_CHARS", "800"))
+DOCUMENT_FILENAME = os.getenv("DOCUMENT_FILENAME", "response.md")
+
+# Remember this many recent update ids to drop redelivered updates
+DEDUP_CACHE_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", "10000"))
+# Also record processed update ids in the database so duplicates are caught across restarts
+DEDUP_PERSIST = os.getenv("DEDUP_PERSIST", "false").lower() == "true"
+
+# Updates handled at the same time (updates from one chat are always handled in order)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "256"))
+# Maximum number of Poe requests in flight across all chats
+POE_MAX_CONCURRENCY = int(os.getenv("POE_MAX_CONCURRENCY", "32"))
+
+# Messages a Telegram user may send per minute, with short bursts up to USER_RATE_BURST (0 disables)
+USER_RATE_PER_MINUTE = float(os.getenv("USER_RATE_PER_MINUTE", "20"))
+USER_RATE_BURST = float(os.getenv("USER_RATE_BURST", "5"))
+# Seconds to wait for a Poe bot's first token, and between later tokens
+POE_CONNECT_TIMEOUT = float(os.getenv("POE_CONNECT_TIMEOUT", "60"))
+POE_IDLE_TIMEOUT = float(os.getenv("POE_IDLE_TIMEOUT", "60"))
+# Retries of a failed Poe request before its first token, with jittered exponential backoff
+POE_RETRIES = int(os.getenv("POE_RETRIES", "2"))
+POE_RETRY_BASE_DELAY = int(os.getenv("POE_RETRY_BASE_DELAY_MS", "500")) / 1000
+POE_RETRY_MAX_DELAY = int(os.getenv("POE_RETRY_MAX_DELAY_MS", "5000")) / 1000
+# Seconds to wait for a first token in all, across retries and fallbacks (0 disables)
+POE_TOTAL_TIMEOUT = float(os.getenv("POE_TOTAL_TIMEOUT", "90"))
+# A bot failing this many times in a row is skipped for POE_BREAKER_RESET seconds
+POE_BREAKER_FAILURES = int(os.getenv("POE_BREAKER_FAILURES", "5"))
+POE_BREAKER_RESET = float(os.getenv("POE_BREAKER_RESET", "30"))
+# Hand failed requests to the bot's `fallback` in AVAILABLE_BOTS (at most POE_MAX_FALLBACKS deep)
+POE_FALLBACKS = os.getenv("POE_FALLBACKS", "true").lower() == "true"
+POE_MAX_FALLBACKS = int(os.getenv("POE_MAX_FALLBACKS", "2"))
+# Connection pool shared by all Poe requests; HTTP/2 is used when h2 is installed
+POE_HTTP2 = os.getenv("POE_HTTP2", "true").lower() == "true"
+POE_HTTP_MAX_CONNECTIONS = int(os.getenv("POE_HTTP_MAX_CONNECTIONS", "100"))
+POE_HTTP_MAX_KEEPALIVE = int(os.getenv("POE_HTTP_MAX_KEEPALIVE", "20"))
+POE_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("POE_HTTP_KEEPALIVE_EXPIRY", "60"))
+POE_HTTP_CONNECT_TIMEOUT = float(os.getenv("POE_HTTP_CONNECT_TIMEOUT", "10"))
+# Requests per minute to a single Poe bot across all users (0 disables)
+BOT_RATE_PER_MINUTE = float(os.getenv("BOT_RATE_PER_MINUTE", "600"))
+BOT_RATE_BURST = float(os.getenv("BOT_RATE_BURST", "50"))
+# Share of Poe capacity per Telegram username when requests queue up, e.g. "alice:2,bob:0.5"
+USER_WEIGHTS = os.getenv("USER_WEIGHTS", "")
+
+# Maximum number of attachments uploaded to Poe at the same time
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+# How long to wait for the remaining photos of an album before answering (milliseconds)
+MEDIA_GROUP_WAIT = int(os.getenv("MEDIA_GROUP_WAIT_MS", "1000")) / 1000
+
+# Stream responses by progressively editing the reply instead of waiting for the full answer
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() == "true"
+STREAM_PLACEHOLDER = "…"
+# Edit the reply at least this often while new text is pending (milliseconds)
+STREAM_EDIT_INTERVAL = int(os.getenv("STREAM_EDIT_INTERVAL_MS", "1000")) / 1000
+# ...or sooner once this many new characters arrived, but never faster than the minimum interval
+STREAM_EDIT_CHARS = int(os.getenv("STREAM_EDIT_CHARS", "300"))
+STREAM_MIN_EDIT_INTERVAL = int(os.getenv("STREAM_MIN_EDIT_INTERVAL_MS", "300")) / 1000
+# Upper bound for the edit interval after Telegram flood control slowed us down (milliseconds)
+STREAM_MAX_EDIT_INTERVAL = int(os.getenv("STREAM_MAX_EDIT_INTERVAL_MS", "10000")) / 1000
 
 # Authorized users by Telegram usernames
 AUTHORIZATION = os.getenv("AUTHORIZATION", "false").lower() == "true"
 AUTHORIZED_USERS = os.getenv("AUTHORIZED_USERS", "").split(",")
 
 WEBHOOK_URL = str(os.getenv("WEBHOOK_URL"))
+# Optional secret Telegram sends in the X-Telegram-Bot-Api-Secret-Token header
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Acknowledge webhook updates immediately and process them from an in-process queue
+WEBHOOK_ASYNC_ACK = os.getenv("WEBHOOK_ASYNC_ACK", "true").lower() == "true"
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "64"))
+# What to do when the queue is full: reject (503, Telegram retries), drop_oldest or drop_newest
+WEBHOOK_OVERFLOW_POLICY = os.getenv("WEBHOOK_OVERFLOW_POLICY", "reject")
+# Seconds to let queued updates finish on shutdown
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "10"))
+
+# Database connection pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "300"))
+# In-process cache of user preferences (entries, seconds)
+PREFERENCE_CACHE_SIZE = int(os.getenv("PREFERENCE_CACHE_SIZE", "10000"))
+PREFERENCE_CACHE_TTL = float(os.getenv("PREFERENCE_CACHE_TTL", "300"))
+# Maximum number of past messages considered for context; the bot's token budget decides how many are sent
+HISTORY_LIMIT = int(os.getenv("HISTORY_LIMIT", "50"))
+# Oldest turn is truncated to fit the budget only if at least this many tokens remain
+CONTEXT_MIN_TRUNCATED_TOKENS = int(os.getenv("CONTEXT_MIN_TRUNCATED_TOKENS", "64"))
+# Background summarization of old history through a cheap Poe bot
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").lower() == "true"
+SUMMARY_BOT = os.getenv("SUMMARY_BOT", "GPT-4o-Mini")
+# Summarize once a user has this many messages that are not yet covered by the summary
+# (must not exceed HISTORY_LIMIT)...
+SUMMARY_TRIGGER_MESSAGES = int(os.getenv("SUMMARY_TRIGGER_MESSAGES", "40"))
+# ...keeping this many of the most recent ones as raw turns
+SUMMARY_KEEP_MESSAGES = int(os.getenv("SUMMARY_KEEP_MESSAGES", "20"))
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "2"))
+SUMMARY_QUEUE_SIZE = int(os.getenv("SUMMARY_QUEUE_SIZE", "1000"))
+# Upper bound for the per-user conversation cache, in characters across all users
+HISTORY_CACHE_MAX_CHARS = int(os.getenv("HISTORY_CACHE_MAX_CHARS", "50000000"))
+# Log a warning when waiting for a pooled connection takes longer than this (seconds)
+DB_POOL_WAIT_WARNING = float(os.getenv("DB_POOL_WAIT_WARNING", "0.1"))
+# Buffer history rows and insert them in batches instead of one commit per message
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "true").lower() == "true"
+HISTORY_WRITE_BATCH_SIZE = int(os.getenv("HISTORY_WRITE_BATCH_SIZE", "200"))
+# Longest a history row waits in the buffer before being written (milliseconds)
+HISTORY_WRITE_INTERVAL = int(os.getenv("HISTORY_WRITE_INTERVAL_MS", "200")) / 1000
+# Rows kept for retry while the database is failing, the oldest are dropped beyond this
+HISTORY_WRITE_MAX_PENDING = int(os.getenv("HISTORY_WRITE_MAX_PENDING", "100000"))
+# History retention: delete messages older than this many days (0 keeps them forever)...
+HISTORY_MAX_AGE_DAYS = float(os.getenv("HISTORY_MAX_AGE_DAYS", "0"))
+# ...and beyond the newest this many messages of each user (0 for no limit)
+HISTORY_MAX_MESSAGES_PER_USER = int(os.getenv("HISTORY_MAX_MESSAGES_PER_USER", "0"))
+# How often the retention job runs (seconds)
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+# Rows deleted per statement, with a pause in between so other writes are not held up
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+RETENTION_BATCH_PAUSE = int(os.getenv("RETENTION_BATCH_PAUSE_MS", "100")) / 1000
+# Monthly partitions created in advance when the Postgres history table is partitioned
+HISTORY_PARTITION_MONTHS_AHEAD = int(os.getenv("HISTORY_PARTITION_MONTHS_AHEAD", "2"))
+# Persisted update ids are forgotten after this many hours (Telegram gives up after 24)
+PROCESSED_UPDATES_MAX_AGE_HOURS = float(os.getenv("PROCESSED_UPDATES_MAX_AGE_HOURS", "48"))
+
+# Prometheus metrics, served at /metrics by the webhook app
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Port of the standalone /metrics exporter in polling mode (0 disables)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Trace each update through handlers, Poe, the database and Telegram calls
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+# Updates taking longer than this have their whole span tree logged as JSON (milliseconds)
+TRACE_SLOW_THRESHOLD = int(os.getenv("TRACE_SLOW_THRESHOLD_MS", "20000")) / 1000
+# Also log every span as a JSON line when it ends
+TRACE_LOG_SPANS = os.getenv("TRACE_LOG_SPANS", "false").lower() == "true"
+# Spans kept per update for the slow-update log (streaming makes many Telegram calls)
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "500"))
+# Mirror spans to OpenTelemetry if it is installed (a no-op until an SDK/exporter is configured)
+TRACE_OTEL = os.getenv("TRACE_OTEL", "false").lower() == "true"
+
+
+def context_budget(bot_name: str) -> int:
+    """Token budget for conversation history sent to the given bot."""
+    return AVAILABLE_BOTS.get(bot_name, {}).get("context_tokens", DEFAULT_CONTEXT_TOKENS)
+
 
 # Validate environment variables
 if AUTHORIZATION:
@@ -0,0 +1,54 @@
+from typing import NamedTuple
+
+import fastapi_poe as fp
+
+from poe_tg import config
+
+# Rough average for English text and code across common tokenizers
+CHARS_PER_TOKEN = 4
+
+
+class HistoryEntry(NamedTuple):
+    """A past message ready to send to Poe, with its estimated token count."""
+
+    message: fp.ProtocolMessage
+    tokens: int
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheaply estimate how many tokens a text takes."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """Keep the end of a text so that it fits in roughly `tokens` tokens."""
+    keep = max(0, tokens * CHARS_PER_TOKEN - 1)
+    return "…" + text[len(text) - keep :]
+
+
+def select_context(history: list[HistoryEntry], budget: int) -> list[fp.ProtocolMessage]:
+    """Pick the most recent history that fits the token budget, oldest first.
+
+    Turns are taken newest to oldest. The first turn that does not fit is
+    truncated to the remaining budget if that leaves enough to be useful, and
+    everything older is dropped.
+    """
+    selected: list[fp.ProtocolMessage] = []
+    remaining = budget
+
+    for message, tokens in reversed(history):
+        if tokens <= remaining:
+            selected.append(message)
+            remaining -= tokens
+            continue
+
+        if remaining >= config.CONTEXT_MIN_TRUNCATED_TOKENS:
+            selected.append(
+                message.model_copy(
+                    update={"content": truncate_to_tokens(message.content, remaining)}
+                )
+            )
+        break
+
+    selected.reverse()
+    return selected
@@ -1,13 +1,32 @@
 import os
-import json
-from fastapi_poe.types import Attachment
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from fastapi_poe.types import Attachment, ProtocolMessage
+from sqlalchemy import delete, event, func, insert, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.pool import StaticPool
-from typing import List, Any, Generator
-from datetime import datetime
-from poe_tg import config
-from .models import Base, UserPreference, ConversationHistory
+from typing import List, Any, AsyncGenerator, AsyncIterator, Callable, Literal, cast
+from datetime import datetime, timedelta
+from poe_tg import config, metrics
+from poe_tg.batch_writer import BatchWriter
+from poe_tg.cache import ConversationCache, LRUCache
+from poe_tg.context import HistoryEntry, estimate_tokens
+from poe_tg.tracing import span, traced
+from .models import (
+    Base,
+    UserPreference,
+    ConversationHistory,
+    ConversationSummary,
+    ProcessedUpdate,
+)
 
 
 def deserialize_attachments(attachments_data: Any) -> List[Attachment]:
@@ -35,166 +54,781 @@ def deserialize_attachments(attachments_data: Any) -> List[Attachment]:
     return attachments
 
 
+def serialize_attachments(attachments: list[Attachment] | None) -> list[dict]:
+    """Convert attachments to JSON-compatible dicts for storage."""
+    if not attachments:
+        return []
+    return [
+        {
+            "url": attachment.url,
+            "content_type": attachment.content_type,
+            "name": attachment.name,
+            "parsed_content": attachment.parsed_content,
+        }
+        for attachment in attachments
+    ]
+
+
+def to_protocol_message(
+    role: str, content: str, attachments: list[dict] | None = None
+) -> ProtocolMessage:
+    """Build the Poe protocol message for a stored history entry."""
+    return ProtocolMessage(
+        role=cast(Literal["system", "user", "bot"], role),
+        content=content,
+        attachments=[
+            Attachment(
+                url=a["url"],
+                content_type=a["content_type"],
+                name=a["name"],
+                parsed_content=a["parsed_content"],
+            )
+            for a in attachments or []
+        ],
+    )
+
+
+def entry_weight(entry: HistoryEntry) -> int:
+    """Approximate the memory held by a cached history entry, in characters."""
+    return len(entry.message.content) + sum(
+        len(a.url) + len(a.parsed_content or "") for a in entry.message.attachments
+    )
+
+
+def to_async_url(url: str) -> str:
+    """Rewrite a plain database URL to use an asyncio-capable driver."""
+    for prefix, async_prefix in (
+        ("postgresql://", "postgresql+asyncpg://"),
+        ("postgres://", "postgresql+asyncpg://"),
+        ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+    ):
+        if url.startswith(prefix):
+            return async_prefix + url[len(prefix) :]
+    return url
+
+
+def is_memory_sqlite(url: str) -> bool:
+    """Check whether the URL points at an in-memory SQLite database."""
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and parsed.database in (
+        None,
+        "",
+        ":memory:",
+    )
+
+
+@dataclass
+class PoolStats:
+    """Counters describing how the connection pool is being used."""
+
+    connects: int = 0
+    checkouts: int = 0
+    checkins: int = 0
+    waits: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+    slow_waits: int = 0
+
+    def record_wait(self, seconds: float) -> None:
+        self.waits += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+        if seconds > config.DB_POOL_WAIT_WARNING:
+            self.slow_waits += 1
+            config.logger.warning(
+                f"Waited {seconds * 1000:.0f} ms for a database connection ({engine.pool.status()})"
+            )
+        for hook in pool_wait_hooks:
+            hook(seconds)
+
+    def snapshot(self) -> dict[str, float]:
+        return {
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "checkins": self.checkins,
+            "checked_out": self.checkouts - self.checkins,
+            "slow_waits": self.slow_waits,
+            "wait_avg_ms": self.wait_total / self.waits * 1000 if self.waits else 0.0,
+            "wait_max_ms": self.wait_max * 1000,
+        }
+
+
+pool_stats = PoolStats()
+
+# Callbacks receiving every connection checkout wait time (seconds), e.g. for metrics
+pool_wait_hooks: list[Callable[[float], None]] = []
+
+
+def create_db_engine(url: str) -> AsyncEngine:
+    """Create the async engine, pooled unless it is an in-memory SQLite database."""
+    url = to_async_url(url)
+
+    if is_memory_sqlite(url):
+        # Every connection to :memory: is a fresh database, so share a single one
+        new_engine = create_async_engine(
+            url, poolclass=StaticPool, connect_args={"check_same_thread": False}
+        )
+    else:
+        new_engine = create_async_engine(
+            url,
+            pool_size=config.DB_POOL_SIZE,
+            max_overflow=config.DB_MAX_OVERFLOW,
+            pool_timeout=config.DB_POOL_TIMEOUT,
+            pool_recycle=config.DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+        )
+
+    @event.listens_for(new_engine.sync_engine, "connect")
+    def _on_connect(*_args):
+        pool_stats.connects += 1
+
+    @event.listens_for(new_engine.sync_engine, "checkout")
+    def _on_checkout(*_args):
+        pool_stats.checkouts += 1
+
+    @event.listens_for(new_engine.sync_engine, "checkin")
+    def _on_checkin(*_args):
+        pool_stats.checkins += 1
+
+    return new_engine
+
+
 # Database configuration
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is required")
 
 # Create engine
-engine = create_engine(
-    DATABASE_URL,
-    poolclass=StaticPool,
-    pool_pre_ping=True,
-    pool_recycle=300,
-)
+engine = create_db_engine(DATABASE_URL)
 
 # Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = async_sessionmaker(
+    bind=engine, autoflush=False, expire_on_commit=False
+)
+
+# Detached UserPreference rows by user id, kept current by set_user_preference
+preference_cache: LRUCache[int, UserPreference] = LRUCache(
+    config.PREFERENCE_CACHE_SIZE, config.PREFERENCE_CACHE_TTL
+)
+
+# Latest summary per user; an empty summary is cached for users without one
+summary_cache: LRUCache[int, ConversationSummary] = LRUCache(
+    config.PREFERENCE_CACHE_SIZE, config.PREFERENCE_CACHE_TTL
+)
+
+# Most recent protocol messages per user, appended to as messages are saved
+history_cache: ConversationCache[int, HistoryEntry] = ConversationCache(
+    config.HISTORY_LIMIT, config.HISTORY_CACHE_MAX_CHARS, entry_weight
+)
+
 
+@traced()
+async def insert_history_rows(rows: list[dict]) -> None:
+    """Insert conversation history rows in a single multi-row INSERT."""
+    async with session_scope() as db:
+        await db.execute(insert(ConversationHistory), rows)
+        await db.commit()
 
-def get_db() -> Generator[Session, None, None]:
+
+# Write-behind buffer for conversation history, started and stopped with the bot
+history_writer: BatchWriter[dict] = BatchWriter(
+    insert_history_rows,
+    config.HISTORY_WRITE_BATCH_SIZE,
+    config.HISTORY_WRITE_INTERVAL,
+    config.HISTORY_WRITE_MAX_PENDING,
+    name="history-writer",
+)
+
+
+metrics.register_stats("db_pool", pool_stats.snapshot)
+metrics.register_stats("preference_cache", preference_cache.stats)
+metrics.register_stats("summary_cache", summary_cache.stats)
+metrics.register_stats("history_cache", history_cache.stats)
+metrics.register_stats("history_writer", history_writer.stats)
+pool_wait_hooks.append(lambda seconds: metrics.observe("db_pool_wait", seconds))
+
+
+def dialect_insert(model: Any):
+    """INSERT construct of the engine's dialect, which supports ON CONFLICT clauses."""
+    if engine.dialect.name == "postgresql":
+        return postgresql.insert(model)
+    if engine.dialect.name == "sqlite":
+        return sqlite.insert(model)
+    raise NotImplementedError(f"Upserts are not supported on {engine.dialect.name}")
+
+
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
     """Get database session for FastAPI dependency injection."""
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-def get_db_session() -> Session:
+def get_db_session() -> AsyncSession:
     """Get database session for direct use."""
     return SessionLocal()
 
 
-def init_db():
+@asynccontextmanager
+async def session_scope() -> AsyncIterator[AsyncSession]:
+    """Open a session with its connection checked out, recording the pool wait."""
+    async with SessionLocal() as db:
+        start = time.perf_counter()
+        with span("database.connection"):
+            await db.connection()
+        pool_stats.record_wait(time.perf_counter() - start)
+        yield db
+
+
+def log_db_stats():
+    """Log the current connection pool and cache statistics."""
+    config.logger.info(f"Database pool: {engine.pool.status()} {pool_stats.snapshot()}")
+    config.logger.info(f"Preference cache: {preference_cache.stats()}")
+    config.logger.info(f"History cache: {history_cache.stats()}")
+    config.logger.info(f"History writer: {history_writer.stats()}")
+
+
+async def init_db():
     """Initialize the database and create tables."""
-    Base.metadata.create_all(bind=engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
     config.logger.info("Database initialized with SQLAlchemy")
 
 
-def get_user_preference(user_id: int):
-    """Get user preference settings from the database."""
-    db = get_db_session()
-    try:
-        preference = (
-            db.query(UserPreference).filter(UserPreference.user_id == user_id).first()
+async def close_db():
+    """Dispose of the engine and close all pooled connections."""
+    # Normally already stopped on shutdown, this only catches leftover rows
+    await history_writer.flush()
+    log_db_stats()
+    await engine.dispose()
+
+
+# Settings of a user who has not changed anything yet
+PREFERENCE_DEFAULTS = {
+    "bot_name": config.DEFAULT_BOT,
+    "system_prompt": "",
+    "temperature": 0.7,
+}
+
+
+@traced()
+async def get_user_preference(user_id: int) -> UserPreference:
+    """Get user preference settings, from the cache when possible."""
+    cached = preference_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    version = preference_cache.version(user_id)
+    async with session_scope() as db:
+        preference = await db.scalar(
+            select(UserPreference).where(UserPreference.user_id == user_id)
         )
 
         if not preference:
-            # Create a new preference and save it to the database
-            preference = UserPreference(
-                user_id=user_id,
-                bot_name=config.DEFAULT_BOT,
-                system_prompt="",
-                temperature=0.7,
-            )
-            db.add(preference)
-            db.commit()
-            # Refresh the object to get the actual values
-            db.refresh(preference)
+            preference = await create_default_preference(db, user_id)
 
+        # Unless a write stored newer settings while the row was read
+        preference_cache.set(user_id, preference, if_version=version)
         return preference
-    finally:
-        db.close()
-
 
-def set_user_preference(user_id: int, **kwargs):
-    """Set user preference settings in the database."""
-    if not kwargs:
-        return
 
-    db = get_db_session()
-    try:
-        preference = (
-            db.query(UserPreference).filter(UserPreference.user_id == user_id).first()
+@traced()
+async def create_default_preference(db: AsyncSession, user_id: int) -> UserPreference:
+    """Save the default settings for a new user.
+
+    Concurrent first messages of the same user race to create the row; the
+    losers keep the winner's row instead of failing on the primary key.
+    """
+    preference = await upsert_preference(
+        db,
+        dialect_insert(UserPreference)
+        .values(user_id=user_id, **PREFERENCE_DEFAULTS)
+        .on_conflict_do_nothing(index_elements=["user_id"]),
+        user_id,
+    )
+    await db.commit()
+    return preference
+
+
+async def upsert_preference(db: AsyncSession, statement: Any, user_id: int) -> UserPreference:
+    """Run an upsert of a user's preference and return the stored row.
+
+    The row comes back with RETURNING in the same round trip. SQLite keeps an
+    INSERT ... RETURNING in progress, and so cannot commit, until its cursor
+    is closed, which fails when sessions share the in-memory connection, so
+    there the row is selected afterwards. So is a row ON CONFLICT DO NOTHING
+    left alone, as RETURNING only yields rows it wrote.
+    """
+    preference = None
+    if engine.dialect.name == "sqlite":
+        await db.execute(statement)
+    else:
+        preference = await db.scalar(
+            statement.returning(UserPreference),
+            execution_options={"populate_existing": True},
         )
+    if preference is None:
+        preference = await db.scalar(
+            select(UserPreference).where(UserPreference.user_id == user_id)
+        )
+    return cast(UserPreference, preference)
 
-        if preference:
-            # Update existing preference
-            for key, value in kwargs.items():
-                if hasattr(preference, key):
-                    setattr(preference, key, value)
-        else:
-            # Create new preference with defaults
-            defaults = {
-                "bot_name": config.DEFAULT_BOT,
-                "system_prompt": "",
-                "temperature": 0.7,
-            }
-            preferences = {**defaults, **kwargs}
-            preferences["user_id"] = user_id
-
-            preference = UserPreference(**preferences)
-            db.add(preference)
 
-        db.commit()
-    finally:
-        db.close()
+@traced()
+async def set_user_preference(user_id: int, **kwargs):
+    """Set user preference settings in the database.
 
+    A single INSERT ... ON CONFLICT DO UPDATE creates the row with defaults for
+    the missing settings or updates just the given ones, so concurrent calls
+    for the same user neither race nor fail. Unknown settings are ignored.
+    """
+    values = {key: value for key, value in kwargs.items() if key in PREFERENCE_DEFAULTS}
+    if not values:
+        return
 
-def add_message_to_history(
+    statement = dialect_insert(UserPreference).values(
+        user_id=user_id, **{**PREFERENCE_DEFAULTS, **values}
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={key: statement.excluded[key] for key in values},
+    )
+
+    version = preference_cache.version(user_id)
+    async with session_scope() as db:
+        try:
+            preference = await upsert_preference(db, statement, user_id)
+            await db.commit()
+        except Exception:
+            preference_cache.invalidate(user_id)
+            raise
+
+    # Write through so the next message sees the new settings without a query.
+    # If another write or load stored settings meanwhile, which of them is
+    # newer is unknown, so the next message reads the row instead.
+    if not preference_cache.set(user_id, preference, if_version=version):
+        preference_cache.invalidate(user_id)
+
+
+@traced()
+async def add_message_to_history(
     user_id: int,
     role: str,
     content: str,
     bot_name: str,
     attachments: list[Attachment] | None = None,
 ):
-    """Add a message to the conversation history."""
-    db = get_db_session()
-    # convert attachments to Dict type
-    attachments_dict = []
-    if attachments:
-        attachments_dict = [
-            {
-                "url": attachment.url,
-                "content_type": attachment.content_type,
-                "name": attachment.name,
-                "parsed_content": attachment.parsed_content,
-            }
-            for attachment in attachments
-        ]
-
-    try:
-        message = ConversationHistory(
-            user_id=user_id,
-            role=role,
-            content=content,
-            bot_name=bot_name,
-            timestamp=datetime.now(),
-            attachments=attachments_dict,
-        )
-        db.add(message)
-        db.commit()
-    finally:
-        db.close()
-
-
-def get_conversation_history(
-    user_id: int, limit: int = 10
-) -> List[ConversationHistory]:
-    """Get the recent conversation history for a user."""
-    db = get_db_session()
-    try:
-        messages = (
-            db.query(ConversationHistory)
-            .filter(ConversationHistory.user_id == user_id)
-            .order_by(ConversationHistory.timestamp.desc())
-            .limit(limit)
-            .all()
+    """Add a message to the conversation history.
+
+    The row is written in the background by `history_writer`; the history cache
+    is updated at once, and reads from the database flush the writer first.
+    """
+    row = history_row(user_id, role, content, bot_name, attachments)
+    await history_writer.add(row)
+    cache_history_row(row)
+
+
+def history_row(
+    user_id: int,
+    role: str,
+    content: str,
+    bot_name: str,
+    attachments: list[Attachment] | None = None,
+) -> dict:
+    """Column values of a new conversation history row."""
+    return {
+        "user_id": user_id,
+        "role": role,
+        "content": content,
+        "bot_name": bot_name,
+        "timestamp": datetime.now(),
+        # convert attachments to Dict type
+        "attachments": serialize_attachments(attachments),
+        "token_count": estimate_tokens(content),
+    }
+
+
+def cache_history_row(row: dict) -> None:
+    """Append a newly saved row to the user's cached history."""
+    history_cache.append(
+        row["user_id"],
+        HistoryEntry(
+            to_protocol_message(row["role"], row["content"], row["attachments"]),
+            row["token_count"],
+        ),
+    )
+
+
+def history_query(user_id: int, limit: int | None, after_id: int = 0):
+    """Select the newest `limit` messages of a user with an id above `after_id`."""
+    return (
+        select(ConversationHistory)
+        .where(
+            ConversationHistory.user_id == user_id,
+            ConversationHistory.id > after_id,
         )
+        # Both sides of an exchange, or a batch, can share a timestamp
+        .order_by(ConversationHistory.timestamp.desc(), ConversationHistory.id.desc())
+        .limit(limit)
+    )
+
+
+@traced()
+async def get_conversation_history(
+    user_id: int, limit: int | None = 10, after_id: int = 0
+) -> List[ConversationHistory]:
+    """Get the recent conversation history for a user, oldest message first.
+
+    Only messages with an id greater than `after_id` are returned, which skips
+    those already covered by the conversation summary.
+    """
+    # Read our own writes: rows still buffered would be missing otherwise
+    await history_writer.flush()
+
+    async with session_scope() as db:
+        result = await db.scalars(history_query(user_id, limit, after_id))
+        messages = list(result)
+        messages.reverse()
 
         return messages
-    finally:
-        db.close()
 
 
-def clear_conversation_history(user_id: int):
+def to_history_entry(row: ConversationHistory) -> HistoryEntry:
+    """Build the cached history entry for a stored message."""
+    content = str(row.content)
+    tokens = row.token_count
+    if tokens is None:
+        # Rows written before token counts were stored
+        tokens = estimate_tokens(content)
+    return HistoryEntry(
+        to_protocol_message(str(row.role), content, row.attachments),  # type: ignore
+        int(tokens),
+    )
+
+
+@dataclass
+class Exchange:
+    """What answering a message needs to know about the user."""
+
+    preference: UserPreference
+    summary: ConversationSummary
+    history: List[HistoryEntry]
+
+
+@traced()
+async def load_exchange(user_id: int) -> Exchange:
+    """Load a user's preference, summary and recent history for one exchange.
+
+    Everything comes from the caches when possible. Whatever is missing is
+    loaded in a single session: the preference together with the summary in
+    one joined query, then the history the summary does not cover.
+    """
+    preference = preference_cache.get(user_id)
+    summary = summary_cache.get(user_id)
+    history = history_cache.get(user_id)
+    if preference is not None and summary is not None and history is not None:
+        return Exchange(preference, summary, history)
+
+    if history is None:
+        # Read our own writes: rows still buffered would be missing otherwise
+        await history_writer.flush()
+
+    version = preference_cache.version(user_id)
+    async with session_scope() as db:
+        if preference is None or summary is None:
+            with metrics.timed("preference_fetch"):
+                row = (
+                    await db.execute(
+                        select(UserPreference, ConversationSummary)
+                        .outerjoin(
+                            ConversationSummary,
+                            ConversationSummary.user_id == UserPreference.user_id,
+                        )
+                        .where(UserPreference.user_id == user_id)
+                    )
+                ).first()
+                if row is None:
+                    # A new user, who has no summary either
+                    preference, summary = await create_default_preference(db, user_id), None
+                else:
+                    preference, summary = row
+            if summary is None:
+                summary = empty_summary(user_id)
+            preference_cache.set(user_id, preference, if_version=version)
+            summary_cache.set(user_id, summary)
+
+        if history is None:
+            with metrics.timed("history_fetch"):
+                rows = list(
+                    await db.scalars(
+                        history_query(
+                            user_id,
+                            config.HISTORY_LIMIT,
+                            int(summary.summarized_until_id),  # type: ignore
+                        )
+                    )
+                )
+            rows.reverse()
+            history = [to_history_entry(row) for row in rows]
+            history_cache.load(user_id, history)
+
+    return Exchange(preference, summary, history)
+
+
+@traced()
+async def save_exchange(
+    user_id: int,
+    bot_name: str,
+    message: str,
+    response: str,
+    attachments: list[Attachment] | None = None,
+):
+    """Save the user's message and the bot's response together.
+
+    Both rows go into the same INSERT, and so the same transaction, whether
+    written at once or through the write-behind buffer.
+    """
+    rows = [
+        history_row(user_id, "user", message, bot_name, attachments),
+        history_row(user_id, "bot", response, bot_name),
+    ]
+    await history_writer.add(*rows)
+    for row in rows:
+        cache_history_row(row)
+
+
+def empty_summary(user_id: int) -> ConversationSummary:
+    """Transient summary for a user whose history has not been summarized yet."""
+    return ConversationSummary(user_id=user_id, content="", summarized_until_id=0)
+
+
+@traced()
+async def get_conversation_summary(user_id: int) -> ConversationSummary:
+    """Get the summary of a user's older history (empty if there is none yet)."""
+    cached = summary_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    async with session_scope() as db:
+        summary = await db.get(ConversationSummary, user_id)
+
+    if summary is None:
+        summary = empty_summary(user_id)
+    summary_cache.set(user_id, summary)
+    return summary
+
+
+@traced()
+async def save_conversation_summary(
+    user_id: int, content: str, summarized_until_id: int
+) -> bool:
+    """Store a new summary covering messages up to `summarized_until_id`.
+
+    Nothing is saved, and False returned, when that message no longer exists:
+    the history was cleared while the summary was being written, and saving it
+    would bring the cleared conversation back.
+    """
+    async with session_scope() as db:
+        still_there = await db.scalar(
+            select(ConversationHistory.id).where(
+                ConversationHistory.id == summarized_until_id,
+                ConversationHistory.user_id == user_id,
+            )
+        )
+        if still_there is None:
+            return False
+        summary = await db.merge(
+            ConversationSummary(
+                user_id=user_id,
+                content=content,
+                summarized_until_id=summarized_until_id,
+                updated_at=datetime.now(),
+            )
+        )
+        await db.commit()
+
+    summary_cache.set(user_id, summary)
+    # The cached turns may include messages the summary now covers
+    history_cache.drop(user_id)
+    return True
+
+
+@traced()
+async def clear_conversation_history(user_id: int):
     """Clear the conversation history for a user."""
-    db = get_db_session()
-    try:
-        db.query(ConversationHistory).filter(
-            ConversationHistory.user_id == user_id
-        ).delete()
-        db.commit()
-    finally:
-        db.close()
+    # Buffered rows must not be inserted after the delete
+    await history_writer.flush()
+
+    async with session_scope() as db:
+        await db.execute(
+            delete(ConversationHistory).where(ConversationHistory.user_id == user_id)
+        )
+        await db.execute(
+            delete(ConversationSummary).where(ConversationSummary.user_id == user_id)
+        )
+        await db.commit()
+
+    history_cache.drop(user_id)
+    summary_cache.invalidate(user_id)
+
+
+@traced()
+async def mark_update_processed(update_id: int) -> bool:
+    """Record a Telegram update id, returning False if it was already recorded."""
+    async with session_scope() as db:
+        result = await db.execute(
+            dialect_insert(ProcessedUpdate)
+            .values(update_id=update_id, processed_at=datetime.now())
+            .on_conflict_do_nothing(index_elements=["update_id"])
+        )
+        await db.commit()
+        return result.rowcount == 1  # type: ignore
+
+
+@traced()
+async def delete_history_rows(ids: Any) -> int:
+    """Delete the conversation history rows selected by `ids`, returning how many went."""
+    async with session_scope() as db:
+        # Read before deleting rather than with DELETE ... RETURNING, which
+        # SQLite keeps in progress and so blocks commits on a shared connection
+        rows = (
+            await db.execute(
+                select(ConversationHistory.id, ConversationHistory.user_id).where(
+                    ConversationHistory.id.in_(ids)
+                )
+            )
+        ).all()
+        if not rows:
+            return 0
+        await db.execute(
+            delete(ConversationHistory).where(
+                ConversationHistory.id.in_([row.id for row in rows])
+            ),
+            execution_options={"synchronize_session": False},
+        )
+        await db.commit()
+
+    # Cached turns of these users may include deleted messages
+    for user_id in {row.user_id for row in rows}:
+        history_cache.drop(user_id)
+    return len(rows)
+
+
+@traced()
+async def delete_old_history(before: datetime, batch_size: int) -> int:
+    """Delete up to `batch_size` messages sent before `before`."""
+    return await delete_history_rows(
+        select(ConversationHistory.id)
+        .where(ConversationHistory.timestamp < before)
+        .limit(batch_size)
+    )
+
+
+@traced()
+async def delete_excess_history(max_messages: int, batch_size: int) -> int:
+    """Delete up to `batch_size` messages beyond the newest `max_messages` of each user.
+
+    Only users over the limit are visited. Their excess is read from the
+    (user_id, timestamp) index, newest first, past their `max_messages`th
+    message, rather than ranking the messages of every user on each batch.
+    """
+    async with session_scope() as db:
+        user_ids = list(
+            await db.scalars(
+                select(ConversationHistory.user_id)
+                .group_by(ConversationHistory.user_id)
+                .having(func.count() > max_messages)
+            )
+        )
+
+    deleted = 0
+    for user_id in user_ids:
+        if deleted >= batch_size:
+            break
+        deleted += await delete_history_rows(
+            select(ConversationHistory.id)
+            .where(ConversationHistory.user_id == user_id)
+            .order_by(ConversationHistory.timestamp.desc(), ConversationHistory.id.desc())
+            .offset(max_messages)
+            .limit(batch_size - deleted)
+        )
+    return deleted
+
+
+@traced()
+async def delete_processed_updates(before: datetime, batch_size: int) -> int:
+    """Forget up to `batch_size` update ids recorded before `before`."""
+    async with session_scope() as db:
+        result = await db.execute(
+            delete(ProcessedUpdate).where(
+                ProcessedUpdate.update_id.in_(
+                    select(ProcessedUpdate.update_id)
+                    .where(ProcessedUpdate.processed_at < before)
+                    .limit(batch_size)
+                )
+            ),
+            execution_options={"synchronize_session": False},
+        )
+        await db.commit()
+        return result.rowcount  # type: ignore
+
+
+HISTORY_PARTITION_PREFIX = "conversation_history_p"
+
+
+@traced()
+async def history_partitions() -> list[str]:
+    """Names of the monthly conversation history partitions, oldest first.
+
+    Empty unless the table was partitioned by the optional Postgres migration.
+    """
+    if engine.dialect.name != "postgresql":
+        return []
+    async with session_scope() as db:
+        result = await db.execute(
+            text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass('conversation_history')"
+            )
+        )
+        return sorted(
+            name for name in result.scalars() if name.startswith(HISTORY_PARTITION_PREFIX)
+        )
+
+
+def history_partition_name(month: datetime) -> str:
+    return f"{HISTORY_PARTITION_PREFIX}{month:%Y%m}"
+
+
+def history_partition_month(name: str) -> datetime:
+    """First day of the month a history partition holds."""
+    return datetime.strptime(name[len(HISTORY_PARTITION_PREFIX) :], "%Y%m")
+
+
+def next_month(month: datetime) -> datetime:
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+@traced()
+async def create_history_partition(month: datetime) -> None:
+    """Create the partition holding the messages of the month starting at `month`."""
+    end = next_month(month)
+    async with session_scope() as db:
+        await db.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {history_partition_name(month)} "
+                "PARTITION OF conversation_history "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+            )
+        )
+        await db.commit()
+
+
+@traced()
+async def drop_history_partition(name: str) -> None:
+    """Drop a whole month of conversation history at once."""
+    async with session_scope() as db:
+        await db.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        await db.commit()
+    history_cache.clear()
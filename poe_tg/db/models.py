@@ -1,4 +1,14 @@
-from sqlalchemy import Column, Integer, String, Text, Float, DateTime, BigInteger, JSON
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    Text,
+    Float,
+    DateTime,
+    BigInteger,
+    JSON,
+    Index,
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 from datetime import datetime
@@ -25,3 +35,31 @@ class ConversationHistory(Base):
     content = Column(Text, nullable=False)
     bot_name = Column(String(255), nullable=False)
     attachments = Column(JSON, nullable=True)
+    # Estimated tokens of `content`, used to fit history into a bot's context budget
+    token_count = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        # Serves "latest N messages of a user" and per-user deletes
+        Index(
+            "ix_conversation_history_user_id_timestamp",
+            "user_id",
+            timestamp.desc(),
+        ),
+    )
+
+
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summaries"
+
+    user_id = Column(BigInteger, primary_key=True)
+    content = Column(Text, nullable=False, default="")
+    # Messages with an id up to and including this one are covered by the summary
+    summarized_until_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, default=func.now())
+
+
+class ProcessedUpdate(Base):
+    __tablename__ = "processed_updates"
+
+    update_id = Column(BigInteger, primary_key=True)
+    processed_at = Column(DateTime, nullable=False, default=func.now())
@@ -0,0 +1,78 @@
+import io
+import math
+
+from telegram import InputFile, Message
+from telegram.constants import ParseMode
+from telegram.error import BadRequest
+
+from poe_tg import config, metrics
+from poe_tg.formatting import (
+    RenderedChunk,
+    is_parse_error,
+    render_chunk,
+    render_chunks,
+    reply_formatted,
+)
+from poe_tg.utils import iter_chunks, with_flood_control
+
+
+def wants_document(length: int, messages: int) -> bool:
+    """Whether a response is long enough to be sent as a file instead of messages."""
+    if config.DOCUMENT_THRESHOLD_CHARS <= 0:
+        return False
+    return (
+        length > config.DOCUMENT_THRESHOLD_CHARS
+        or messages > config.DOCUMENT_THRESHOLD_MESSAGES
+    )
+
+
+def wants_document_for(length: int, limit: int = config.TELEGRAM_MESSAGE_LIMIT) -> bool:
+    """`wants_document` for a response of which only the length is known yet."""
+    return wants_document(length, math.ceil(length / limit))
+
+
+def preview(text: str, limit: int = config.DOCUMENT_PREVIEW_CHARS) -> str:
+    """The beginning of a long response, cut at a clean break."""
+    if len(text) <= limit:
+        return text
+    return next(iter_chunks(text, limit - 2)).render(text) + "\n…"
+
+
+async def reply_with_document(message: Message, text: str, caption: str) -> Message:
+    """Reply with `text` as a Markdown file, built in memory, captioned with `caption`."""
+    data = text.encode()
+    chunk = render_chunk(caption)
+
+    async def send(chunk: RenderedChunk) -> Message:
+        # A fresh stream per attempt, an earlier one may have been read already
+        document = InputFile(io.BytesIO(data), filename=config.DOCUMENT_FILENAME)
+        with metrics.timed("telegram_send"):
+            if chunk.html is None:
+                return await message.reply_document(document, caption=chunk.text)
+            return await message.reply_document(
+                document, caption=chunk.html, parse_mode=ParseMode.HTML
+            )
+
+    try:
+        return await with_flood_control(lambda: send(chunk))
+    except BadRequest as e:
+        if chunk.html is None or not is_parse_error(e):
+            raise
+        config.logger.warning(f"Sending caption as plain text: {e}")
+        return await with_flood_control(lambda: send(chunk._replace(html=None)))
+
+
+async def deliver_response(message: Message, text: str) -> None:
+    """Send a complete response as formatted messages, or as a file with a preview.
+
+    Messages are sent one after another, each waiting out flood control, so
+    they arrive in order without fixed delays.
+    """
+    with metrics.timed("split_message"):
+        chunks = render_chunks(text)
+    if len(chunks) > 1 and wants_document(len(text), len(chunks)):
+        await reply_with_document(message, text, preview(text))
+        return
+
+    for chunk in chunks:
+        await with_flood_control(lambda: reply_formatted(message, chunk))
@@ -0,0 +1,248 @@
+import re
+from html import escape
+from typing import List, NamedTuple, Optional
+
+from telegram import Message
+from telegram.constants import ParseMode
+from telegram.error import BadRequest
+
+from poe_tg import config, metrics
+from poe_tg.utils import FENCE, split_message
+
+# Characters that may start inline markup; everything else is copied as a run
+PLAIN_RUN = re.compile(r"[^`\[*_~<>&]+")
+HEADING = re.compile(r"(#{1,6})\s+(.*)")
+BULLET = re.compile(r"(\s*)[-*+]\s+(.*)")
+LINK_SCHEMES = ("http://", "https://", "tg://", "mailto:")
+INLINE_TAGS = {"**": "b", "__": "b", "~~": "s", "*": "i", "_": "i"}
+# Chunks that still have too many entities after this are sent as plain text
+MIN_FORMATTED_CHUNK = 256
+
+
+def render_inline(line: str) -> str:
+    """Render the inline Markdown of one line (emphasis, code, links) as HTML.
+
+    Delimiters are matched with a stack in a single left-to-right pass; an
+    opening delimiter stays literal text until its closing one turns up, so
+    unmatched markers are shown as typed and tags always nest properly.
+    """
+    out: list[str] = []
+    stack: list[tuple[str, int]] = []
+    open_counts = dict.fromkeys(INLINE_TAGS, 0)
+    # Next "](" at or after the current position, found lazily so that many
+    # unmatched "[" on a line do not rescan it
+    link_mid = -2
+    i, length = 0, len(line)
+
+    while i < length:
+        run = PLAIN_RUN.match(line, i)
+        if run:
+            out.append(escape(run.group(), quote=False))
+            i = run.end()
+            continue
+
+        char = line[i]
+        if char == "`":
+            end = line.find("`", i + 1)
+            if end > i + 1:
+                out.append(f"<code>{escape(line[i + 1 : end], quote=False)}</code>")
+                i = end + 1
+                continue
+
+        elif char == "[":
+            if link_mid != -1 and link_mid < i:
+                link_mid = line.find("](", i)
+            close = line.find(")", link_mid + 2) if link_mid != -1 else -1
+            if close != -1:
+                label, url = line[i + 1 : link_mid], line[link_mid + 2 : close]
+                if url.startswith(LINK_SCHEMES) and " " not in url and "[" not in label:
+                    out.append(
+                        f'<a href="{escape(url)}">{escape(label, quote=False)}</a>'
+                    )
+                    i = close + 1
+                    continue
+
+        elif char in "*_~":
+            delimiter = line[i : i + 2] if line[i : i + 2] in INLINE_TAGS else char
+            if delimiter in INLINE_TAGS:
+                before = line[i - 1] if i else " "
+                end = i + len(delimiter)
+                after = line[end] if end < length else " "
+                can_open = not after.isspace()
+                can_close = not before.isspace() and open_counts[delimiter] > 0
+                if "_" in delimiter:
+                    # snake_case words are not emphasis
+                    can_open = can_open and not before.isalnum()
+                    can_close = can_close and not after.isalnum()
+
+                if can_close:
+                    # Delimiters opened inside this one and never closed stay literal
+                    while True:
+                        opened, index = stack.pop()
+                        open_counts[opened] -= 1
+                        if opened == delimiter:
+                            break
+                    out[index] = f"<{INLINE_TAGS[delimiter]}>"
+                    out.append(f"</{INLINE_TAGS[delimiter]}>")
+                elif can_open:
+                    stack.append((delimiter, len(out)))
+                    open_counts[delimiter] += 1
+                    out.append(delimiter)
+                else:
+                    out.append(delimiter)
+                i = end
+                continue
+
+        out.append(escape(char, quote=False))
+        i += 1
+
+    return "".join(out)
+
+
+def markdown_to_html(text: str) -> str:
+    """Convert model Markdown to the HTML subset Telegram accepts.
+
+    One pass over the lines: fenced code becomes ``<pre>``, tables are kept
+    aligned in ``<pre>`` (Telegram has no tables), headings turn bold, bullets
+    become "•", "> " quotes become ``<blockquote>`` and the rest goes through
+    `render_inline`. Everything else is escaped, so the result always parses.
+    """
+    out: list[str] = []
+    code: Optional[list[str]] = None
+    language = ""
+    table: list[str] = []
+    quote: list[str] = []
+
+    def flush_blocks() -> None:
+        if table:
+            out.append(f"<pre>{escape(chr(10).join(table), quote=False)}</pre>")
+            table.clear()
+        if quote:
+            out.append(f"<blockquote>{chr(10).join(quote)}</blockquote>")
+            quote.clear()
+
+    def flush_code() -> None:
+        assert code is not None
+        attribute = f' class="language-{escape(language)}"' if language else ""
+        body = escape("\n".join(code), quote=False)
+        out.append(f"<pre><code{attribute}>{body}</code></pre>")
+
+    for line in text.split("\n"):
+        stripped = line.strip()
+
+        if code is not None:
+            if stripped.startswith(FENCE) and not stripped.strip("`"):
+                flush_code()
+                code = None
+            else:
+                code.append(line)
+            continue
+
+        if stripped.startswith(FENCE):
+            flush_blocks()
+            code, language = [], stripped[len(FENCE) :].strip().split(" ")[0]
+            continue
+
+        if len(stripped) > 1 and stripped.startswith("|") and stripped.endswith("|"):
+            if quote:
+                flush_blocks()
+            table.append(stripped)
+            continue
+
+        if stripped.startswith(">"):
+            if table:
+                flush_blocks()
+            quote.append(render_inline(stripped[1:].lstrip()))
+            continue
+
+        flush_blocks()
+        heading = HEADING.fullmatch(stripped)
+        bullet = BULLET.fullmatch(line)
+        if heading:
+            out.append(f"<b>{render_inline(heading.group(2))}</b>")
+        elif bullet and stripped not in ("***", "---", "___"):
+            out.append(f"{bullet.group(1)}• {render_inline(bullet.group(2))}")
+        else:
+            out.append(render_inline(line))
+
+    if code is not None:
+        # Unclosed block, e.g. a truncated response
+        flush_code()
+    flush_blocks()
+    return "\n".join(out)
+
+
+def count_entities(html: str) -> int:
+    """Upper bound on the number of Telegram entities the HTML produces."""
+    return html.count("</")
+
+
+class RenderedChunk(NamedTuple):
+    """One message: the Markdown source and its HTML, None to send it as plain text."""
+
+    text: str
+    html: Optional[str]
+
+
+def render_chunks(
+    text: str, limit: int = config.TELEGRAM_MESSAGE_LIMIT
+) -> List[RenderedChunk]:
+    """Split a response into messages and render each one as Telegram HTML.
+
+    Splitting happens on the Markdown, which is never shorter than the text
+    Telegram shows, so chunks stay within the length limit. A chunk with more
+    formatting than Telegram allows in one message is split further.
+    """
+    if not config.FORMAT_RESPONSES:
+        return [RenderedChunk(chunk, None) for chunk in split_message(text, limit)]
+
+    chunks = []
+    for chunk in split_message(text, limit):
+        html = markdown_to_html(chunk)
+        if count_entities(html) <= config.TELEGRAM_MAX_ENTITIES:
+            chunks.append(RenderedChunk(chunk, html))
+        elif len(chunk) > MIN_FORMATTED_CHUNK:
+            chunks.extend(render_chunks(chunk, len(chunk) // 2))
+        else:
+            chunks.append(RenderedChunk(chunk, None))
+    return chunks
+
+
+def render_chunk(text: str) -> RenderedChunk:
+    """Render text that already fits in one message."""
+    if config.FORMAT_RESPONSES:
+        html = markdown_to_html(text)
+        if count_entities(html) <= config.TELEGRAM_MAX_ENTITIES:
+            return RenderedChunk(text, html)
+    return RenderedChunk(text, None)
+
+
+def is_parse_error(error: BadRequest) -> bool:
+    return "can't parse entities" in str(error).lower()
+
+
+async def reply_formatted(message: Message, chunk: RenderedChunk) -> Message:
+    """Reply with a rendered chunk, resending it as plain text if Telegram rejects the HTML."""
+    with metrics.timed("telegram_send"):
+        if chunk.html is not None:
+            try:
+                return await message.reply_text(chunk.html, parse_mode=ParseMode.HTML)
+            except BadRequest as e:
+                if not is_parse_error(e):
+                    raise
+                config.logger.warning(f"Sending response as plain text: {e}")
+        return await message.reply_text(chunk.text)
+
+
+async def edit_formatted(message: Message, chunk: RenderedChunk) -> None:
+    """Edit a message to show a rendered chunk, falling back to plain text like `reply_formatted`."""
+    with metrics.timed("telegram_send"):
+        if chunk.html is not None:
+            try:
+                await message.edit_text(chunk.html, parse_mode=ParseMode.HTML)
+                return
+            except BadRequest as e:
+                if not is_parse_error(e):
+                    raise
+                config.logger.warning(f"Showing response as plain text: {e}")
+        await message.edit_text(chunk.text)
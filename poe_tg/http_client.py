@@ -0,0 +1,138 @@
+import asyncio
+from importlib.util import find_spec
+from typing import AsyncIterator, Optional
+
+import fastapi_poe as fp
+import httpx
+
+from poe_tg import config, metrics
+
+
+# How much of an unread response body is read on close to keep its connection
+DRAIN_MAX_BYTES = 64 * 1024
+DRAIN_TIMEOUT = 1.0
+
+
+class DrainingStream(httpx.AsyncByteStream):
+    """Response body that reads what is left of itself when closed early.
+
+    fastapi_poe stops reading at the "done" event, before the end of the
+    body; over HTTP/1.1 the connection is then closed instead of going back
+    to the pool. Reading the few remaining bytes keeps it.
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream):
+        self.stream = stream
+        self.finished = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.stream:
+            yield chunk
+        self.finished = True
+
+    async def drain(self) -> None:
+        remaining = DRAIN_MAX_BYTES
+        async for chunk in self.stream:
+            remaining -= len(chunk)
+            if remaining < 0:
+                return
+
+    async def aclose(self) -> None:
+        try:
+            if not self.finished:
+                await asyncio.wait_for(self.drain(), DRAIN_TIMEOUT)
+        except Exception:
+            # The connection is closed below instead of reused
+            pass
+        finally:
+            await self.stream.aclose()
+
+
+class DrainingTransport(httpx.AsyncBaseTransport):
+    """Wrap every response body of `transport` in a `DrainingStream`."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self.transport.handle_async_request(request)
+        assert isinstance(response.stream, httpx.AsyncByteStream)
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=DrainingStream(response.stream),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+async def raise_for_status(response: httpx.Response) -> None:
+    """Fail on an error status before fastapi_poe reads the body as an event stream.
+
+    Otherwise it only sees the wrong content type and retries whatever the
+    status was. Client errors other than 429 are raised as `BotErrorNoRetry`,
+    which fastapi_poe passes on at once.
+    """
+    if response.status_code < 400:
+        return
+    await response.aread()
+    try:
+        response.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        if response.status_code < 500 and response.status_code != 429:
+            raise fp.BotErrorNoRetry(
+                f"Poe refused the request ({response.status_code} {response.reason_phrase})"
+            ) from e
+        raise
+
+
+class PoeHTTPClient:
+    """One `httpx.AsyncClient` for all Poe requests of the process.
+
+    Without it fastapi_poe opens a new client, and so a new TCP and TLS
+    connection, for every request. Started and stopped with the application;
+    until then `client` is None and fastapi_poe falls back to its own.
+    """
+
+    def __init__(self):
+        self.client: Optional[httpx.AsyncClient] = None
+        self.started = 0
+
+    async def start(self) -> None:
+        if self.client is not None:
+            return
+        # HTTP/2 needs the h2 package (httpx[http2])
+        http2 = config.POE_HTTP2 and find_spec("h2") is not None
+        if config.POE_HTTP2 and not http2:
+            config.logger.warning("POE_HTTP2 is set but h2 is not installed, using HTTP/1.1")
+        transport = httpx.AsyncHTTPTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=config.POE_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=config.POE_HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=config.POE_HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+        self.client = httpx.AsyncClient(
+            transport=DrainingTransport(transport),
+            # fastapi_poe's own default; the token timeouts are enforced per request
+            timeout=httpx.Timeout(600, connect=config.POE_HTTP_CONNECT_TIMEOUT),
+            event_hooks={"response": [raise_for_status]},
+        )
+        self.started += 1
+        config.logger.info(f"Poe HTTP client started ({'HTTP/2' if http2 else 'HTTP/1.1'})")
+
+    async def stop(self) -> None:
+        client, self.client = self.client, None
+        if client is not None:
+            await client.aclose()
+
+    def stats(self) -> dict[str, float]:
+        return {"open": int(self.client is not None), "started": self.started}
+
+
+poe_http = PoeHTTPClient()
+
+metrics.register_stats("poe_http", poe_http.stats)
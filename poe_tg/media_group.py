@@ -0,0 +1,34 @@
+import asyncio
+
+from telegram import Message
+
+from poe_tg import config
+
+
+class MediaGroupCollector:
+    """Collect the messages of a Telegram album so they can be answered together.
+
+    Telegram delivers every photo of an album as a separate update sharing one
+    `media_group_id`. The first message opens a group, later ones are added to
+    it, and `collect` hands back the whole album once no more are expected.
+    """
+
+    def __init__(self, wait: float = config.MEDIA_GROUP_WAIT):
+        self.wait = wait
+        self.pending: dict[str, list[Message]] = {}
+
+    def add(self, message: Message) -> bool:
+        """Add an album message, returning True if it opened a new group."""
+        group_id = str(message.media_group_id)
+        is_new = group_id not in self.pending
+        self.pending.setdefault(group_id, []).append(message)
+        return is_new
+
+    async def collect(self, media_group_id: str) -> list[Message]:
+        """Wait for the rest of the album and return all of its messages in order."""
+        await asyncio.sleep(self.wait)
+        messages = self.pending.pop(str(media_group_id), [])
+        return sorted(messages, key=lambda message: message.message_id)
+
+
+media_groups = MediaGroupCollector()
@@ -0,0 +1,272 @@
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterator, Optional
+
+from poe_tg import config
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds, wide enough for cache lookups as well as complete Poe responses
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for value in values
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter per combination of label values."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        for labels, value in list(self.values.items()):
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+
+
+class Histogram:
+    """Fixed-bucket histogram per combination of label values.
+
+    `observe` is a binary search and two additions; buckets are only made
+    cumulative when rendered.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Per label values: count per bucket (the last one is +Inf) and the sum
+        self.values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    def render(self) -> Iterator[str]:
+        names = self.labelnames + ("le",)
+        for labels, (counts, total) in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = format_labels(names, labels + (format_value(bound),))
+                yield f"{self.name}_bucket{le} {cumulative}"
+            label_text = format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_text} {format_value(total[0])}"
+            yield f"{self.name}_count{label_text} {cumulative}"
+
+
+class Gauge:
+    """Values read from `read` when metrics are scraped, keyed by label values."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...],
+        read: Callable[[], dict[tuple[str, ...], float]],
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.read = read
+
+    def render(self) -> Iterator[str]:
+        for labels, value in self.read().items():
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+
+
+class Stats:
+    """Numbers read from the components' own `stats()` when metrics are scraped.
+
+    Rendered as ``<name>{component="...",stat="..."}``; these mix counters
+    and gauges, so the family is untyped.
+    """
+
+    kind = "untyped"
+    labelnames = ("component", "stat")
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.sources: dict[str, Callable[[], dict[str, float]]] = {}
+
+    def render(self) -> Iterator[str]:
+        for component, read in list(self.sources.items()):
+            try:
+                stats = read()
+            except Exception as e:
+                config.logger.warning(f"Could not read {component} stats: {e}")
+                continue
+            for stat, value in stats.items():
+                labels = format_labels(self.labelnames, (component, stat))
+                yield f"{self.name}{labels} {format_value(value)}"
+
+
+class Registry:
+    """The metrics of the process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics: dict[str, Counter | Histogram | Gauge | Stats] = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds: Histogram = registry.register(
+    Histogram(
+        "poe_tg_stage_seconds",
+        "Time spent in each stage of answering a message",
+        ("stage",),
+    )
+)
+errors: Counter = registry.register(
+    Counter("poe_tg_errors_total", "Errors by stage and exception type", ("stage", "error"))
+)
+poe_requests: Counter = registry.register(
+    Counter("poe_tg_poe_requests_total", "Poe requests by bot and outcome", ("bot", "outcome"))
+)
+poe_fallbacks: Counter = registry.register(
+    Counter(
+        "poe_tg_poe_fallbacks_total",
+        "Requests handed to a fallback bot",
+        ("bot", "fallback"),
+    )
+)
+stats: Stats = registry.register(
+    Stats("poe_tg_stats", "Queue, cache, pool and limiter statistics by component")
+)
+
+
+def register_stats(component: str, read: Callable[[], dict[str, float]]) -> None:
+    """Expose a component's `stats()` dict, read when metrics are scraped."""
+    stats.sources[component] = read
+
+
+def observe(stage: str, seconds: float) -> None:
+    if config.METRICS_ENABLED:
+        stage_seconds.observe(seconds, stage)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Record how long the block takes as `stage`, and count its exceptions."""
+    if not config.METRICS_ENABLED:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        errors.inc(stage, type(e).__name__)
+        raise
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage)
+
+
+class MetricsExporter:
+    """Serve /metrics from a background thread, for when there is no FastAPI app.
+
+    The thread only does HTTP; rendering is handed to the event loop so it
+    never reads the counters while the bot is updating them.
+    """
+
+    def __init__(self, port: int = config.METRICS_PORT, host: str = "0.0.0.0"):
+        self.port = port
+        self.host = host
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.thread: Optional[threading.Thread] = None
+
+    async def start(self) -> None:
+        if self.server is not None or not config.METRICS_ENABLED or self.port <= 0:
+            return
+        loop = asyncio.get_running_loop()
+
+        async def collect() -> str:
+            return registry.render()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = asyncio.run_coroutine_threadsafe(collect(), loop).result(5).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="metrics-exporter", daemon=True
+        )
+        self.thread.start()
+        config.logger.info(f"Serving metrics on port {self.server.server_address[1]}")
+
+    async def stop(self) -> None:
+        server, self.server = self.server, None
+        if server is None:
+            return
+        # shutdown() blocks until serve_forever returns, keep it off the loop
+        await asyncio.get_running_loop().run_in_executor(None, server.shutdown)
+        server.server_close()
+
+
+exporter = MetricsExporter()
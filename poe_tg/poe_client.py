@@ -1,100 +1,386 @@
-from typing import Literal, Optional, cast
+import asyncio
+import math
+import time
+from contextlib import aclosing
+from typing import AsyncIterator, Optional
 import fastapi_poe as fp
-from poe_tg import config
-from poe_tg.db.database import (
-    get_conversation_history,
-    add_message_to_history,
-    get_user_preference,
+from fastapi_poe.client import PROTOCOL_VERSION
+from poe_tg import config, metrics, tracing
+from poe_tg.circuit_breaker import (
+    CircuitOpenError,
+    PoeTimeoutError,
+    backoff_delay,
+    is_refusal,
+    is_retryable,
+    poe_breakers,
 )
-from telegram import Update, File
+from poe_tg.context import estimate_tokens, select_context
+from poe_tg.http_client import poe_http
+from poe_tg.rate_limit import FairScheduler, bot_limiter, user_weights
+from poe_tg.summarizer import summarizer
+from poe_tg.db.database import Exchange, load_exchange, save_exchange
+from telegram import Bot, Message, Update
 from telegram.ext import ContextTypes
 
+# Bounds concurrent Telegram downloads + Poe uploads across all chats
+upload_semaphore = asyncio.Semaphore(config.UPLOAD_CONCURRENCY)
+# Bounds Poe requests in flight across all chats, sharing slots fairly between users
+poe_scheduler = FairScheduler(config.POE_MAX_CONCURRENCY)
 
-async def get_poe_response(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+metrics.register_stats("poe_scheduler", poe_scheduler.stats)
+
+
+@tracing.traced()
+async def get_poe_response(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    album: Optional[list[Message]] = None,
+) -> str:
     """Get response from Poe API with conversation history."""
+    async with aclosing(stream_poe_response(update, context, album)) as stream:
+        return "".join([text async for text in stream])
+
+
+def error_reply(error: Exception, partial: bool = False) -> str:
+    """Log a failed request and return the text telling the user about it."""
+    config.logger.error(
+        f"Error getting response from Poe: {error} (trace {tracing.current_trace_id()})"
+    )
+    separator = "\n\n" if partial else ""
+    return f"{separator}Sorry, I encountered an error: {str(error)}"
+
+
+async def stream_poe_response(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    album: Optional[list[Message]] = None,
+) -> AsyncIterator[str]:
+    """Stream the Poe response text as it arrives, saving the exchange once complete.
+
+    `album` holds all messages of a media group when they are answered together.
+    Errors are reported as the last part of the text. Consume it with
+    `contextlib.aclosing`, so the Poe request and its scheduler slot are
+    released as soon as the caller stops reading, e.g. after a Telegram error.
+    """
     if not update.effective_user or not update.message:
-        return "Sorry, I encountered an error: Invalid user or message"
+        yield "Sorry, I encountered an error: Invalid user or message"
+        return
 
-    if not update.message.caption and not update.message.text:
-        return "Sorry, I encountered an error: Could not find message text, please attach a caption when sending a file/photo"
+    incoming = album or [update.message]
+    message_text = next((m.text or m.caption for m in incoming if m.text or m.caption), "") or ""
+    if not message_text:
+        yield "Sorry, I encountered an error: Could not find message text, please attach a caption when sending a file/photo"
+        return
 
+    # Start uploading attachments right away so it overlaps with the database work
+    upload = asyncio.ensure_future(upload_attachments(context.bot, incoming))
+    user_id = update.effective_user.id
+    # Errors are only reported outside the try blocks: yielding while the
+    # generator is being closed is not allowed
+    error: Optional[Exception] = None
     try:
-        # Get recent conversation history
-        user_id = update.effective_user.id
-        preference = get_user_preference(user_id)
+        # Preference, summary and recent history, in one session on a cache miss
+        exchange = await load_exchange(user_id)
+        preference = exchange.preference
 
         # Extract values from the preference object safely
         system_prompt = str(preference.system_prompt)
         temperature = float(preference.temperature)  # type: ignore
         bot_name = str(preference.bot_name)
-        message_text = update.message.text or update.message.caption or ""
-
-        # check message if there is any file attached
-        file_paths: list[File] = []
-        if update.message.photo or update.message.document:
-            if update.message.photo:
-                file = await context.bot.get_file(update.message.photo[-1].file_id)
-            elif update.message.document:
-                file = await context.bot.get_file(update.message.document.file_id)
-            file_paths.append(file)
-
-        # Get conversation history
-        attachments = [
-            fp.upload_file_sync(file_url=file.file_path, api_key=config.POE_API_KEY)
-            for file in file_paths
-        ]
-        messages = build_message(user_id, system_prompt, message_text, attachments)
-
-        # Use the direct API approach as shown in Poe documentation
-        full_response = ""
-        async for partial in fp.get_bot_response(
-            messages=messages,
-            bot_name=bot_name,
-            api_key=config.POE_API_KEY,
-            temperature=temperature,
-        ):
-            full_response += partial.text
-
-        # Save the conversation to history
-        add_message_to_history(user_id, "user", message_text, bot_name, attachments)
-        add_message_to_history(user_id, "bot", full_response, bot_name)
-
-        return full_response
     except Exception as e:
-        config.logger.error(f"Error getting response from Poe: {e}")
-        return f"Sorry, I encountered an error: {str(e)}"
+        error = e
+    if error is not None:
+        upload.cancel()
+        yield error_reply(error)
+        return
+
+    if not bot_limiter.try_acquire(bot_name):
+        upload.cancel()
+        metrics.poe_requests.inc(bot_name, "rate_limited")
+        wait = bot_limiter.retry_after(bot_name)
+        yield f"{bot_name} is getting a lot of requests right now. Please try again in {wait:.0f} seconds."
+        return
 
+    try:
+        with metrics.timed("build_message"):
+            messages = await build_message(
+                user_id, system_prompt, message_text, bot_name=bot_name, exchange=exchange
+            )
+        messages[-1].attachments = await upload
+    except Exception as e:
+        error = e
+    if error is not None:
+        upload.cancel()
+        yield error_reply(error)
+        return
 
-def build_message(
+    response_parts: list[str] = []
+    answered_by = bot_name
+    first_token: Optional[float] = None
+    parent_span = tracing.current_span.get()
+    weight = user_weights.get(update.effective_user.username or "", 1.0)
+    start = time.perf_counter()
+    try:
+        async with poe_scheduler.slot(user_id, weight):
+            start = time.perf_counter()
+            async with aclosing(stream_bot_response(messages, bot_name, temperature)) as stream:
+                while True:
+                    try:
+                        answered_by, text = await anext(stream)
+                    except StopAsyncIteration:
+                        break
+                    except Exception as e:
+                        error = e
+                        break
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                        metrics.observe("poe_first_token", first_token)
+                    response_parts.append(text)
+                    yield text
+    finally:
+        # Includes the time the caller takes to show each part. Recorded once
+        # the stream is done, also when the caller stops early: a span kept
+        # open across the yields above would leak into the caller's context.
+        metrics.observe("poe_total", time.perf_counter() - start)
+        tracing.record(
+            "poe.response",
+            start,
+            error,
+            parent_span,
+            bot=bot_name,
+            answered_by=answered_by,
+            first_token_ms=round(first_token * 1000, 1) if first_token is not None else None,
+            parts=len(response_parts),
+        )
+    if error is not None:
+        metrics.errors.inc("poe_total", type(error).__name__)
+        yield error_reply(error, partial=bool(response_parts))
+        return
+
+    try:
+        # Save both sides of the exchange to history together
+        await save_exchange(
+            user_id,
+            answered_by,
+            message_text,
+            "".join(response_parts),
+            messages[-1].attachments,
+        )
+
+        # Compact older turns in the background before the history grows too long
+        if len(exchange.history) + 2 >= config.SUMMARY_TRIGGER_MESSAGES:
+            summarizer.schedule(user_id)
+    except Exception as e:
+        error = e
+    if error is not None:
+        yield error_reply(error, partial=True)
+
+
+def fallback_chain(bot_name: str) -> list[str]:
+    """The bot followed by its `fallback` bots from AVAILABLE_BOTS, without repeats."""
+    chain = [bot_name]
+    while config.POE_FALLBACKS and len(chain) <= config.POE_MAX_FALLBACKS:
+        fallback = config.AVAILABLE_BOTS.get(chain[-1], {}).get("fallback")
+        if not fallback or fallback in chain:
+            break
+        chain.append(fallback)
+    return chain
+
+
+async def stream_with_timeouts(
+    messages: list[fp.ProtocolMessage],
+    bot_name: str,
+    temperature: float,
+    first_token_timeout: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """Stream one Poe request, giving up if the first or any later token takes too long.
+
+    The first token is waited for `first_token_timeout` seconds, by default
+    POE_CONNECT_TIMEOUT.
+    """
+    if first_token_timeout is None:
+        first_token_timeout = config.POE_CONNECT_TIMEOUT
+    request = fp.QueryRequest(
+        query=messages,
+        user_id="",
+        conversation_id="",
+        message_id="",
+        version=PROTOCOL_VERSION,
+        type="query",
+        temperature=temperature,
+    )
+    # One try: stream_bot_response retries, with backoff, the breaker and the deadline
+    stream = fp.stream_request(
+        request=request,
+        bot_name=bot_name,
+        api_key=config.POE_API_KEY,
+        num_tries=1,
+        session=poe_http.client,
+    )
+    first = True
+    try:
+        while True:
+            timeout = first_token_timeout if first else config.POE_IDLE_TIMEOUT
+            try:
+                partial = await asyncio.wait_for(anext(stream), timeout)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                waited = "first" if first else "next"
+                raise PoeTimeoutError(
+                    f"{bot_name} did not send its {waited} token within {timeout:g} seconds"
+                ) from None
+            first = False
+            yield partial.text
+    finally:
+        await stream.aclose()
+
+
+async def stream_bot_response(
+    messages: list[fp.ProtocolMessage], bot_name: str, temperature: float
+) -> AsyncIterator[tuple[str, str]]:
+    """Stream `(answering bot, text)` pairs, retrying and falling back before the first token.
+
+    A request that fails with a retryable error (see `is_retryable`) is
+    repeated after a jittered exponential backoff; once the bot's retries are
+    used up, or its circuit breaker is open, the next bot of `fallback_chain`
+    takes over. All of this together gets POE_TOTAL_TIMEOUT seconds to
+    produce the first token. Other errors, and any error after the first
+    token has been passed on, are raised as they are.
+    """
+    deadline = time.monotonic() + (config.POE_TOTAL_TIMEOUT or math.inf)
+    last_error: Exception = CircuitOpenError(f"{bot_name} is unavailable")
+    for candidate in fallback_chain(bot_name):
+        if time.monotonic() >= deadline:
+            break
+        if candidate != bot_name:
+            config.logger.warning(f"Falling back from {bot_name} to {candidate}: {last_error}")
+            metrics.poe_fallbacks.inc(bot_name, candidate)
+        breaker = poe_breakers.get(candidate)
+
+        for attempt in range(config.POE_RETRIES + 1):
+            if attempt:
+                delay = backoff_delay(
+                    attempt, config.POE_RETRY_BASE_DELAY, config.POE_RETRY_MAX_DELAY
+                )
+                await asyncio.sleep(max(0.0, min(delay, deadline - time.monotonic())))
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not breaker.allow():
+                metrics.poe_requests.inc(candidate, "circuit_open")
+                last_error = CircuitOpenError(
+                    f"{candidate} is unavailable, retrying in {breaker.retry_after():.0f} seconds"
+                )
+                break
+
+            started = False
+            try:
+                async with aclosing(
+                    stream_with_timeouts(
+                        messages,
+                        candidate,
+                        temperature,
+                        min(config.POE_CONNECT_TIMEOUT, remaining),
+                    )
+                ) as stream:
+                    async for text in stream:
+                        started = True
+                        yield candidate, text
+            except Exception as e:
+                timed_out = isinstance(e, PoeTimeoutError)
+                metrics.poe_requests.inc(candidate, "timeout" if timed_out else "error")
+                if not is_retryable(e):
+                    # A refused request at least shows the bot answering, so a
+                    # half-open breaker closes again; other errors, our own
+                    # bugs included, leave the breaker as it is
+                    if is_refusal(e):
+                        breaker.record_success()
+                    raise
+                breaker.record_failure()
+                if started:
+                    raise
+                config.logger.warning(
+                    f"Poe request to {candidate} failed (attempt {attempt + 1}): {e}"
+                )
+                last_error = e
+                continue
+            breaker.record_success()
+            metrics.poe_requests.inc(candidate, "ok")
+            return
+
+    if time.monotonic() >= deadline:
+        raise PoeTimeoutError(
+            f"{bot_name} did not answer within {config.POE_TOTAL_TIMEOUT:g} seconds"
+        ) from last_error
+    raise last_error
+
+
+def attachment_file_ids(messages: list[Message]) -> list[str]:
+    """Collect the Telegram file ids of photos and documents in the messages."""
+    file_ids = []
+    for message in messages:
+        if message.photo:
+            # The last size is the largest
+            file_ids.append(message.photo[-1].file_id)
+        elif message.document:
+            file_ids.append(message.document.file_id)
+    return file_ids
+
+
+@tracing.traced()
+async def upload_attachment(bot: Bot, file_id: str) -> fp.Attachment:
+    """Resolve a Telegram file and upload it to Poe."""
+    async with upload_semaphore:
+        file = await bot.get_file(file_id)
+        # Not given the shared client: upload_file closes the session it is passed
+        return await fp.upload_file(file_url=file.file_path, api_key=config.POE_API_KEY)
+
+
+async def upload_attachments(bot: Bot, messages: list[Message]) -> list[fp.Attachment]:
+    """Upload all attachments of the messages to Poe concurrently."""
+    file_ids = attachment_file_ids(messages)
+    if not file_ids:
+        return []
+    with metrics.timed("attachment_upload"):
+        return list(
+            await asyncio.gather(*(upload_attachment(bot, file_id) for file_id in file_ids))
+        )
+
+
+@tracing.traced()
+async def build_message(
     user_id: int,
     system_prompt: str,
     message_text: str,
     attachments: Optional[list[fp.Attachment]] = None,
+    bot_name: str = config.DEFAULT_BOT,
+    exchange: Optional[Exchange] = None,
 ) -> list[fp.ProtocolMessage]:
-    history = get_conversation_history(user_id, limit=10)
+    if exchange is None:
+        exchange = await load_exchange(user_id)
+    history = exchange.history
+    summary = exchange.summary
 
     messages = []
 
     if system_prompt:
         messages.append(fp.ProtocolMessage(role="system", content=system_prompt))
 
-    for msg in history:
-        role = cast(Literal["system", "user", "bot"], msg.role)
-        content = str(msg.content)
-        historic_attachment = []
-        if msg.attachments:  # type: ignore
-            historic_attachment = [
-                fp.Attachment(
-                    url=a["url"], content_type=a["content_type"], name=a["name"], parsed_content=a["parsed_content"]  # type: ignore
-                )
-                for a in msg.attachments
-            ]
+    # Older turns are only sent in summarized form
+    summary_text = ""
+    if summary.content:
+        summary_text = f"Summary of the earlier conversation:\n{summary.content}"
+        messages.append(fp.ProtocolMessage(role="system", content=summary_text))
 
-        messages.append(
-            fp.ProtocolMessage(
-                role=role, content=content, attachments=historic_attachment
-            )
-        )
+    # Whatever the prompts and new message leave of the bot's budget goes to history
+    budget = (
+        config.context_budget(bot_name)
+        - estimate_tokens(system_prompt)
+        - estimate_tokens(summary_text)
+        - estimate_tokens(message_text)
+    )
+    messages.extend(select_context(history, budget))
 
     messages.append(
         fp.ProtocolMessage(
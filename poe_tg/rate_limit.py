@@ -0,0 +1,179 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Hashable
+
+from poe_tg import config, metrics
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(
+        self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic
+    ):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated_at = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Take tokens if available, without waiting."""
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def retry_after(self, tokens: float = 1) -> float:
+        """Seconds until `tokens` will be available."""
+        self._refill()
+        if self.tokens >= tokens or self.rate <= 0:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets per key, e.g. per Telegram user or per Poe bot.
+
+    At most `max_keys` buckets are kept; the least recently used is forgotten
+    first, which is harmless because an idle bucket would be full anyway.
+    """
+
+    def __init__(
+        self,
+        rate_per_minute: float,
+        burst: float,
+        max_keys: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: OrderedDict[Hashable, TokenBucket] = OrderedDict()
+        self.limited = 0
+
+    def _bucket(self, key: Hashable) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst, self.clock)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def try_acquire(self, key: Hashable) -> bool:
+        """Take one token for `key`, returning False if it is over its limit."""
+        if self.rate <= 0:
+            return True
+        if self._bucket(key).try_acquire():
+            return True
+        self.limited += 1
+        return False
+
+    def retry_after(self, key: Hashable) -> float:
+        """Seconds until `key` may send again."""
+        return self._bucket(key).retry_after()
+
+    def stats(self) -> dict[str, int]:
+        return {"keys": len(self._buckets), "limited": self.limited}
+
+
+class FairScheduler:
+    """Hand out a fixed number of slots fairly across keys (start-time fair queueing).
+
+    Each request gets a virtual start tag: the later of the scheduler's virtual
+    time and the finish tag of the key's previous request. A key's requests
+    advance its tag by ``1 / weight``, so a user with many queued requests is
+    served in turn with everyone else instead of starving them, and a key with
+    weight 2 gets twice the share of one with weight 1.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.active = 0
+        self.virtual_time = 0.0
+        self._finish_tags: dict[Hashable, float] = {}
+        self._pending: dict[Hashable, int] = {}
+        self._waiting: list[tuple[float, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, future in self._waiting if not future.done())
+
+    def stats(self) -> dict[str, int]:
+        return {"capacity": self.capacity, "active": self.active, "waiting": self.waiting}
+
+    @asynccontextmanager
+    async def slot(self, key: Hashable, weight: float = 1.0) -> AsyncIterator[None]:
+        """Wait for a slot in fair order and hold it for the duration of the block."""
+        start = max(self.virtual_time, self._finish_tags.get(key, 0.0))
+        self._finish_tags[key] = start + 1 / weight
+        self._pending[key] = self._pending.get(key, 0) + 1
+        try:
+            await self._acquire(start)
+            self.virtual_time = max(self.virtual_time, start)
+            try:
+                yield
+            finally:
+                self._release()
+        finally:
+            self._pending[key] -= 1
+            if not self._pending[key]:
+                del self._pending[key]
+                del self._finish_tags[key]
+
+    async def _acquire(self, start: float) -> None:
+        if self.active < self.capacity and not self.waiting:
+            self.active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (start, next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot was handed to us just as we were cancelled; pass it on
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        while self._waiting:
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                # Hand the slot straight to the next request in fair order
+                future.set_result(None)
+                return
+        self.active -= 1
+
+
+def parse_weights(value: str) -> dict[str, float]:
+    """Parse "name:weight,name:weight" into a mapping."""
+    weights = {}
+    for item in value.split(","):
+        name, _, weight = item.partition(":")
+        if name.strip() and weight.strip():
+            weights[name.strip()] = float(weight)
+    return weights
+
+
+user_limiter = RateLimiter(config.USER_RATE_PER_MINUTE, config.USER_RATE_BURST)
+bot_limiter = RateLimiter(config.BOT_RATE_PER_MINUTE, config.BOT_RATE_BURST)
+user_weights = parse_weights(config.USER_WEIGHTS)
+
+metrics.register_stats("user_limiter", user_limiter.stats)
+metrics.register_stats("bot_limiter", bot_limiter.stats)
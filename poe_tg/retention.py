@@ -0,0 +1,141 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from poe_tg import config, metrics
+from poe_tg.db.database import (
+    create_history_partition,
+    delete_excess_history,
+    delete_old_history,
+    delete_processed_updates,
+    drop_history_partition,
+    history_partition_month,
+    history_partitions,
+    next_month,
+)
+
+
+async def maintain_history_partitions(cutoff: Optional[datetime]) -> int:
+    """Create upcoming monthly partitions and drop those entirely before `cutoff`.
+
+    Does nothing unless the Postgres history table is partitioned. Returns the
+    number of partitions dropped.
+    """
+    partitions = await history_partitions()
+    if not partitions:
+        return 0
+
+    month = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    for _ in range(config.HISTORY_PARTITION_MONTHS_AHEAD + 1):
+        await create_history_partition(month)
+        month = next_month(month)
+
+    dropped = 0
+    for name in partitions:
+        if cutoff and next_month(history_partition_month(name)) <= cutoff:
+            await drop_history_partition(name)
+            config.logger.info(f"Dropped history partition {name}")
+            dropped += 1
+    return dropped
+
+
+class HistoryRetention:
+    """Periodically prune old conversation history, a small batch at a time.
+
+    Messages older than `max_age` and beyond the newest `max_messages` of each
+    user are deleted in batches of `batch_size` rows with a `pause` between
+    batches, so no statement holds locks for long. On a partitioned Postgres
+    table whole months past `max_age` are dropped as partitions first. Old
+    processed update ids are pruned the same way.
+    """
+
+    def __init__(
+        self,
+        max_age: Optional[timedelta] = (
+            timedelta(days=config.HISTORY_MAX_AGE_DAYS)
+            if config.HISTORY_MAX_AGE_DAYS > 0
+            else None
+        ),
+        max_messages: int = config.HISTORY_MAX_MESSAGES_PER_USER,
+        interval: float = config.RETENTION_INTERVAL,
+        batch_size: int = config.RETENTION_BATCH_SIZE,
+        pause: float = config.RETENTION_BATCH_PAUSE,
+    ):
+        self.max_age = max_age
+        self.max_messages = max_messages
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.task: Optional[asyncio.Task] = None
+        # Totals across passes, as returned by prune
+        self.deleted = {"partitions": 0, "expired": 0, "excess": 0, "processed_updates": 0}
+        self.failures = 0
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None
+
+    def stats(self) -> dict[str, int]:
+        return {**self.deleted, "failures": self.failures}
+
+    async def prune(self) -> dict[str, int]:
+        """Run one pruning pass, returning how much was deleted."""
+        now = datetime.now()
+        cutoff = now - self.max_age if self.max_age else None
+        deleted = {
+            "partitions": await maintain_history_partitions(cutoff),
+            "expired": 0,
+            "excess": 0,
+            "processed_updates": await self._in_batches(
+                lambda: delete_processed_updates(
+                    now - timedelta(hours=config.PROCESSED_UPDATES_MAX_AGE_HOURS),
+                    self.batch_size,
+                )
+            ),
+        }
+        if cutoff:
+            deleted["expired"] = await self._in_batches(
+                lambda: delete_old_history(cutoff, self.batch_size)
+            )
+        if self.max_messages > 0:
+            deleted["excess"] = await self._in_batches(
+                lambda: delete_excess_history(self.max_messages, self.batch_size)
+            )
+        return deleted
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self.task = asyncio.create_task(self._run(), name="history-retention")
+
+    async def stop(self) -> None:
+        task, self.task = self.task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _in_batches(self, delete_batch: Callable[[], Awaitable[int]]) -> int:
+        total = 0
+        while True:
+            deleted = await delete_batch()
+            total += deleted
+            if deleted < self.batch_size:
+                return total
+            await asyncio.sleep(self.pause)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                deleted = await self.prune()
+                for key, count in deleted.items():
+                    self.deleted[key] += count
+                if any(deleted.values()):
+                    config.logger.info(f"History retention: {deleted}")
+            except Exception as e:
+                self.failures += 1
+                config.logger.error(f"Error pruning history: {e}")
+            await asyncio.sleep(self.interval)
+
+
+retention = HistoryRetention()
+metrics.register_stats("retention", retention.stats)
@@ -0,0 +1,186 @@
+import time
+from typing import Optional
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+
+from poe_tg import config, metrics
+from poe_tg.delivery import reply_with_document, wants_document_for
+from poe_tg.formatting import (
+    RenderedChunk,
+    edit_formatted,
+    render_chunk,
+    render_chunks,
+    reply_formatted,
+)
+from poe_tg.utils import iter_chunks, retry_after_seconds, with_flood_control
+
+
+class StreamingReply:
+    """Show a streamed response by progressively editing Telegram messages.
+
+    A placeholder reply is sent first and then edited as text arrives. Once the
+    text outgrows Telegram's message limit the full part is finalized and the
+    rest continues in a new reply. Text is shown as typed while it streams and
+    formatted once a message is finalized. Edits slow down whenever Telegram
+    applies flood control and speed back up as edits succeed again.
+
+    A response that grows past the document threshold stops producing new
+    messages: the current one is kept as a preview and the whole response is
+    sent as a file when the stream finishes.
+    """
+
+    def __init__(self, message: Message, limit: int = config.TELEGRAM_MESSAGE_LIMIT):
+        self.message = message
+        self.limit = limit
+        self.current: Optional[Message] = None
+        self.text = ""
+        self.shown_text = ""
+        # Everything streamed so far, in case it ends up sent as a file
+        self.parts: list[str] = []
+        self.length = 0
+        self.as_document = False
+        self.interval = config.STREAM_EDIT_INTERVAL
+        self.last_edit = 0.0
+        self.paused_until = 0.0
+        self.started_at = time.monotonic()
+        self.first_visible_at: Optional[float] = None
+
+    async def start(self) -> None:
+        """Send the placeholder message that will be edited."""
+        self.started_at = time.monotonic()
+        with metrics.timed("telegram_send"):
+            self.current = await with_flood_control(
+                lambda: self.message.reply_text(config.STREAM_PLACEHOLDER)
+            )
+        self.last_edit = time.monotonic()
+
+    async def append(self, delta: str) -> None:
+        """Add newly streamed text and edit the reply if an update is due."""
+        self.parts.append(delta)
+        self.length += len(delta)
+        if self.as_document:
+            return
+        if wants_document_for(self.length, self.limit):
+            self.as_document = True
+            return
+        self.text += delta
+
+        while len(self.text) > self.limit:
+            if not await self._hand_over():
+                break
+
+        if self._edit_due():
+            await self._edit(self._visible_text())
+
+    async def finish(self) -> None:
+        """Make sure the complete text is shown."""
+        if self.as_document:
+            await self._finish_document()
+            return
+
+        if not self.text.strip():
+            if self.current is not None:
+                await with_flood_control(
+                    lambda: self._edit("Sorry, I received an empty response.", force=True)
+                )
+            return
+
+        with metrics.timed("split_message"):
+            chunks = render_chunks(self.text, self.limit)
+        for chunk in chunks:
+            if not (chunk.html is None and chunk.text == self.shown_text):
+                await with_flood_control(lambda: self._show(chunk))
+            self.current = None
+            self.shown_text = ""
+
+    async def _finish_document(self) -> None:
+        """Finalize the current message as a preview and send the full response as a file."""
+        # Nothing may have been shown yet if the first delta was already too long
+        text = self.text or "".join(self.parts)
+        preview = next(iter_chunks(text, self.limit - 2)).render(text) + "\n…"
+        await with_flood_control(lambda: self._show(render_chunk(preview)))
+        await reply_with_document(
+            self.message,
+            "".join(self.parts),
+            f"Full response attached ({self.length} characters).",
+        )
+        self.current = None
+        self.shown_text = ""
+
+    def _edit_due(self) -> bool:
+        now = time.monotonic()
+        if now < self.paused_until or self._visible_text() == self.shown_text:
+            return False
+
+        elapsed = now - self.last_edit
+        if elapsed >= self.interval:
+            return True
+
+        # The character trigger slows down together with the adaptive interval
+        slowdown = self.interval / config.STREAM_EDIT_INTERVAL
+        min_interval = config.STREAM_MIN_EDIT_INTERVAL * slowdown
+        new_chars = len(self.text) - len(self.shown_text)
+        return new_chars >= config.STREAM_EDIT_CHARS and elapsed >= min_interval
+
+    def _visible_text(self) -> str:
+        """The text to show; past the limit only whitespace can follow, see `_hand_over`."""
+        return self.text if len(self.text) <= self.limit else self.text.rstrip()
+
+    async def _hand_over(self) -> bool:
+        """Finalize the current message at a clean break and continue in a new one.
+
+        Returns False, leaving the message open, when only whitespace follows
+        the break: there is nothing to continue with yet.
+        """
+        chunks = iter_chunks(self.text, self.limit)
+        head, rest = next(chunks), next(chunks, None)
+        if rest is None:
+            return False
+        # A code block cut in two is closed here and reopened in the next message
+        finished = render_chunk(head.render(self.text))
+        self.text = rest.prefix + self.text[rest.start :]
+        await with_flood_control(lambda: self._show(finished))
+
+        self.current = None
+        self.shown_text = ""
+        return True
+
+    async def _show(self, chunk: RenderedChunk) -> None:
+        """Finalize the current message with the formatted text."""
+        if self.current is None:
+            self.current = await reply_formatted(self.message, chunk)
+            return
+        try:
+            await edit_formatted(self.current, chunk)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+
+    async def _edit(self, text: str, force: bool = False) -> None:
+        """Show `text`, backing off instead of failing when Telegram throttles us."""
+        try:
+            with metrics.timed("telegram_send"):
+                if self.current is None:
+                    self.current = await self.message.reply_text(text)
+                else:
+                    await self.current.edit_text(text)
+        except RetryAfter as e:
+            if force:
+                raise
+            self.paused_until = time.monotonic() + retry_after_seconds(e)
+            self.interval = min(self.interval * 2, config.STREAM_MAX_EDIT_INTERVAL)
+            return
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+
+        self.shown_text = text
+        self.last_edit = time.monotonic()
+        self.interval = max(config.STREAM_EDIT_INTERVAL, self.interval * 0.9)
+
+        if self.first_visible_at is None:
+            self.first_visible_at = self.last_edit
+            config.logger.debug(
+                f"First streamed text visible after {(self.first_visible_at - self.started_at) * 1000:.0f} ms"
+            )
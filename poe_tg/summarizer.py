@@ -0,0 +1,158 @@
+import asyncio
+from typing import Optional
+
+import fastapi_poe as fp
+
+from poe_tg import config, metrics
+from poe_tg.db.database import (
+    get_conversation_history,
+    get_conversation_summary,
+    save_conversation_summary,
+)
+from poe_tg.http_client import poe_http
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a chat between a user and an AI assistant. "
+    "Update the summary with the new messages. Keep facts, names, decisions, open "
+    "questions and the user's preferences; drop small talk. Reply with the summary only."
+)
+
+
+async def summarize_history(user_id: int) -> bool:
+    """Fold a user's older turns into their stored summary.
+
+    Returns True if a new summary was written, False if there was not enough
+    unsummarized history to bother.
+    """
+    summary = await get_conversation_summary(user_id)
+    rows = await get_conversation_history(
+        user_id,
+        limit=None,
+        after_id=int(summary.summarized_until_id),  # type: ignore
+    )
+    if len(rows) < config.SUMMARY_TRIGGER_MESSAGES:
+        return False
+
+    to_summarize = rows[: len(rows) - config.SUMMARY_KEEP_MESSAGES]
+    if not to_summarize:
+        return False
+
+    transcript = "\n\n".join(
+        f"{'User' if row.role == 'user' else 'Assistant'}: {row.content}"
+        for row in to_summarize
+    )
+    prompt = (
+        f"Current summary:\n{summary.content or '(none)'}\n\n"
+        f"New messages:\n{transcript}"
+    )
+
+    content = await fp.get_final_response(
+        [
+            fp.ProtocolMessage(role="system", content=SUMMARY_INSTRUCTIONS),
+            fp.ProtocolMessage(role="user", content=prompt),
+        ],
+        bot_name=config.SUMMARY_BOT,
+        api_key=config.POE_API_KEY,
+        session=poe_http.client,
+    )
+    if not await save_conversation_summary(
+        user_id, content.strip(), int(to_summarize[-1].id)  # type: ignore
+    ):
+        config.logger.info(f"History of user {user_id} was cleared, dropping its summary")
+        return False
+    config.logger.info(f"Summarized {len(to_summarize)} messages for user {user_id}")
+    return True
+
+
+class HistorySummarizer:
+    """Run history summarization in background workers, off the request path.
+
+    `schedule` is cheap and never blocks: a user is queued at most once at a
+    time and requests are dropped (and retried on a later message) when the
+    queue is full. `discard` drops a user's queued request, e.g. when their
+    history is cleared.
+    """
+
+    def __init__(
+        self,
+        workers: int = config.SUMMARY_WORKERS,
+        queue_size: int = config.SUMMARY_QUEUE_SIZE,
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue: Optional[asyncio.Queue[int]] = None
+        self.queued: set[int] = set()
+        # Queued users whose request was discarded before a worker got to it
+        self.discarded: set[int] = set()
+        self.tasks: list[asyncio.Task] = []
+        self.summarized = 0
+        self.failures = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self.tasks)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "queued": self.queue.qsize() if self.queue else 0,
+            "summarized": self.summarized,
+            "failures": self.failures,
+        }
+
+    def schedule(self, user_id: int) -> None:
+        """Queue a user's history for summarization."""
+        if not self.running or self.queue is None:
+            return
+        if user_id in self.queued:
+            # The request already in the queue serves this one too
+            self.discarded.discard(user_id)
+            return
+        try:
+            self.queue.put_nowait(user_id)
+        except asyncio.QueueFull:
+            config.logger.warning("Summary queue is full, skipping summarization")
+            return
+        self.queued.add(user_id)
+
+    def discard(self, user_id: int) -> None:
+        """Drop the user's queued summarization, if any."""
+        if user_id in self.queued:
+            self.discarded.add(user_id)
+
+    async def start(self) -> None:
+        if self.running or not config.SUMMARY_ENABLED:
+            return
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.tasks = [
+            asyncio.create_task(self._work(), name=f"summarizer-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.queued.clear()
+        self.discarded.clear()
+
+    async def _work(self) -> None:
+        assert self.queue is not None
+        while True:
+            user_id = await self.queue.get()
+            try:
+                if user_id in self.discarded:
+                    continue
+                if await summarize_history(user_id):
+                    self.summarized += 1
+            except Exception as e:
+                self.failures += 1
+                config.logger.error(f"Error summarizing history for user {user_id}: {e}")
+            finally:
+                self.queued.discard(user_id)
+                self.discarded.discard(user_id)
+                self.queue.task_done()
+
+
+summarizer = HistorySummarizer()
+metrics.register_stats("summarizer", summarizer.stats)
@@ -6,6 +6,7 @@ from .message_handler import handle_message
 from .clear_history import clear_history
 from .system_prompt import set_system_prompt
 from .temperature import set_temperature
+from .dedup import drop_duplicate_updates
 from .setup import setup_handlers
 
 __all__ = [
@@ -18,6 +19,7 @@ __all__ = [
     "clear_history",
     "set_system_prompt",
     "set_temperature",
+    "drop_duplicate_updates",
     "setup_handlers",
 ]
 
@@ -32,5 +34,6 @@ poe_tg/telegram_handler/
 ├── message_handler.py   # Main message processing handler
 ├── clear_history.py     # /clear_history command handler
 ├── system_prompt.py     # /set_system_prompt command handler
-└── temperature.py       # /set_temperature command handler
+├── temperature.py       # /set_temperature command handler
+└── dedup.py             # Drops redelivered updates before other handlers run
 """
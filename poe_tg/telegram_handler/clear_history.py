@@ -1,6 +1,7 @@
 from telegram import Update
 from telegram.ext import ContextTypes
 from poe_tg.db.database import clear_conversation_history
+from poe_tg.summarizer import summarizer
 
 
 async def clear_history(update: Update, _context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -8,6 +9,8 @@ async def clear_history(update: Update, _context: ContextTypes.DEFAULT_TYPE) ->
     if not update.effective_user or not update.message:
         return
     user_id = update.effective_user.id
-    clear_conversation_history(user_id)
+    await clear_conversation_history(user_id)
+    # A summary written now would bring the cleared turns back
+    summarizer.discard(user_id)
 
     await update.message.reply_text("Your conversation history has been cleared.")
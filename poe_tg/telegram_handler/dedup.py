@@ -0,0 +1,52 @@
+from collections import OrderedDict
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+from poe_tg import config, metrics
+from poe_tg.db.database import mark_update_processed
+
+
+class UpdateDeduplicator:
+    """Remember recent update ids so redelivered updates are handled only once."""
+
+    def __init__(
+        self, maxsize: int = config.DEDUP_CACHE_SIZE, persist: bool = config.DEDUP_PERSIST
+    ):
+        self.maxsize = maxsize
+        self.persist = persist
+        self._seen: OrderedDict[int, None] = OrderedDict()
+        self.duplicates = 0
+
+    async def is_duplicate(self, update_id: int) -> bool:
+        """Check an update id and remember it for next time."""
+        if update_id in self._seen:
+            self.duplicates += 1
+            return True
+
+        # Remember before awaiting so a concurrent redelivery is caught too
+        self._seen[update_id] = None
+        if len(self._seen) > self.maxsize:
+            self._seen.popitem(last=False)
+
+        if self.persist and not await mark_update_processed(update_id):
+            self.duplicates += 1
+            return True
+
+        return False
+
+    def stats(self) -> dict[str, int]:
+        return {"remembered": len(self._seen), "duplicates": self.duplicates}
+
+
+deduplicator = UpdateDeduplicator()
+metrics.register_stats("deduplicator", deduplicator.stats)
+
+
+async def drop_duplicate_updates(
+    update: Update, _context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Stop handling updates Telegram has already delivered before."""
+    if await deduplicator.is_duplicate(update.update_id):
+        config.logger.info(f"Dropping duplicate update {update.update_id}")
+        raise ApplicationHandlerStop
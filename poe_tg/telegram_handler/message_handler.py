@@ -1,12 +1,17 @@
-import asyncio
-from telegram import Update
+from contextlib import aclosing
+from typing import Optional
+from telegram import Message, Update
 from telegram.ext import ContextTypes
-from poe_tg import config
-from poe_tg.poe_client import get_poe_response
-from poe_tg.utils import split_message
+from poe_tg import config, tracing
+from poe_tg.delivery import deliver_response
+from poe_tg.media_group import media_groups
+from poe_tg.poe_client import get_poe_response, stream_poe_response
+from poe_tg.rate_limit import user_limiter
+from poe_tg.streaming import StreamingReply
 from poe_tg.telegram_handler.select_bot import handle_custom_bot_name
 
 
+@tracing.traced()
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle user messages and forward them to Poe."""
     if not update.effective_user or not update.message:
@@ -28,20 +33,77 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await handle_custom_bot_name(update, context)
         return
 
+    # Albums arrive as one update per photo; answer them once, together
+    if update.message.media_group_id:
+        if media_groups.add(update.message):
+            context.application.create_task(
+                respond_to_album(update, context), update=update
+            )
+        return
+
+    if await check_rate_limit(update):
+        await respond(update, context)
+
+
+async def check_rate_limit(update: Update) -> bool:
+    """Let the user know (and return False) when they are sending too fast."""
+    if not update.effective_user or not update.message:
+        return False
+    user_id = update.effective_user.id
+    if user_limiter.try_acquire(user_id):
+        return True
+    wait = max(1, round(user_limiter.retry_after(user_id)))
+    await update.message.reply_text(
+        f"You're sending messages too quickly. Please wait {wait} seconds and try again."
+    )
+    return False
+
+
+async def respond_to_album(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Answer all messages of an album with a single Poe request."""
+    if not update.message:
+        return
+    # Runs as its own task, after the update that started the album was handled.
+    # Wait for the rest of the album outside the chat's turn, or its other
+    # photos could not be handled, then answer in order like any other update.
+    album = await media_groups.collect(str(update.message.media_group_id))
+    await context.application.update_processor.process_update(
+        update, respond_to_collected_album(update, context, album)
+    )
+
+
+async def respond_to_collected_album(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, album: list[Message]
+) -> None:
+    tracing.annotate(album=True, photos=len(album))
+    if await check_rate_limit(update):
+        await respond(update, context, album)
+
+
+async def respond(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    album: Optional[list[Message]] = None,
+) -> None:
+    """Forward the message (or album) to Poe and send back the response."""
+    if not update.message:
+        return
+
     # Send a "typing" action
     if update.effective_message:
         await context.bot.send_chat_action(
             chat_id=update.effective_message.chat_id, action="typing"
         )
 
-    response = await get_poe_response(update, context)
-
-    # Split the response if it's too long
-    message_chunks = split_message(response)
+    if config.STREAM_RESPONSES:
+        reply = StreamingReply(update.message)
+        await reply.start()
+        # Closes the Poe request right away if showing a part fails
+        async with aclosing(stream_poe_response(update, context, album)) as stream:
+            async for text in stream:
+                await reply.append(text)
+        await reply.finish()
+        return
 
-    # Send each chunk as a separate message
-    for chunk in message_chunks:
-        await update.message.reply_text(chunk)
-        # Small delay between messages to maintain order
-        if len(message_chunks) > 1:
-            await asyncio.sleep(0.5)
+    response = await get_poe_response(update, context, album)
+    await deliver_response(update.message, response)
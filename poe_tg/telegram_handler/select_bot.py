@@ -33,7 +33,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if query.data and query.data.startswith("bot_"):
         selected_bot = query.data[4:]  # Remove "bot_" prefix
         user_id = update.effective_user.id
-        set_user_preference(
+        await set_user_preference(
             user_id, bot_name=selected_bot, system_prompt="", temperature=0.7
         )
 
@@ -75,7 +75,7 @@ async def handle_custom_bot_name(
 
         if custom_bot_name:
             # Save the custom bot name
-            set_user_preference(
+            await set_user_preference(
                 user_id, bot_name=custom_bot_name, system_prompt="", temperature=0.7
             )
 
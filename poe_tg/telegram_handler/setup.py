@@ -1,7 +1,9 @@
+from telegram import Update
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
+    TypeHandler,
     filters,
     CallbackQueryHandler,
 )
@@ -15,11 +17,14 @@ from . import (
     clear_history,
     set_system_prompt,
     set_temperature,
+    drop_duplicate_updates,
 )
 
 
 def setup_handlers(application: Application) -> None:
     """Set up all the handlers for the Telegram bot."""
+    # Runs first (lower group) and stops redelivered updates before any Poe call
+    application.add_handler(TypeHandler(Update, drop_duplicate_updates), group=-1)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("select_bot", select_bot))
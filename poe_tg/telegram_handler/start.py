@@ -10,7 +10,7 @@ async def start(update: Update, _context: ContextTypes.DEFAULT_TYPE) -> None:
         return
 
     user_id = update.effective_user.id
-    set_user_preference(
+    await set_user_preference(
         user_id,
         bot_name=config.DEFAULT_BOT,
         temperature=0.7,
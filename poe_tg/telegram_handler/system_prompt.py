@@ -29,6 +29,6 @@ async def set_system_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE)
         success_message = f"System prompt set to: {prompt}"
 
     # Update the user's system prompt
-    set_user_preference(user_id, system_prompt=prompt)
+    await set_user_preference(user_id, system_prompt=prompt)
 
     await update.message.reply_text(success_message)
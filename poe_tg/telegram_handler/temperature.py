@@ -28,7 +28,7 @@ async def set_temperature(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             return
 
         # Update the user's temperature setting
-        set_user_preference(user_id, temperature=temperature)
+        await set_user_preference(user_id, temperature=temperature)
 
         await update.message.reply_text(f"Temperature set to: {temperature}")
     except ValueError:
@@ -0,0 +1,240 @@
+import functools
+import json
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Iterator, Optional, TypeVar
+
+from telegram.request import HTTPXRequest
+
+from poe_tg import config
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # pragma: no cover - optional dependency
+    otel_trace = None
+
+T = TypeVar("T")
+
+
+class Span:
+    """One timed operation within a trace."""
+
+    __slots__ = (
+        "name", "span_id", "parent", "trace", "start", "end", "attributes", "error", "otel",
+    )
+
+    def __init__(
+        self, name: str, trace: "Trace", parent: Optional["Span"], attributes: dict
+    ):
+        self.name = name
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent = parent
+        self.trace = trace
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self.otel: Any = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+    def to_dict(self) -> dict[str, Any]:
+        data = {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "name": self.name,
+            "offset_ms": round((self.start - self.trace.root.start) * 1000, 3),
+            "duration_ms": round(self.duration_ms, 3),
+        }
+        if self.error:
+            data["error"] = self.error
+        data.update(self.attributes)
+        return data
+
+
+class Trace:
+    """All spans of one update, kept until its root span ends."""
+
+    def __init__(self, name: str, attributes: dict):
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.spans: list[Span] = []
+        self.dropped = 0
+        self.root = Span(name, self, None, attributes)
+
+    def add(self, span: Span) -> None:
+        if len(self.spans) < config.TRACE_MAX_SPANS:
+            self.spans.append(span)
+        else:
+            self.dropped += 1
+
+    def tree(self) -> dict[str, Any]:
+        """The spans nested under their parents, in start order."""
+        nodes = {
+            id(span): {**span.to_dict(), "children": []} for span in [self.root, *self.spans]
+        }
+        for span in self.spans:
+            parent = nodes.get(id(span.parent))
+            if parent is not None:
+                parent["children"].append(nodes[id(span)])
+        root = nodes[id(self.root)]
+        if self.dropped:
+            root["dropped_spans"] = self.dropped
+        return root
+
+
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_trace_id() -> Optional[str]:
+    span = current_span.get()
+    return span.trace.trace_id if span else None
+
+
+def annotate(**attributes: Any) -> None:
+    """Add attributes to the current span, if there is one."""
+    span = current_span.get()
+    if span is not None:
+        span.attributes.update(attributes)
+
+
+def log_span(span: Span) -> None:
+    if config.TRACE_LOG_SPANS:
+        config.logger.info(json.dumps(span.to_dict(), default=str))
+
+
+def wall_time_ns(moment: float) -> int:
+    """Convert a `time.perf_counter()` reading to wall-clock nanoseconds."""
+    return time.time_ns() - int((time.perf_counter() - moment) * 1e9)
+
+
+def start_otel(span: Span) -> None:
+    if otel_trace is None or not config.TRACE_OTEL:
+        return
+    parent = span.parent.otel if span.parent else None
+    context = otel_trace.set_span_in_context(parent) if parent is not None else None
+    span.otel = otel_trace.get_tracer("poe_tg").start_span(
+        span.name, context=context, start_time=wall_time_ns(span.start)
+    )
+
+
+def end_otel(span: Span) -> None:
+    if span.otel is None:
+        return
+    for key, value in span.attributes.items():
+        if isinstance(value, (str, bool, int, float)):
+            span.otel.set_attribute(key, value)
+    if span.error:
+        span.otel.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, span.error))
+    span.otel.end(end_time=wall_time_ns(span.end) if span.end is not None else None)
+
+
+@contextmanager
+def run_span(span: Span) -> Iterator[Span]:
+    start_otel(span)
+    token = current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        span.end = time.perf_counter()
+        current_span.reset(token)
+        end_otel(span)
+        log_span(span)
+
+
+@contextmanager
+def trace(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Start a new trace for one update; its span tree is logged if it turns out slow."""
+    if not config.TRACING_ENABLED:
+        yield None
+        return
+
+    new_trace = Trace(name, attributes)
+    try:
+        with run_span(new_trace.root) as root:
+            yield root
+    finally:
+        if new_trace.root.duration_ms >= config.TRACE_SLOW_THRESHOLD * 1000:
+            config.logger.warning(
+                json.dumps({"slow_trace": new_trace.tree()}, default=str)
+            )
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Time the block as a child of the current span; a no-op outside a trace."""
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(name, parent.trace, parent, attributes)
+    parent.trace.add(child)
+    with run_span(child):
+        yield child
+
+
+def record(
+    name: str,
+    start: float,
+    error: Optional[BaseException] = None,
+    parent: Optional[Span] = None,
+    **attributes: Any,
+) -> None:
+    """Add a span that started at `start` and ends now, by default under the current span.
+
+    For work that crosses `yield`s in an async generator, where `span` would
+    leave its context variable set in the consumer's context. Pass the
+    `parent` taken before the first yield, the generator may be closed from
+    another context.
+    """
+    parent = parent or current_span.get()
+    if parent is None:
+        return
+    finished = Span(name, parent.trace, parent, attributes)
+    finished.start = start
+    finished.end = time.perf_counter()
+    if error is not None:
+        finished.error = f"{type(error).__name__}: {error}"
+    parent.trace.add(finished)
+    start_otel(finished)
+    end_otel(finished)
+    log_span(finished)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorate a coroutine function so each call is a span, by default "module.function"."""
+
+    def decorate(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        span_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            with span(span_name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+class TracedRequest(HTTPXRequest):
+    """Bot API requests as spans named after the API method, e.g. ``telegram.sendMessage``."""
+
+    async def do_request(
+        self, url: str, method: str, *args: Any, **kwargs: Any
+    ) -> tuple[int, bytes]:
+        # Only the method name: the rest of the URL contains the bot token
+        with span(f"telegram.{url.rsplit('/', 1)[-1]}") as request_span:
+            status, payload = await super().do_request(url, method, *args, **kwargs)
+            if request_span is not None:
+                request_span.attributes["status"] = status
+            return status, payload
@@ -0,0 +1,100 @@
+import asyncio
+import sys
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from poe_tg import config, tracing
+
+
+def chat_key(update: object) -> Optional[int]:
+    """Return the chat an update belongs to, if any."""
+    if isinstance(update, Update) and update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Process updates from different chats concurrently, but one at a time per chat.
+
+    Updates of the same chat wait on a per-chat lock, which asyncio hands out in
+    arrival order, so a chat never sees its replies reordered while a slow Poe
+    call in one chat no longer holds up every other chat. Locks are dropped as
+    soon as a chat has nothing left in flight.
+
+    Only then does an update take one of the `max_concurrent_updates` slots.
+    The base class would take its slot before `do_process_update`, so the
+    queued updates of one busy chat would hold every slot and starve all
+    other chats; it is given no limit and the slots are kept here instead,
+    as `update_limit`.
+    """
+
+    def __init__(self, max_concurrent_updates: int = config.MAX_CONCURRENT_UPDATES):
+        super().__init__(sys.maxsize)
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        self.update_limit = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._busy = 0
+        self._chat_locks: dict[int, asyncio.Lock] = {}
+        self._chat_pending: dict[int, int] = {}
+
+    @property
+    def current_concurrent_updates(self) -> int:
+        """Number of updates holding one of the `update_limit` slots."""
+        return self._busy
+
+    @property
+    def active_chats(self) -> int:
+        """Number of chats with at least one update in flight."""
+        return len(self._chat_locks)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "active_chats": self.active_chats,
+            "pending_updates": sum(self._chat_pending.values()),
+        }
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = chat_key(update)
+        update_id = update.update_id if isinstance(update, Update) else None
+        with tracing.trace("update", update_id=update_id, chat_id=key):
+            if key is None:
+                await self._process(coroutine)
+                return
+            async with self._chat_turn(key):
+                await self._process(coroutine)
+
+    async def _process(self, coroutine: Awaitable[Any]) -> None:
+        async with self._slots:
+            self._busy += 1
+            try:
+                await coroutine
+            finally:
+                self._busy -= 1
+
+    @asynccontextmanager
+    async def _chat_turn(self, key: int) -> AsyncIterator[None]:
+        lock = self._chat_locks.setdefault(key, asyncio.Lock())
+        self._chat_pending[key] = self._chat_pending.get(key, 0) + 1
+        try:
+            # Earlier updates of the same chat are still being answered
+            with tracing.span("update.wait_for_chat"):
+                await lock.acquire()
+            try:
+                yield
+            finally:
+                lock.release()
+        finally:
+            self._chat_pending[key] -= 1
+            if not self._chat_pending[key]:
+                del self._chat_pending[key]
+                del self._chat_locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -1,8 +1,13 @@
-from typing import List
+import asyncio
+from bisect import bisect_right
+from typing import Awaitable, Callable, Iterator, List, NamedTuple, TypeVar
 
+from telegram.error import RetryAfter
 from telegram.ext import ContextTypes
 from . import config
 
+T = TypeVar("T")
+
 
 async def catch_error(context: ContextTypes.DEFAULT_TYPE) -> str:
     """Catch all errors and log them."""
@@ -10,71 +15,149 @@ async def catch_error(context: ContextTypes.DEFAULT_TYPE) -> str:
     return "Sorry, something went wrong while processing your request. Please try again later."
 
 
-def split_message(text: str, limit: int = config.TELEGRAM_MESSAGE_LIMIT) -> List[str]:
-    """Split a message into chunks that fit within Telegram's character limit."""
-    if len(text) <= limit:
-        return [text]
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Return how long Telegram asked us to wait, in seconds."""
+    retry_after = error.retry_after
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
 
-    chunks = []
-    current_chunk = ""
-
-    # Try to split on paragraph breaks first
-    paragraphs = text.split("\n\n")
-
-    for paragraph in paragraphs:
-        # If a single paragraph is too long, we'll need to split it
-        if len(paragraph) > limit:
-            # Split the paragraph into sentences
-            sentences = paragraph.replace(". ", ".\n").split("\n")
-
-            for sentence in sentences:
-                # If a single sentence is too long, we'll need to split it by character
-                if len(sentence) > limit:
-                    while sentence:
-                        # Find a good breaking point (preferably at a space)
-                        if len(sentence) <= limit:
-                            chunk_end = len(sentence)
-                        else:
-                            chunk_end = sentence[:limit].rfind(" ")
-                            if chunk_end == -1:  # No space found, just cut at the limit
-                                chunk_end = limit
-
-                        # Add this chunk to our result
-                        if (
-                            current_chunk
-                            and len(current_chunk) + len(sentence[:chunk_end]) + 1
-                            > limit
-                        ):
-                            chunks.append(current_chunk)
-                            current_chunk = sentence[:chunk_end]
-                        else:
-                            if current_chunk:
-                                current_chunk += "\n"
-                            current_chunk += sentence[:chunk_end]
-
-                        # Move to the next part of the sentence
-                        sentence = sentence[chunk_end:].lstrip()
-                else:
-                    # This sentence fits within the limit
-                    if current_chunk and len(current_chunk) + len(sentence) + 1 > limit:
-                        chunks.append(current_chunk)
-                        current_chunk = sentence
-                    else:
-                        if current_chunk:
-                            current_chunk += "\n"
-                        current_chunk += sentence
-        else:
-            # This paragraph fits within the limit
-            if current_chunk and len(current_chunk) + len(paragraph) + 2 > limit:
-                chunks.append(current_chunk)
-                current_chunk = paragraph
+
+async def with_flood_control(
+    call: Callable[[], Awaitable[T]], max_attempts: int = 5
+) -> T:
+    """Run a Telegram API call, waiting out flood control (RetryAfter) between attempts."""
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return await call()
+        except RetryAfter as e:
+            if attempt == max_attempts:
+                raise
+            delay = retry_after_seconds(e)
+            config.logger.warning(f"Telegram flood control, retrying in {delay}s")
+            await asyncio.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+FENCE = "```"
+# Appended to a chunk that ends inside a code block
+FENCE_CLOSE = "\n" + FENCE
+
+
+class Chunk(NamedTuple):
+    """A message chunk: ``text[start:end]`` wrapped in fence markers if needed."""
+
+    start: int
+    end: int
+    prefix: str = ""
+    suffix: str = ""
+
+    def render(self, text: str) -> str:
+        return self.prefix + text[self.start : self.end] + self.suffix
+
+
+def find_code_blocks(
+    text: str,
+) -> tuple[list[int], list[int], list[int], list[str]]:
+    """Locate fenced code blocks (fences at the start of a line, maybe indented).
+
+    Returns where each block starts, where its body starts (at the end of the
+    opening fence line), where it ends (after the closing fence line) and its
+    language.
+    """
+    starts, bodies, ends, languages = [], [], [], []
+    fence = text.find(FENCE)
+    while fence != -1:
+        line_start = text.rfind("\n", 0, fence) + 1
+        line_end = text.find("\n", fence)
+        if line_end == -1:
+            line_end = len(text)
+        if not text[line_start:fence].strip(" \t"):
+            if len(starts) == len(ends):
+                starts.append(line_start)
+                bodies.append(line_end)
+                languages.append(text[fence + len(FENCE) : line_end].strip())
             else:
-                if current_chunk:
-                    current_chunk += "\n\n"
-                current_chunk += paragraph
+                ends.append(line_end)
+        fence = text.find(FENCE, line_end)
+    if len(ends) < len(starts):
+        # An unclosed block runs to the end of the text
+        ends.append(len(text))
+    return starts, bodies, ends, languages
 
-    # Don't forget the last chunk
-    if current_chunk:
-        chunks.append(current_chunk)
 
-    return chunks
+def iter_chunks(text: str, limit: int = config.TELEGRAM_MESSAGE_LIMIT) -> Iterator[Chunk]:
+    """Split text into chunks of at most `limit` characters in a single pass.
+
+    Breaks are made at the last paragraph break, line break or space in the
+    second half of the window, in that order, and outside code blocks when
+    possible. A code block too long for one chunk is broken at a line break,
+    closed at the end of the chunk and reopened (with its language) at the
+    start of the next. Whitespace at a break outside code blocks is dropped.
+    Every window is scanned a bounded number of times, so the whole split is
+    linear in the length of the text.
+    """
+    starts, bodies, ends, languages = find_code_blocks(text)
+
+    def block_at(offset: int) -> int:
+        """Index of the code block strictly containing `offset`, or -1."""
+        i = bisect_right(starts, offset - 1) - 1
+        return i if i >= 0 and offset < ends[i] else -1
+
+    def in_body(offset: int) -> bool:
+        """Whether `offset` is past the opening fence of the block it is in."""
+        block = block_at(offset)
+        return block >= 0 and offset >= bodies[block]
+
+    def last_break(separator: str, lo: int, hi: int, in_code: bool) -> int:
+        cut = text.rfind(separator, lo, hi)
+        while cut >= lo:
+            block = block_at(cut)
+            if block < 0 or (in_code and cut > bodies[block]):
+                break
+            # Jump to just before the code block and keep looking
+            cut = text.rfind(separator, lo, starts[block])
+        return cut
+
+    pos, length = 0, len(text)
+    while pos < length:
+        block = block_at(pos)
+        prefix = ""
+        if in_body(pos):
+            prefix = f"{FENCE}{languages[block]}\n"
+            if len(prefix) > limit // 4:
+                prefix = f"{FENCE}\n"
+        budget = limit - len(prefix)
+
+        if length - pos <= budget:
+            yield Chunk(pos, length, prefix)
+            return
+
+        # Leave room to close a code block and only accept breaks that keep chunks large
+        hi = max(pos + 1, pos + budget - len(FENCE_CLOSE))
+        lo = pos + max(1, budget // 2)
+        cut = -1
+        for separator, in_code in (("\n\n", False), ("\n", False), ("\n", True), (" ", False), (" ", True)):
+            cut = last_break(separator, lo, hi, in_code)
+            if cut >= lo:
+                break
+        if cut < lo:
+            cut = hi
+
+        inside = in_body(cut)
+        yield Chunk(pos, cut, prefix, FENCE_CLOSE if inside else "")
+
+        if inside:
+            # Keep indentation inside code, only drop the line break itself
+            pos = cut + 1 if text[cut] == "\n" else cut
+        else:
+            pos = cut
+            while pos < length and text[pos].isspace():
+                pos += 1
+
+
+def split_message(text: str, limit: int = config.TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Split a message into chunks that fit within Telegram's character limit."""
+    if len(text) <= limit:
+        return [text]
+    return [chunk.render(text) for chunk in iter_chunks(text, limit)]
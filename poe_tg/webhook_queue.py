@@ -0,0 +1,134 @@
+import asyncio
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+from poe_tg import config
+
+OVERFLOW_POLICIES = ("reject", "drop_oldest", "drop_newest")
+
+
+class WebhookUpdateQueue:
+    """Bounded in-process queue that lets the webhook acknowledge updates at once.
+
+    The webhook route only validates and `submit`s an update; worker tasks feed
+    queued updates through the application's update processor. When the queue
+    is full the overflow policy decides what happens:
+
+    - ``reject``: refuse the update so the route answers 503 and Telegram
+      redelivers it later (no update is lost).
+    - ``drop_oldest``: discard the oldest queued update to make room.
+    - ``drop_newest``: acknowledge and discard the incoming update.
+    """
+
+    def __init__(
+        self,
+        application: Application,
+        maxsize: int = config.WEBHOOK_QUEUE_SIZE,
+        workers: int = config.WEBHOOK_WORKERS,
+        overflow_policy: str = config.WEBHOOK_OVERFLOW_POLICY,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Unknown webhook overflow policy {overflow_policy!r}, expected one of {OVERFLOW_POLICIES}"
+            )
+        self.application = application
+        self.maxsize = maxsize
+        self.workers = workers
+        self.overflow_policy = overflow_policy
+        self.queue: Optional[asyncio.Queue[Update]] = None
+        self.tasks: list[asyncio.Task] = []
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self.busy = 0
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize() if self.queue else 0
+
+    def submit(self, update: Update) -> bool:
+        """Queue an update, returning False if it was rejected and should be retried."""
+        if self.queue is None:
+            self.rejected += 1
+            return False
+
+        if self.queue.full():
+            if self.overflow_policy == "reject":
+                self.rejected += 1
+                config.logger.warning(
+                    f"Webhook queue full ({self.maxsize}), rejecting update {update.update_id}"
+                )
+                return False
+            if self.overflow_policy == "drop_newest":
+                self.dropped += 1
+                config.logger.warning(
+                    f"Webhook queue full ({self.maxsize}), dropping update {update.update_id}"
+                )
+                return True
+            dropped = self.queue.get_nowait()
+            self.queue.task_done()
+            self.dropped += 1
+            config.logger.warning(
+                f"Webhook queue full ({self.maxsize}), dropping update {dropped.update_id}"
+            )
+
+        self.queue.put_nowait(update)
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    async def start(self) -> None:
+        if self.tasks:
+            return
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        self.tasks = [
+            asyncio.create_task(self._work(self.queue), name=f"webhook-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self, timeout: float = config.WEBHOOK_DRAIN_TIMEOUT) -> None:
+        """Stop accepting updates, give queued ones `timeout` seconds to finish."""
+        queue, self.queue = self.queue, None
+        if queue is not None:
+            try:
+                await asyncio.wait_for(queue.join(), timeout)
+            except asyncio.TimeoutError:
+                config.logger.warning(
+                    f"Webhook queue not drained, {queue.qsize()} updates left unprocessed"
+                )
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        config.logger.info(f"Webhook queue: {self.stats()}")
+
+    def stats(self) -> dict[str, int]:
+        """Return queue depth and backpressure counters."""
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "busy_workers": self.busy,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+        }
+
+    async def _work(self, queue: asyncio.Queue[Update]) -> None:
+        while True:
+            update = await queue.get()
+            self.busy += 1
+            try:
+                await self.application.update_processor.process_update(
+                    update, self.application.process_update(update)
+                )
+            except Exception as e:
+                config.logger.error(f"Error processing update {update.update_id}: {e}")
+            finally:
+                self.busy -= 1
+                self.processed += 1
+                queue.task_done()
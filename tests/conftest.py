@@ -0,0 +1,48 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable
+
+import pytest
+
+# Set before poe_tg is imported: the database module needs a URL at import time
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+os.environ.setdefault("POE_API_KEY", "test")
+os.environ.setdefault("TELEGRAM_TOKEN", "test")
+
+
+@pytest.fixture
+def run_with_db() -> Callable[[Callable[[], Awaitable[Any]]], None]:
+    """Run a coroutine function in a new event loop with the tables created."""
+    from poe_tg.db.database import close_db, init_db
+
+    def run(test: Callable[[], Awaitable[Any]]) -> None:
+        async def main() -> None:
+            await init_db()
+            try:
+                await test()
+            finally:
+                await close_db()
+
+        asyncio.run(main())
+
+    return run
+
+
+@pytest.fixture
+def file_db(tmp_path: Any, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Use a SQLite file, where every session gets its own connection as in production.
+
+    With the in-memory database all sessions share one connection, and so
+    one transaction, which hides or invents races between them.
+    """
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    from poe_tg.db import database
+
+    engine = database.create_db_engine(f"sqlite+aiosqlite:///{tmp_path / 'poe_tg.db'}")
+    monkeypatch.setattr(database, "engine", engine)
+    monkeypatch.setattr(
+        database,
+        "SessionLocal",
+        async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False),
+    )
@@ -0,0 +1,151 @@
+import asyncio
+from typing import Any
+
+import pytest
+
+from poe_tg.batch_writer import BatchWriter
+from poe_tg.db import database
+from poe_tg.db.database import add_message_to_history, history_cache, load_exchange
+
+
+class Sink:
+    """Collects written batches; fails the next `failures` writes."""
+
+    def __init__(self) -> None:
+        self.batches: list[list[int]] = []
+        self.failures = 0
+
+    async def write(self, batch: list[int]) -> None:
+        await asyncio.sleep(0)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("database is gone")
+        self.batches.append(batch)
+
+
+async def written(sink: Sink, batches: int) -> None:
+    while len(sink.batches) < batches:
+        await asyncio.sleep(0.001)
+
+
+def test_a_full_batch_is_written_without_waiting_for_the_interval() -> None:
+    async def test() -> None:
+        sink = Sink()
+        writer = BatchWriter(sink.write, batch_size=3, interval=60, max_pending=100)
+        await writer.start()
+
+        await writer.add(1)
+        await writer.add(2)
+        await asyncio.sleep(0.01)
+        assert sink.batches == []
+        await writer.add(3, 4)
+        await asyncio.wait_for(written(sink, 1), 1)
+
+        assert sink.batches == [[1, 2, 3, 4]]
+        await writer.stop()
+
+    asyncio.run(test())
+
+
+def test_a_partial_batch_is_written_after_the_interval() -> None:
+    async def test() -> None:
+        sink = Sink()
+        writer = BatchWriter(sink.write, batch_size=100, interval=0.05, max_pending=100)
+        await writer.start()
+
+        await writer.add(1)
+        await asyncio.sleep(0.01)
+        await writer.add(2)
+        assert sink.batches == []
+        await asyncio.wait_for(written(sink, 1), 1)
+
+        assert sink.batches == [[1, 2]]
+        await writer.stop()
+
+    asyncio.run(test())
+
+
+def test_rows_of_a_failed_write_are_kept_for_the_next_one() -> None:
+    async def test() -> None:
+        sink = Sink()
+        writer = BatchWriter(sink.write, batch_size=10, interval=60, max_pending=4)
+
+        sink.failures = 1
+        writer.pending = [[1, 2], [3]]
+        writer.pending_rows = 3
+        assert not await writer.flush()
+        assert writer.pending == [[1, 2], [3]]
+
+        # Beyond max_pending the oldest rows go, whole groups at a time
+        sink.failures = 1
+        writer.pending.append([4, 5])
+        writer.pending_rows += 2
+        assert not await writer.flush()
+        assert writer.pending == [[3], [4, 5]]
+
+        assert await writer.flush()
+        assert sink.batches == [[3, 4, 5]]
+        assert writer.stats()["failures"] == 2
+        assert writer.stats()["dropped"] == 2
+        assert writer.stats()["pending"] == 0
+
+    asyncio.run(test())
+
+
+def test_a_failed_background_write_is_retried() -> None:
+    async def test() -> None:
+        sink = Sink()
+        sink.failures = 1
+        writer = BatchWriter(sink.write, batch_size=1, interval=0.01, max_pending=100)
+        await writer.start()
+
+        await writer.add(1)
+        await asyncio.wait_for(written(sink, 1), 1)
+
+        assert sink.batches == [[1]]
+        assert writer.stats()["failures"] == 1
+        await writer.stop()
+
+    asyncio.run(test())
+
+
+def test_stop_writes_what_is_still_buffered() -> None:
+    async def test() -> None:
+        sink = Sink()
+        writer = BatchWriter(sink.write, batch_size=100, interval=60, max_pending=100)
+        await writer.start()
+
+        await writer.add(1, 2)
+        await writer.add(3)
+        await writer.stop()
+
+        assert sink.batches == [[1, 2, 3]]
+        assert not writer.running
+        # Stopped writers write straight away
+        await writer.add(4)
+        assert sink.batches == [[1, 2, 3], [4]]
+
+    asyncio.run(test())
+
+
+def test_load_exchange_reads_rows_still_buffered(
+    run_with_db: Any, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(database.history_writer, "interval", 60)
+
+    async def test() -> None:
+        await database.history_writer.start()
+        try:
+            await add_message_to_history(500, "user", "hello", "GPT-4o")
+            await add_message_to_history(500, "bot", "hi there", "GPT-4o")
+            assert database.history_writer.stats()["pending"] == 2
+
+            # Nothing cached, so the history comes from the database
+            history_cache.drop(500)
+            exchange = await load_exchange(500)
+            assert [entry.message.content for entry in exchange.history] == ["hello", "hi there"]
+            assert database.history_writer.stats()["pending"] == 0
+        finally:
+            await database.history_writer.stop()
+
+    run_with_db(test)
@@ -0,0 +1,32 @@
+from poe_tg.cache import LRUCache
+
+
+def test_set_if_version_refuses_values_loaded_before_a_change() -> None:
+    cache: LRUCache[str, int] = LRUCache(maxsize=2, ttl=60)
+
+    stale = cache.version("a")
+    assert cache.set("a", 2)
+    assert not cache.set("a", 1, if_version=stale)
+    assert cache.get("a") == 2
+
+    fresh = cache.version("a")
+    cache.invalidate("a")
+    assert not cache.set("a", 3, if_version=fresh)
+    assert cache.get("a") is None
+
+    assert cache.set("a", 3, if_version=cache.version("a"))
+    assert cache.get("a") == 3
+
+
+def test_versions_of_forgotten_keys_still_change() -> None:
+    cache: LRUCache[str, int] = LRUCache(maxsize=1, ttl=60)
+
+    stale = cache.version("a")
+    cache.set("a", 1)
+    # "b" pushes "a" out of both the entries and the tracked versions
+    cache.set("b", 2)
+    assert not cache.set("a", 0, if_version=stale)
+
+    stale = cache.version("b")
+    cache.clear()
+    assert not cache.set("b", 0, if_version=stale)
@@ -0,0 +1,91 @@
+import fastapi_poe as fp
+import httpx
+import pytest
+
+from poe_tg.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    PoeTimeoutError,
+    is_refusal,
+    is_retryable,
+)
+
+
+def wrapped(cause: Exception) -> fp.BotError:
+    """The error as fastapi_poe raises it once its own tries are used up."""
+    try:
+        raise fp.BotError("Error communicating with bot GPT-4o") from cause
+    except fp.BotError as e:
+        return e
+
+
+def status_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://api.poe.com/bot/GPT-4o")
+    response = httpx.Response(status, request=request)
+    return httpx.HTTPStatusError(f"{status}", request=request, response=response)
+
+
+@pytest.mark.parametrize(
+    "error, retryable",
+    [
+        (PoeTimeoutError("no first token"), True),
+        (fp.BotError('{"text": "internal error", "allow_retry": true}'), True),
+        (fp.BotErrorNoRetry('{"text": "bad request", "allow_retry": false}'), False),
+        (wrapped(httpx.ConnectError("connection refused")), True),
+        (wrapped(httpx.RemoteProtocolError("peer closed connection")), True),
+        (wrapped(status_error(500)), True),
+        (wrapped(status_error(503)), True),
+        (wrapped(status_error(429)), True),
+        (wrapped(status_error(400)), False),
+        (wrapped(status_error(401)), False),
+        (wrapped(status_error(404)), False),
+        (wrapped(ValueError("Expected response header Content-Type to contain ...")), False),
+    ],
+)
+def test_is_retryable_looks_at_the_wrapped_error(error: Exception, retryable: bool) -> None:
+    assert is_retryable(error) is retryable
+
+
+@pytest.mark.parametrize(
+    "error, refusal",
+    [
+        (fp.BotErrorNoRetry('{"text": "bad request", "allow_retry": false}'), True),
+        (wrapped(status_error(401)), True),
+        (wrapped(status_error(404)), True),
+        (wrapped(status_error(429)), False),
+        (wrapped(status_error(503)), False),
+        (wrapped(ValueError("Expected response header Content-Type to contain ...")), False),
+        (TypeError("unexpected keyword argument"), False),
+        (KeyError("text"), False),
+    ],
+)
+def test_is_refusal_only_for_upstream_client_errors(error: Exception, refusal: bool) -> None:
+    assert is_refusal(error) is refusal
+
+
+def test_breaker_opens_and_lets_one_trial_through() -> None:
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.retry_after() == 10
+
+    now[0] = 10
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Only one trial at a time
+    assert not breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    now[0] = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
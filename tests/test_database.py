@@ -0,0 +1,157 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any
+
+import pytest
+from sqlalchemy import func, select
+
+from poe_tg import config
+from poe_tg.db import database
+from poe_tg.db.database import (
+    delete_excess_history,
+    get_conversation_history,
+    get_user_preference,
+    history_row,
+    insert_history_rows,
+    load_exchange,
+    preference_cache,
+    session_scope,
+    set_user_preference,
+)
+from poe_tg.db.models import ConversationHistory, UserPreference
+
+
+async def preference_rows(user_ids: list[int]) -> dict[int, int]:
+    async with session_scope() as db:
+        rows = await db.execute(
+            select(UserPreference.user_id, func.count())
+            .where(UserPreference.user_id.in_(user_ids))
+            .group_by(UserPreference.user_id)
+        )
+        return {user_id: count for user_id, count in rows}
+
+
+def test_concurrent_first_messages_create_one_preference_each(run_with_db: Any) -> None:
+    async def test() -> None:
+        user_ids = list(range(100, 120))
+        # Several first messages per user, all at once
+        exchanges = await asyncio.gather(
+            *(load_exchange(user_id) for user_id in user_ids for _ in range(5))
+        )
+        assert all(e.preference.bot_name == config.DEFAULT_BOT for e in exchanges)
+        assert await preference_rows(user_ids) == {user_id: 1 for user_id in user_ids}
+
+    run_with_db(test)
+
+
+def test_concurrent_preference_writes_leave_the_cache_as_stored(
+    file_db: None, run_with_db: Any
+) -> None:
+    async def test() -> None:
+        user_id = 200
+        for round in range(20):
+            preference_cache.invalidate(user_id)
+            temperatures = [round / 100 + i / 1000 for i in range(5)]
+            # First messages creating the defaults race /start-like updates
+            await asyncio.gather(
+                *(load_exchange(user_id) for _ in range(3)),
+                *(
+                    set_user_preference(user_id, temperature=temperature, bot_name=f"Bot-{i}")
+                    for i, temperature in enumerate(temperatures)
+                ),
+                get_user_preference(user_id),
+            )
+            async with session_scope() as db:
+                stored = await db.scalar(
+                    select(UserPreference).where(UserPreference.user_id == user_id)
+                )
+            cached = preference_cache.get(user_id) or await get_user_preference(user_id)
+            assert stored is not None and stored.temperature in temperatures
+            assert (cached.temperature, cached.bot_name) == (stored.temperature, stored.bot_name)
+        assert await preference_rows([user_id]) == {user_id: 1}
+
+    run_with_db(test)
+
+
+def test_a_first_message_does_not_cache_defaults_over_a_newer_write(
+    file_db: None, run_with_db: Any, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    async def test() -> None:
+        user_id = 201
+        written = asyncio.Event()
+        create_default_preference = database.create_default_preference
+
+        async def slow_create(db: Any, user_id: int) -> Any:
+            preference = await create_default_preference(db, user_id)
+            # The defaults are read; /start changes them before they are cached
+            await written.wait()
+            return preference
+
+        async def start() -> None:
+            await asyncio.sleep(0.01)
+            await set_user_preference(user_id, temperature=0.2, bot_name="Bot-start")
+            written.set()
+
+        monkeypatch.setattr(database, "create_default_preference", slow_create)
+        await asyncio.gather(load_exchange(user_id), start())
+
+        preference = await get_user_preference(user_id)
+        assert (preference.temperature, preference.bot_name) == (0.2, "Bot-start")
+
+    run_with_db(test)
+
+
+async def seed_history(user_id: int, messages: int, start: datetime) -> None:
+    rows = []
+    for i in range(messages):
+        row = history_row(user_id, "user", f"message {i}", "GPT-4o")
+        # Pairs of messages share a timestamp, like both sides of an exchange
+        row["timestamp"] = start + timedelta(seconds=i // 2)
+        rows.append(row)
+    await insert_history_rows(rows)
+
+
+async def history_contents(user_id: int) -> list[str]:
+    async with session_scope() as db:
+        return list(
+            await db.scalars(
+                select(ConversationHistory.content)
+                .where(ConversationHistory.user_id == user_id)
+                .order_by(ConversationHistory.id)
+            )
+        )
+
+
+def test_history_with_equal_timestamps_keeps_the_order_it_was_written_in(
+    run_with_db: Any,
+) -> None:
+    async def test() -> None:
+        rows = [history_row(400, "user", f"message {i}", "GPT-4o") for i in range(6)]
+        for row in rows:
+            row["timestamp"] = datetime(2024, 1, 1)
+        await insert_history_rows(rows)
+
+        history = await get_conversation_history(400, limit=4)
+        assert [row.content for row in history] == [f"message {i}" for i in range(2, 6)]
+        after = await get_conversation_history(400, limit=None, after_id=history[1].id)
+        assert [row.content for row in after] == ["message 4", "message 5"]
+
+    run_with_db(test)
+
+
+def test_excess_history_is_deleted_in_batches_oldest_first(run_with_db: Any) -> None:
+    async def test() -> None:
+        start = datetime(2024, 1, 1)
+        await seed_history(300, 25, start)
+        await seed_history(301, 12, start)
+        await seed_history(302, 5, start)
+
+        # 15 + 2 messages over the limit, deleted 4 at a time
+        batches = [await delete_excess_history(10, 4) for _ in range(6)]
+        assert batches == [4, 4, 4, 4, 1, 0]
+
+        assert await history_contents(300) == [f"message {i}" for i in range(15, 25)]
+        assert await history_contents(301) == [f"message {i}" for i in range(2, 12)]
+        assert await history_contents(302) == [f"message {i}" for i in range(5)]
+
+    run_with_db(test)
@@ -0,0 +1,75 @@
+from typing import Any
+
+import pytest
+from sqlalchemy import select
+from telegram import Update
+from telegram.ext import Application, ApplicationHandlerStop, ExtBot, TypeHandler
+
+from poe_tg.db.database import session_scope
+from poe_tg.db.models import ProcessedUpdate
+from poe_tg.telegram_handler import dedup
+from poe_tg.telegram_handler.dedup import UpdateDeduplicator, drop_duplicate_updates
+
+
+@pytest.fixture
+def deduplicator(monkeypatch: pytest.MonkeyPatch) -> UpdateDeduplicator:
+    deduplicator = UpdateDeduplicator(maxsize=100, persist=True)
+    monkeypatch.setattr(dedup, "deduplicator", deduplicator)
+    return deduplicator
+
+
+async def application(handled: list[int]) -> Application:
+    """An application with the dedup handler in group -1, as `setup_handlers` adds it."""
+
+    async def handle(update: Update, _context: Any) -> None:
+        handled.append(update.update_id)
+
+    app = Application.builder().token("test").build()
+    app.add_handler(TypeHandler(Update, drop_duplicate_updates), group=-1)
+    app.add_handler(TypeHandler(Update, handle))
+    await app.initialize()
+    return app
+
+
+def test_redelivered_update_is_dropped(
+    deduplicator: UpdateDeduplicator, run_with_db: Any, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    async def offline(_bot: ExtBot) -> None:
+        pass
+
+    # Initializing the bot would call getMe
+    monkeypatch.setattr(ExtBot, "initialize", offline)
+
+    async def test() -> None:
+        await drop_duplicate_updates(Update(1), None)  # type: ignore[arg-type]
+        with pytest.raises(ApplicationHandlerStop):
+            await drop_duplicate_updates(Update(1), None)  # type: ignore[arg-type]
+
+        # Later handler groups never see the redelivery
+        handled: list[int] = []
+        app = await application(handled)
+        for update_id in (2, 2, 3, 2):
+            await app.process_update(Update(update_id))
+        await app.shutdown()
+        assert handled == [2, 3]
+        assert deduplicator.stats() == {"remembered": 3, "duplicates": 3}
+
+    run_with_db(test)
+
+
+def test_new_update_passes_and_is_recorded(
+    deduplicator: UpdateDeduplicator, run_with_db: Any
+) -> None:
+    async def test() -> None:
+        await drop_duplicate_updates(Update(10), None)  # type: ignore[arg-type]
+
+        async with session_scope() as db:
+            recorded = list(await db.scalars(select(ProcessedUpdate.update_id)))
+        assert recorded == [10]
+
+        # After a restart the in-memory ids are gone, the recorded one still counts
+        restarted = UpdateDeduplicator(maxsize=100, persist=True)
+        assert await restarted.is_duplicate(10)
+        assert not await restarted.is_duplicate(11)
+
+    run_with_db(test)
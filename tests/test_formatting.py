@@ -0,0 +1,120 @@
+import random
+from html.parser import HTMLParser
+
+import pytest
+
+from poe_tg import config
+from poe_tg.formatting import markdown_to_html, render_chunks
+
+TELEGRAM_TAGS = {"b", "i", "s", "code", "pre", "a", "blockquote"}
+
+
+class TagChecker(HTMLParser):
+    """Fails on tags Telegram does not support and on tags that do not nest."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.stack: list[str] = []
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        assert tag in TELEGRAM_TAGS, tag
+        self.stack.append(tag)
+
+    def handle_endtag(self, tag: str) -> None:
+        assert self.stack and self.stack.pop() == tag, tag
+
+
+def assert_well_formed(html: str) -> None:
+    checker = TagChecker()
+    checker.feed(html)
+    checker.close()
+    assert checker.stack == []
+
+
+@pytest.mark.parametrize(
+    "markdown, html",
+    [
+        ("**bold _italic_ text**", "<b>bold <i>italic</i> text</b>"),
+        ("~~gone~~ and __strong__", "<s>gone</s> and <b>strong</b>"),
+        # Unclosed delimiters stay as typed, inside and outside other markup
+        ("**bold _unclosed** tail", "<b>bold _unclosed</b> tail"),
+        ("_a **b_ c**", "<i>a **b</i> c**"),
+        ("*not closed", "*not closed"),
+        ("** spaced **", "** spaced **"),
+        ("snake_case_name", "snake_case_name"),
+        ("a < b && c > d", "a &lt; b &amp;&amp; c &gt; d"),
+        ("<b>raw</b>", "&lt;b&gt;raw&lt;/b&gt;"),
+        ("`a<b> **x**`", "<code>a&lt;b&gt; **x**</code>"),
+        (
+            "[link](https://example.com/?a=1&b=2)",
+            '<a href="https://example.com/?a=1&amp;b=2">link</a>',
+        ),
+        ("[bad](javascript:alert(1))", "[bad](javascript:alert(1))"),
+        (
+            "# Title *x*\n- item **b**\n> quote & <q>",
+            "<b>Title <i>x</i></b>\n• item <b>b</b>\n"
+            "<blockquote>quote &amp; &lt;q&gt;</blockquote>",
+        ),
+        ("| a | b |\n|---|---|", "<pre>| a | b |\n|---|---|</pre>"),
+    ],
+)
+def test_markdown_to_html(markdown: str, html: str) -> None:
+    assert markdown_to_html(markdown) == html
+
+
+def test_code_blocks_keep_markdown_characters_literal() -> None:
+    markdown = "```python\nx = a * b_c  # **not bold** <tag> & [x](https://a.b)\n```\n**after**"
+
+    assert markdown_to_html(markdown) == (
+        '<pre><code class="language-python">'
+        "x = a * b_c  # **not bold** &lt;tag&gt; &amp; [x](https://a.b)"
+        "</code></pre>\n<b>after</b>"
+    )
+
+
+def test_an_unclosed_code_block_runs_to_the_end() -> None:
+    assert markdown_to_html("text\n```\n*a* <b>") == "text\n<pre><code>*a* &lt;b&gt;</code></pre>"
+
+
+MARKDOWN_PIECES = [
+    "**", "__", "*", "_", "~~", "`", "```", "```python", "[x](https://a.b/?q=1&r=2)", "[",
+    "](", ")", "<", ">", "&", "\n", "\n", "> ", "| a |", "# ", "- ", "word", "snake_case", " ",
+]
+
+
+def random_markdown(rng: random.Random, pieces: int) -> str:
+    return "".join(rng.choice(MARKDOWN_PIECES) for _ in range(pieces))
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_html_is_always_well_formed(seed: int) -> None:
+    assert_well_formed(markdown_to_html(random_markdown(random.Random(seed), 60)))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_chunks_never_cut_a_tag_in_half(seed: int, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(config, "FORMAT_RESPONSES", True)
+    text = random_markdown(random.Random(seed), 2000)
+
+    chunks = render_chunks(text, 300)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(chunk.text) <= 300
+        assert chunk.html is not None
+        assert_well_formed(chunk.html)
+
+
+def test_chunks_with_too_many_entities_are_split_further(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(config, "FORMAT_RESPONSES", True)
+    monkeypatch.setattr(config, "TELEGRAM_MAX_ENTITIES", 10)
+    text = " ".join(["**bold**"] * 200)
+
+    chunks = render_chunks(text, 4000)
+    assert len(chunks) > 1
+    assert " ".join(chunk.text for chunk in chunks).split() == text.split()
+    for chunk in chunks:
+        if chunk.html is not None:
+            assert chunk.html.count("<b>") <= 10
+            assert_well_formed(chunk.html)
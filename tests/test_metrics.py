@@ -0,0 +1,73 @@
+import pytest
+
+from poe_tg import config, metrics
+from poe_tg.metrics import Counter, Histogram, Registry, Stats
+
+
+def test_registry_renders_the_prometheus_text_format() -> None:
+    registry = Registry()
+    requests = registry.register(
+        Counter("test_requests_total", "Requests by bot", ("bot", "outcome"))
+    )
+    seconds = registry.register(
+        Histogram("test_seconds", "Time per stage", ("stage",), buckets=(0.1, 1.0))
+    )
+    stats = registry.register(Stats("test_stats", "Component statistics"))
+
+    def broken() -> dict[str, float]:
+        raise RuntimeError("not started")
+
+    requests.inc("GPT-4o", "ok")
+    requests.inc("GPT-4o", "ok")
+    requests.inc('say "hi"\n', "error", amount=0.5)
+    seconds.observe(0.05, "poe")
+    seconds.observe(0.1, "poe")
+    seconds.observe(2.5, "poe")
+    stats.sources["queue"] = lambda: {"size": 3, "hit_rate": 0.25}
+    stats.sources["broken"] = broken
+
+    assert registry.render() == "\n".join(
+        [
+            "# HELP test_requests_total Requests by bot",
+            "# TYPE test_requests_total counter",
+            'test_requests_total{bot="GPT-4o",outcome="ok"} 2',
+            'test_requests_total{bot="say \\"hi\\"\\n",outcome="error"} 0.5',
+            "# HELP test_seconds Time per stage",
+            "# TYPE test_seconds histogram",
+            'test_seconds_bucket{stage="poe",le="0.1"} 2',
+            'test_seconds_bucket{stage="poe",le="1.0"} 2',
+            'test_seconds_bucket{stage="poe",le="+Inf"} 3',
+            'test_seconds_sum{stage="poe"} 2.65',
+            'test_seconds_count{stage="poe"} 3',
+            "# HELP test_stats Component statistics",
+            "# TYPE test_stats untyped",
+            'test_stats{component="queue",stat="size"} 3',
+            'test_stats{component="queue",stat="hit_rate"} 0.25',
+        ]
+    ) + "\n"
+
+
+def test_metric_names_are_unique() -> None:
+    registry = Registry()
+    registry.register(Counter("test_total", "First"))
+
+    with pytest.raises(ValueError, match="already registered"):
+        registry.register(Counter("test_total", "Second"))
+
+
+def test_process_registry_renders_timings_errors_and_stats(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(config, "METRICS_ENABLED", True)
+    monkeypatch.setitem(metrics.stats.sources, "test_component", lambda: {"size": 7})
+
+    with pytest.raises(KeyError):
+        with metrics.timed("test_stage"):
+            raise KeyError("text")
+
+    text = metrics.registry.render()
+    assert "# TYPE poe_tg_stage_seconds histogram" in text
+    assert 'poe_tg_stage_seconds_count{stage="test_stage"} 1' in text
+    assert "# TYPE poe_tg_errors_total counter" in text
+    assert 'poe_tg_errors_total{stage="test_stage",error="KeyError"} 1' in text
+    assert 'poe_tg_stats{component="test_component",stat="size"} 7' in text
@@ -0,0 +1,233 @@
+import asyncio
+import contextvars
+from contextlib import aclosing
+from types import SimpleNamespace
+from typing import Any
+
+import fastapi_poe as fp
+import httpx
+import pytest
+
+from poe_tg import config, http_client, poe_client, tracing
+from poe_tg.circuit_breaker import CLOSED, CircuitBreakers, PoeTimeoutError
+from poe_tg.http_client import PoeHTTPClient, poe_http, raise_for_status
+from poe_tg.poe_client import poe_scheduler, stream_bot_response, stream_poe_response
+
+
+def make_update(user_id: int, text: str) -> tuple[Any, Any]:
+    message = SimpleNamespace(
+        chat_id=user_id, text=text, caption=None, photo=[], document=None, media_group_id=None
+    )
+    update = SimpleNamespace(
+        update_id=1,
+        effective_user=SimpleNamespace(id=user_id, username=f"user{user_id}"),
+        message=message,
+        effective_message=message,
+    )
+    return update, SimpleNamespace(bot=None, user_data={})
+
+
+@pytest.fixture
+def poe_stream(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    """Replace Poe with a long stream; the returned list records how it ended."""
+    events: list[str] = []
+
+    async def fake_stream_request(*_args: Any, **_kwargs: Any):
+        try:
+            for i in range(1000):
+                await asyncio.sleep(0)
+                yield fp.PartialResponse(text=f"part {i} ")
+            events.append("finished")
+        finally:
+            events.append("closed")
+
+    monkeypatch.setattr(fp, "stream_request", fake_stream_request)
+    return events
+
+
+def test_stream_is_released_when_the_consumer_fails(
+    poe_stream: list[str], run_with_db: Any
+) -> None:
+    async def test() -> None:
+        update, context = make_update(1, "hello")
+        with pytest.raises(RuntimeError, match="Telegram"):
+            async with aclosing(stream_poe_response(update, context)) as stream:
+                async for _ in stream:
+                    raise RuntimeError("Telegram is down")
+        # Released right away, not whenever the generator is collected
+        assert poe_scheduler.active == 0
+        assert poe_stream == ["closed"]
+
+    run_with_db(test)
+
+
+def test_stream_reports_errors_as_text(
+    monkeypatch: pytest.MonkeyPatch, run_with_db: Any
+) -> None:
+    async def failing_stream_request(*_args: Any, **_kwargs: Any):
+        yield fp.PartialResponse(text="Hello")
+        raise fp.BotErrorNoRetry("bad request")
+
+    monkeypatch.setattr(fp, "stream_request", failing_stream_request)
+
+    async def test() -> None:
+        update, context = make_update(2, "hello")
+        async with aclosing(stream_poe_response(update, context)) as stream:
+            parts = [text async for text in stream]
+        assert parts[0] == "Hello"
+        assert parts[-1] == "\n\nSorry, I encountered an error: bad request"
+        assert poe_scheduler.active == 0
+
+    run_with_db(test)
+
+
+def test_poe_span_does_not_leak_into_the_caller(
+    poe_stream: list[str], run_with_db: Any
+) -> None:
+    async def test() -> None:
+        update, context = make_update(3, "hello")
+        stream = stream_poe_response(update, context)
+        with tracing.trace("update") as root:
+            await anext(stream)
+            # The Poe span is not left open in the caller's context
+            assert tracing.current_span.get() is root
+            trace = root.trace
+
+        # Closed from an unrelated context, as the garbage collector would
+        await contextvars.Context().run(asyncio.ensure_future, stream.aclose())
+        assert poe_stream == ["closed"]
+        (span,) = [span for span in trace.spans if span.name == "poe.response"]
+        assert span.attributes["parts"] == 1
+        assert span.end is not None
+
+    run_with_db(test)
+
+
+@pytest.fixture
+def breakers(monkeypatch: pytest.MonkeyPatch) -> CircuitBreakers:
+    breakers = CircuitBreakers(failure_threshold=2, reset_timeout=30)
+    monkeypatch.setattr(poe_client, "poe_breakers", breakers)
+    monkeypatch.setattr(config, "POE_RETRY_BASE_DELAY", 0.001)
+    return breakers
+
+
+async def ask(bot_name: str) -> str:
+    messages = [fp.ProtocolMessage(role="user", content="hi")]
+    return "".join(
+        [text async for _, text in stream_bot_response(messages, bot_name, 0.7)]
+    )
+
+
+def mock_poe_client(status: int, calls: list[str]) -> httpx.AsyncClient:
+    """A client like `poe_http`'s, answering every request with `status`."""
+
+    def answer(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.path)
+        return httpx.Response(status, json={"detail": "mocked"})
+
+    return httpx.AsyncClient(
+        transport=httpx.MockTransport(answer),
+        event_hooks={"response": [raise_for_status]},
+    )
+
+
+def test_each_attempt_is_one_http_call(monkeypatch: pytest.MonkeyPatch) -> None:
+    breakers = CircuitBreakers(failure_threshold=10, reset_timeout=30)
+    monkeypatch.setattr(poe_client, "poe_breakers", breakers)
+    monkeypatch.setattr(config, "POE_RETRIES", 2)
+    monkeypatch.setattr(config, "POE_RETRY_BASE_DELAY", 0.001)
+    monkeypatch.setattr(config, "POE_FALLBACKS", False)
+    calls: list[str] = []
+
+    async def test() -> None:
+        client = mock_poe_client(503, calls)
+        monkeypatch.setattr(poe_http, "client", client)
+        with pytest.raises(fp.BotError, match="Error communicating"):
+            await ask("GPT-4o")
+        await client.aclose()
+
+    asyncio.run(test())
+    # fastapi_poe does not retry on its own: one call per attempt, one failure per call
+    assert calls == ["/bot/GPT-4o"] * 3
+    assert breakers.get("GPT-4o").failures == 3
+
+
+def test_rejected_requests_are_not_retried(
+    monkeypatch: pytest.MonkeyPatch, breakers: CircuitBreakers
+) -> None:
+    calls: list[str] = []
+
+    async def test() -> None:
+        client = mock_poe_client(401, calls)
+        monkeypatch.setattr(poe_http, "client", client)
+        for _ in range(2):
+            with pytest.raises(fp.BotErrorNoRetry, match="401 Unauthorized"):
+                await ask("Claude-3.7-Sonnet")
+        await client.aclose()
+
+    asyncio.run(test())
+    # One call per message: no retries, no fallback, and the bot is not to blame
+    assert calls == ["/bot/Claude-3.7-Sonnet"] * 2
+    assert breakers.get("Claude-3.7-Sonnet").state == CLOSED
+    assert breakers.get("Claude-3.7-Sonnet").failures == 0
+
+
+def test_our_own_errors_leave_the_breaker_alone(
+    monkeypatch: pytest.MonkeyPatch, breakers: CircuitBreakers
+) -> None:
+    async def broken_stream_request(*_args: Any, **_kwargs: Any):
+        raise TypeError("unexpected keyword argument")
+        yield
+
+    monkeypatch.setattr(fp, "stream_request", broken_stream_request)
+    breaker = breakers.get("GPT-4o")
+    breaker.record_failure()
+
+    with pytest.raises(TypeError):
+        asyncio.run(ask("GPT-4o"))
+    assert breaker.failures == 1
+
+
+def test_retries_and_fallbacks_share_one_deadline(
+    monkeypatch: pytest.MonkeyPatch, breakers: CircuitBreakers
+) -> None:
+    calls: list[str] = []
+
+    async def hanging_stream_request(*_args: Any, bot_name: str, **_kwargs: Any):
+        calls.append(bot_name)
+        await asyncio.sleep(3600)
+        yield fp.PartialResponse(text="too late")
+
+    monkeypatch.setattr(fp, "stream_request", hanging_stream_request)
+    monkeypatch.setattr(config, "POE_CONNECT_TIMEOUT", 0.2)
+    monkeypatch.setattr(config, "POE_TOTAL_TIMEOUT", 0.5)
+
+    async def test() -> None:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        with pytest.raises(PoeTimeoutError, match="did not answer within 0.5 seconds"):
+            await ask("Claude-3.7-Sonnet")
+        assert loop.time() - start < 0.6
+
+    asyncio.run(test())
+    # Without the deadline: 3 attempts on each of the 3 bots of the chain
+    assert 2 <= len(calls) < 9
+
+
+def test_missing_h2_is_a_warning(
+    monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    monkeypatch.setattr(config, "POE_HTTP2", True)
+    monkeypatch.setattr(http_client, "find_spec", lambda name: None)
+
+    async def test() -> None:
+        client = PoeHTTPClient()
+        await client.start()
+        await client.stop()
+
+    with caplog.at_level("INFO", logger=config.logger.name):
+        asyncio.run(test())
+    assert [(r.levelname, r.message) for r in caplog.records] == [
+        ("WARNING", "POE_HTTP2 is set but h2 is not installed, using HTTP/1.1"),
+        ("INFO", "Poe HTTP client started (HTTP/1.1)"),
+    ]
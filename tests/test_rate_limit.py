@@ -0,0 +1,153 @@
+import asyncio
+from typing import Hashable
+
+import pytest
+
+from poe_tg.rate_limit import FairScheduler, RateLimiter, TokenBucket, parse_weights
+
+
+class Clock:
+    """A clock that only moves when told to."""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def test_token_bucket_allows_a_burst_then_refills_at_its_rate() -> None:
+    clock = Clock()
+    bucket = TokenBucket(rate=2, capacity=3, clock=clock)
+
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    assert bucket.retry_after() == pytest.approx(0.5)
+
+    clock.advance(0.25)
+    assert not bucket.try_acquire()
+    assert bucket.retry_after() == pytest.approx(0.25)
+
+    clock.advance(0.25)
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+
+def test_token_bucket_never_holds_more_than_its_capacity() -> None:
+    clock = Clock()
+    bucket = TokenBucket(rate=10, capacity=2, clock=clock)
+    clock.advance(3600)
+
+    assert [bucket.try_acquire() for _ in range(3)] == [True, True, False]
+    assert bucket.retry_after() == pytest.approx(0.1)
+
+
+def test_rate_limiter_limits_each_key_separately() -> None:
+    clock = Clock()
+    limiter = RateLimiter(rate_per_minute=60, burst=2, clock=clock)
+
+    assert [limiter.try_acquire("a") for _ in range(3)] == [True, True, False]
+    assert limiter.try_acquire("b")
+    assert limiter.retry_after("a") == pytest.approx(1)
+
+    clock.advance(1)
+    assert limiter.try_acquire("a")
+    assert limiter.stats() == {"keys": 2, "limited": 1}
+
+
+def test_rate_limiter_without_a_rate_never_limits() -> None:
+    limiter = RateLimiter(rate_per_minute=0, burst=0, clock=Clock())
+
+    assert all(limiter.try_acquire("a") for _ in range(100))
+    assert limiter.stats() == {"keys": 0, "limited": 0}
+
+
+def test_rate_limiter_forgets_the_least_recently_used_key() -> None:
+    clock = Clock()
+    limiter = RateLimiter(rate_per_minute=60, burst=1, max_keys=2, clock=clock)
+
+    assert limiter.try_acquire("a")
+    assert limiter.try_acquire("b")
+    # Using "a" again makes "b" the least recently used key
+    assert not limiter.try_acquire("a")
+    assert limiter.try_acquire("c")
+
+    assert limiter.stats() == {"keys": 2, "limited": 1}
+    # "b" starts over with a full bucket, "a" is still limited
+    assert limiter.try_acquire("b")
+    assert not limiter.try_acquire("c")
+
+
+def run_scheduler(
+    scheduler: FairScheduler, requests: list[Hashable], weights: dict[Hashable, float]
+) -> list[Hashable]:
+    """Queue `requests` behind one busy slot and return the order they are served in."""
+    served: list[Hashable] = []
+
+    async def request(key: Hashable) -> None:
+        async with scheduler.slot(key, weights.get(key, 1.0)):
+            served.append(key)
+            await asyncio.sleep(0)
+
+    async def main() -> None:
+        release = asyncio.Event()
+
+        async def busy() -> None:
+            async with scheduler.slot("busy"):
+                await release.wait()
+
+        holder = asyncio.create_task(busy())
+        await asyncio.sleep(0)
+        tasks = []
+        for key in requests:
+            tasks.append(asyncio.create_task(request(key)))
+            # Queue them in exactly this order
+            await asyncio.sleep(0)
+        assert scheduler.waiting == len(requests)
+        release.set()
+        await asyncio.gather(holder, *tasks)
+        assert scheduler.stats() == {"capacity": 1, "active": 0, "waiting": 0}
+
+    asyncio.run(main())
+    return served
+
+
+def test_fair_scheduler_takes_turns_between_keys() -> None:
+    served = run_scheduler(FairScheduler(1), ["a"] * 4 + ["b"] * 2, {})
+
+    # "b" queued last but does not wait behind all of "a"
+    assert served == ["a", "b", "a", "b", "a", "a"]
+
+
+def test_fair_scheduler_shares_slots_by_weight() -> None:
+    served = run_scheduler(FairScheduler(1), ["a"] * 4 + ["b"] * 4, {"a": 2})
+
+    assert served[:6] == ["a", "b", "a", "a", "b", "a"]
+
+
+def test_fair_scheduler_passes_on_a_slot_of_a_cancelled_request() -> None:
+    async def test() -> None:
+        scheduler = FairScheduler(1)
+        served: list[str] = []
+
+        async def request(key: str) -> None:
+            async with scheduler.slot(key):
+                served.append(key)
+
+        async with scheduler.slot("busy"):
+            cancelled = asyncio.create_task(request("cancelled"))
+            waiting = asyncio.create_task(request("waiting"))
+            await asyncio.sleep(0)
+            cancelled.cancel()
+        await asyncio.gather(cancelled, waiting, return_exceptions=True)
+
+        assert served == ["waiting"]
+        assert scheduler.stats() == {"capacity": 1, "active": 0, "waiting": 0}
+
+    asyncio.run(test())
+
+
+def test_parse_weights_skips_incomplete_items() -> None:
+    assert parse_weights("alice:2, bob:0.5,carol,:3,") == {"alice": 2.0, "bob": 0.5}
@@ -0,0 +1,85 @@
+import asyncio
+from typing import Any
+
+import fastapi_poe as fp
+import pytest
+
+from poe_tg import config
+from poe_tg.db.database import (
+    clear_conversation_history,
+    get_conversation_summary,
+    history_row,
+    insert_history_rows,
+)
+from poe_tg.summarizer import HistorySummarizer, summarize_history
+
+
+async def seed_history(user_id: int, messages: int) -> None:
+    await insert_history_rows(
+        [
+            history_row(user_id, "user" if i % 2 == 0 else "bot", f"message {i}", "GPT-4o")
+            for i in range(messages)
+        ]
+    )
+
+
+def test_summary_is_saved(monkeypatch: pytest.MonkeyPatch, run_with_db: Any) -> None:
+    async def get_final_response(*_args: Any, **_kwargs: Any) -> str:
+        return "The user said hello."
+
+    monkeypatch.setattr(fp, "get_final_response", get_final_response)
+
+    async def test() -> None:
+        await seed_history(10, config.SUMMARY_TRIGGER_MESSAGES)
+        assert await summarize_history(10)
+        summary = await get_conversation_summary(10)
+        assert summary.content == "The user said hello."
+        assert summary.summarized_until_id > 0
+
+    run_with_db(test)
+
+
+def test_summary_of_cleared_history_is_dropped(
+    monkeypatch: pytest.MonkeyPatch, run_with_db: Any
+) -> None:
+    async def get_final_response(*_args: Any, **_kwargs: Any) -> str:
+        # /clear_history while the summary is being written
+        await clear_conversation_history(11)
+        return "Summary of the cleared conversation."
+
+    monkeypatch.setattr(fp, "get_final_response", get_final_response)
+
+    async def test() -> None:
+        await seed_history(11, config.SUMMARY_TRIGGER_MESSAGES)
+        assert not await summarize_history(11)
+        assert (await get_conversation_summary(11)).content == ""
+
+    run_with_db(test)
+
+
+def test_discarded_user_is_not_summarized(monkeypatch: pytest.MonkeyPatch) -> None:
+    summarized: list[int] = []
+
+    async def fake_summarize(user_id: int) -> bool:
+        summarized.append(user_id)
+        return True
+
+    monkeypatch.setattr("poe_tg.summarizer.summarize_history", fake_summarize)
+    monkeypatch.setattr(config, "SUMMARY_ENABLED", True)
+
+    async def test() -> None:
+        worker = HistorySummarizer(workers=1)
+        await worker.start()
+        worker.schedule(1)
+        worker.schedule(2)
+        worker.discard(1)
+        # Scheduled again after the discard: the queued request stands
+        worker.schedule(2)
+        worker.discard(2)
+        worker.schedule(2)
+        assert worker.queue is not None
+        await worker.queue.join()
+        await worker.stop()
+        assert summarized == [2]
+
+    asyncio.run(test())
@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+from telegram import Chat, Message, Update
+
+from poe_tg.media_group import media_groups
+from poe_tg.telegram_handler import message_handler
+from poe_tg.update_processor import ChatOrderedUpdateProcessor
+
+update_ids = iter(range(1, 1_000_000))
+
+
+def make_update(chat_id: int, media_group_id: str | None = None) -> Update:
+    update_id = next(update_ids)
+    message = Message(
+        update_id,
+        datetime.now(),
+        Chat(chat_id, Chat.PRIVATE),
+        text="hello",
+        media_group_id=media_group_id,
+    )
+    return Update(update_id, message=message)
+
+
+def test_updates_of_a_chat_run_in_order() -> None:
+    async def test() -> None:
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=8)
+        handled: list[int] = []
+
+        async def handle(i: int) -> None:
+            # Later updates finish faster, so only the ordering keeps them in place
+            await asyncio.sleep((10 - i) / 1000)
+            handled.append(i)
+
+        await asyncio.gather(
+            *(processor.process_update(make_update(1), handle(i)) for i in range(10))
+        )
+        assert handled == list(range(10))
+        assert processor.stats() == {"active_chats": 0, "pending_updates": 0}
+
+    asyncio.run(test())
+
+
+def test_a_busy_chat_does_not_starve_other_chats() -> None:
+    async def test() -> None:
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=2)
+        release = asyncio.Event()
+        handled: list[int] = []
+
+        async def handle(chat_id: int) -> None:
+            if chat_id == 1:
+                await release.wait()
+            handled.append(chat_id)
+
+        # More updates queued for chat 1 than there are concurrency slots
+        busy = [
+            asyncio.create_task(processor.process_update(make_update(1), handle(1)))
+            for _ in range(5)
+        ]
+        await asyncio.wait_for(processor.process_update(make_update(2), handle(2)), 1)
+        assert handled == [2]
+        assert processor.current_concurrent_updates == 1
+
+        release.set()
+        await asyncio.gather(*busy)
+        assert handled == [2, 1, 1, 1, 1, 1]
+
+    asyncio.run(test())
+
+
+def test_album_reply_waits_for_the_chat_turn(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def test() -> None:
+        processor = ChatOrderedUpdateProcessor()
+        context: Any = SimpleNamespace(application=SimpleNamespace(update_processor=processor))
+        release = asyncio.Event()
+        events: list[str] = []
+
+        async def respond(update: Update, _context: Any, album: list[Message]) -> None:
+            events.append(f"album of {len(album)}")
+
+        async def allow(_update: Update) -> bool:
+            return True
+
+        async def earlier_update() -> None:
+            await release.wait()
+            events.append("earlier update")
+
+        monkeypatch.setattr(media_groups, "wait", 0)
+        monkeypatch.setattr(message_handler, "respond", respond)
+        monkeypatch.setattr(message_handler, "check_rate_limit", allow)
+
+        first, second = make_update(1, "album"), make_update(1, "album")
+        media_groups.add(first.message)
+        media_groups.add(second.message)
+        earlier = asyncio.create_task(processor.process_update(make_update(1), earlier_update()))
+        await asyncio.sleep(0)
+        album = asyncio.create_task(message_handler.respond_to_album(first, context))
+        await asyncio.sleep(0.01)
+        assert events == []
+
+        release.set()
+        await asyncio.gather(earlier, album)
+        assert events == ["earlier update", "album of 2"]
+
+    asyncio.run(test())
@@ -0,0 +1,156 @@
+import asyncio
+import random
+import re
+from typing import Any
+
+import pytest
+
+from poe_tg.streaming import StreamingReply
+from poe_tg.utils import FENCE, FENCE_CLOSE, find_code_blocks, iter_chunks, split_message
+
+FENCE_PATTERN = re.compile(r"^[ \t]*```", re.MULTILINE)
+WORDS = "the quick brown fox jumps over a lazy dog while models stream tokens".split()
+
+
+def random_text(rng: random.Random, size: int) -> str:
+    """Prose, fenced code (some of it indented) and very long words."""
+    parts: list[str] = []
+    length = 0
+    while length < size:
+        kind = rng.random()
+        if kind < 0.15:
+            language = rng.choice(["", "python", "js"])
+            lines = [
+                " " * rng.choice([0, 4, 8]) + " ".join(rng.choices(WORDS, k=rng.randint(1, 12)))
+                for _ in range(rng.randint(1, 120))
+            ]
+            part = f"\n{FENCE}{language}\n" + "\n".join(lines) + f"\n{FENCE}\n"
+        elif kind < 0.2:
+            part = "x" * rng.randint(1, 6000)
+        else:
+            part = " ".join(rng.choices(WORDS, k=rng.randint(1, 400)))
+        parts.append(part)
+        parts.append(rng.choice(["\n\n", "\n", " ", "\n\n\n"]))
+        length += len(part) + 2
+    return "".join(parts)
+
+
+def random_cases(count: int, seed: int) -> list[tuple[str, int]]:
+    rng = random.Random(seed)
+    return [
+        (random_text(rng, rng.randint(1, 30_000)), rng.choice([64, 200, 1000, 4096]))
+        for _ in range(count)
+    ]
+
+
+CASES = random_cases(300, seed=1)
+
+
+@pytest.mark.parametrize("text,limit", CASES)
+def test_chunks_fit_the_limit(text: str, limit: int) -> None:
+    for piece in split_message(text, limit):
+        assert len(piece) <= limit
+
+
+@pytest.mark.parametrize("text,limit", CASES)
+def test_chunks_preserve_content(text: str, limit: int) -> None:
+    chunks = list(iter_chunks(text, limit))
+    if len(text) <= limit:
+        assert split_message(text, limit) == [text]
+        return
+    assert split_message(text, limit) == [chunk.render(text) for chunk in chunks]
+    assert chunks[0].start == 0 and chunks[-1].end == len(text)
+
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk.start < chunk.end
+        gap = text[previous.end : chunk.start]
+        # Only whitespace is dropped between chunks, only the line break inside code
+        if previous.suffix:
+            assert gap in ("", "\n")
+        else:
+            assert not gap.strip()
+
+    rebuilt = "".join(
+        text[chunk.start : chunk.end] + text[chunk.end : following.start]
+        for chunk, following in zip(chunks, chunks[1:] + [chunks[-1]._replace(start=len(text))])
+    )
+    assert rebuilt == text
+
+
+@pytest.mark.parametrize("text,limit", CASES)
+def test_code_blocks_are_closed_and_reopened(text: str, limit: int) -> None:
+    chunks = list(iter_chunks(text, limit))
+    starts, _, _, languages = find_code_blocks(text)
+    balanced = len(FENCE_PATTERN.findall(text)) % 2 == 0
+
+    for chunk in chunks:
+        if balanced:
+            assert len(FENCE_PATTERN.findall(chunk.render(text))) % 2 == 0
+
+    for previous, chunk in zip(chunks, chunks[1:]):
+        if previous.suffix:
+            assert previous.suffix == FENCE_CLOSE
+            # Reopened with the language of the block it continues
+            block = max(i for i, start in enumerate(starts) if start < chunk.start)
+            assert chunk.prefix.startswith(FENCE)
+            assert chunk.prefix[len(FENCE) : -1] in (languages[block], "")
+        else:
+            assert not chunk.prefix
+
+
+def test_code_block_split_keeps_language() -> None:
+    code = "\n".join(f"    line {i}" for i in range(200))
+    text = f"Intro\n\n```python\n{code}\n```\nOutro"
+    pieces = split_message(text, 500)
+    assert len(pieces) > 2
+    for piece in pieces[1:-1]:
+        assert piece.startswith("```python\n")
+        assert piece.endswith(FENCE_CLOSE)
+
+
+class FakeMessage:
+    """Records the text of every reply and its latest edit."""
+
+    def __init__(self, sent: list["FakeMessage"], text: str = ""):
+        self.sent = sent
+        self.text = text
+
+    async def reply_text(self, text: str, **_kwargs: Any) -> "FakeMessage":
+        reply = FakeMessage(self.sent, text)
+        self.sent.append(reply)
+        return reply
+
+    async def edit_text(self, text: str, **_kwargs: Any) -> "FakeMessage":
+        self.text = text
+        return self
+
+
+def stream(deltas: list[str], limit: int = 4096) -> list[str]:
+    sent: list[FakeMessage] = []
+
+    async def run() -> None:
+        reply = StreamingReply(FakeMessage(sent), limit)  # type: ignore[arg-type]
+        await reply.start()
+        for delta in deltas:
+            await reply.append(delta)
+        await reply.finish()
+
+    asyncio.run(run())
+    return [message.text for message in sent]
+
+
+# A list item just under the limit, shown with a bullet once formatted
+ITEM = "- " + "word " * 818
+SHOWN_ITEM = "• " + ITEM[2:].rstrip()
+
+
+def test_streaming_hand_over_with_only_whitespace_after_the_break() -> None:
+    texts = stream([ITEM, "\n" + " " * 8])
+    assert texts == [SHOWN_ITEM]
+
+
+def test_streaming_continues_after_a_whitespace_tail() -> None:
+    texts = stream([ITEM, "\n" + " " * 8, "next part"])
+    assert len(texts) == 2
+    assert texts[0] == SHOWN_ITEM
+    assert texts[1] == "next part"
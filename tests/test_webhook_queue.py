@@ -0,0 +1,134 @@
+import asyncio
+from http import HTTPStatus
+from types import SimpleNamespace
+from typing import Any, Awaitable
+
+import pytest
+from telegram import Update
+
+from poe_tg import config
+from poe_tg.webhook_queue import WebhookUpdateQueue
+
+
+class FakeApplication:
+    """Records the updates the queue's workers process, each waiting for `release`."""
+
+    def __init__(self) -> None:
+        self.release = asyncio.Event()
+        self.processed: list[int] = []
+        self.update_processor = SimpleNamespace(process_update=self.run)
+
+    async def run(self, _update: Update, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def process_update(self, update: Update) -> None:
+        await self.release.wait()
+        self.processed.append(update.update_id)
+
+
+async def full_queue(overflow_policy: str) -> tuple[WebhookUpdateQueue, FakeApplication]:
+    """A queue of 2 with its one worker busy on update 1 and updates 2 and 3 waiting."""
+    application = FakeApplication()
+    queue = WebhookUpdateQueue(
+        application,  # type: ignore[arg-type]
+        maxsize=2,
+        workers=1,
+        overflow_policy=overflow_policy,
+    )
+    await queue.start()
+    assert queue.submit(Update(1))
+    await asyncio.sleep(0)
+    assert queue.submit(Update(2))
+    assert queue.submit(Update(3))
+    assert queue.depth == 2
+    return queue, application
+
+
+def test_reject_refuses_updates_while_full_so_telegram_retries_them(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    import main
+
+    async def test() -> None:
+        queue, application = await full_queue("reject")
+        assert not queue.submit(Update(4))
+
+        # The webhook route turns the refusal into a 503
+        monkeypatch.setattr(main, "webhook_queue", queue)
+        monkeypatch.setattr(config, "WEBHOOK_ASYNC_ACK", True)
+        monkeypatch.setattr(config, "WEBHOOK_SECRET", "")
+
+        async def json() -> dict:
+            return {"update_id": 5}
+
+        response = await main.process_update(SimpleNamespace(headers={}, json=json))
+        assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+
+        application.release.set()
+        await queue.stop(timeout=1)
+        assert application.processed == [1, 2, 3]
+        assert queue.stats()["rejected"] == 2
+        assert queue.stats()["dropped"] == 0
+
+    asyncio.run(test())
+
+
+def test_drop_oldest_makes_room_for_the_new_update() -> None:
+    async def test() -> None:
+        queue, application = await full_queue("drop_oldest")
+        assert queue.submit(Update(4))
+        assert queue.depth == 2
+
+        application.release.set()
+        await queue.stop(timeout=1)
+        assert application.processed == [1, 3, 4]
+        assert queue.stats()["dropped"] == 1
+        assert queue.stats()["rejected"] == 0
+
+    asyncio.run(test())
+
+
+def test_drop_newest_acknowledges_and_discards_the_new_update() -> None:
+    async def test() -> None:
+        queue, application = await full_queue("drop_newest")
+        assert queue.submit(Update(4))
+
+        application.release.set()
+        await queue.stop(timeout=1)
+        assert application.processed == [1, 2, 3]
+        assert queue.stats()["dropped"] == 1
+
+    asyncio.run(test())
+
+
+def test_stop_drains_queued_updates_then_refuses_new_ones() -> None:
+    async def test() -> None:
+        queue, application = await full_queue("reject")
+        stopping = asyncio.create_task(queue.stop(timeout=1))
+        await asyncio.sleep(0)
+        # Stopped queues refuse updates, which Telegram redelivers after a restart
+        assert not queue.submit(Update(4))
+
+        application.release.set()
+        await stopping
+        assert application.processed == [1, 2, 3]
+        assert queue.tasks == []
+        assert queue.stats()["processed"] == 3
+
+    asyncio.run(test())
+
+
+def test_stop_gives_up_on_updates_that_do_not_finish_in_time() -> None:
+    async def test() -> None:
+        queue, application = await full_queue("reject")
+        await queue.stop(timeout=0.01)
+
+        assert application.processed == []
+        assert queue.tasks == []
+
+    asyncio.run(test())
+
+
+def test_unknown_overflow_policy_is_refused() -> None:
+    with pytest.raises(ValueError, match="overflow policy"):
+        WebhookUpdateQueue(FakeApplication(), overflow_policy="drop_all")  # type: ignore[arg-type]